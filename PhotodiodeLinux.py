@@ -1,11 +1,9 @@
 import time
-import pyvisa as visa
 import datetime
 import os
 import sys
 import codecs
 import codecs
-import pandas as pd
 import serial
 import serial.tools.list_ports
 import numpy as np
@@ -13,8 +11,17 @@ import shutterapi as shutter
 import fwapi as fw
 import monochromatorapi as mcapi
 import port_utils as pt
-import command
-import clr # Import the .NET class library
+from port_utils import MCPort,FWPort,shutterport,picoasrl #port database aliases, resolved by the instrument registry
+import checkpoint as ckpt
+import instruments
+import scheduler as sched
+import latency
+import estimate
+import adaptive as adapt
+import queue
+import threading
+import lazy
+pd = lazy.module('pandas') #imported on first use
 
 """Comands for Keithley 6482 Picoammeter. Uses variables in command.py and port_utils.py."""
 
@@ -69,14 +76,10 @@ def picoammeter_initialize(Ch1ON=1,Ch2ON=1,interval=0.1,nsamples=50,asrl="asrl5:
                 print( "This program requires at least one measurement channel: "+str(Ch1ON+Ch2ON)+" selected" )
                 return
         try:
-                rm = visa.ResourceManager() #create PyVISA instrument session with 6482
-                picoa = rm.open_resource(asrl) #asrl# could change depending on the serial port used COM3 goes to asrl3::instr
+                picoa = instruments.visa_resource(asrl) #pooled PyVISA session with 6482 that records command latencies, asrl# could change depending on the serial port used COM3 goes to asrl3::instr
                 picoa.write_termination='\r' #ASCII command for enter key
                 picoa.read_termination='\r' #ASCII command for enter key
-                picoa.baud_rate = 9600 #communication between device and computer
-                picoa.data_bits = 8 #communication between device and computer
-                picoa.parity = visa.constants.Parity.none #communication between device and computer
-                picoa.flow_control = visa.constants.VI_ASRL_FLOW_NONE #communication between device and computer
+                #baud rate, data bits, parity and flow control are set when the session opens, see instruments.VISA_SETTINGS
                 # csvpath = os.getcwd( )+'\\' #we should change this to a user defined path. #in command.py 
                 '''Set up 6482 communications from the 6482 front panel: RS-232, 9600 Baud, 8 data bits, No parity, No Flow Control, CR terminator
                 USE < and > Edit keys and Enter key to select values. Menu -> Communication -> 
@@ -118,15 +121,17 @@ def picoammeter_initialize(Ch1ON=1,Ch2ON=1,interval=0.1,nsamples=50,asrl="asrl5:
                 return
         return(picoa)
 
-def picoammeter_end(picoa):
-        """Closes serial port after samples are collected.
+def picoammeter_end(picoa,close=False):
+        """Ends a measurement run. The pooled session stays open for the next run and is closed at exit.
         Inputs:
                 :picoa(string): rm.open_resource(asrl)
+                :close(boolean): close the serial port now
         Return:
                 ::Measurements complete message
                 ::Error if device is already closed or serial port could not be found""" 
         try: 
-                picoa.close()
+                if close:
+                        instruments.get_registry().visa(picoa.resource_name).close()
                 print("Measurements complete")
         except: 
                 print("Error! Device already closed or incorrect device specified")
@@ -226,6 +231,358 @@ def picoa_get_measurement_nosave(picoa,interval=0.1,nsamples=50):
                 print(msg)
                 return
 
+"""Fixed range control for the 6482 so sample timing does not depend on autorange settling"""
+
+PICOA_RANGES=[2e-9,2e-8,2e-7,2e-6,2e-5,2e-4,2e-3,2e-2] #A #fixed current ranges of the 6482 from the manual
+PICOA_OVERFLOW=9.9e37 #value the 6482 returns when the input overflows the selected range
+
+class PicoaRangeManager:
+    """Predicts the current at the next wavelength and locks each channel to a fixed range before sampling.
+    Prediction uses a reference lamp spectrum when one is given, otherwise it extrapolates the previous points.
+    A channel falls back to autorange only when a reading overflows or underflows the locked range.
+    Inputs:
+        :channels(list): picoammeter channels in use, 1 and/or 2
+        :llim(float): lowest current the channel may be ranged for in A, same as the autorange lower limit
+        :ulim(float): highest current the channel may be ranged for in A, same as the autorange upper limit
+        :headroom(float): factor between predicted current and full scale of the selected range
+        :underflow(float): fraction of full scale below which a reading is treated as underflow
+        :reference(string or DataFrame): lamp spectrum with columns wl, Ch1, Ch2 or a csv file of it"""
+    def __init__(self,channels=[1,2],llim=1e-7,ulim=1e-2,headroom=2.0,underflow=1e-3,reference=None):
+        self.channels=list(channels)
+        self.llim=llim
+        self.ulim=ulim
+        self.headroom=headroom
+        self.underflow=underflow
+        if isinstance(reference,str): #load reference spectrum from csv file
+            reference=pd.read_csv(reference)
+        if reference is not None:
+            reference=reference.sort_values('wl')
+        self.reference=reference
+        self.history={ch:[] for ch in self.channels} #(wavelength, mean current) of measured points per channel
+        self.ranges={ch:None for ch in self.channels} #locked range per channel, None when in autorange
+        self.fallbacks=0 #number of readings that needed autorange
+
+    def predict(self,channel,wl):
+        """Expected current on a channel at a wavelength.
+        Inputs:
+            :channel(integer): picoammeter channel
+            :wl(float): wavelength in nm
+        Returns:
+            ::predicted current in A, None if there is nothing to predict from"""
+        col=f'Ch{channel}'
+        if self.reference is not None and col in self.reference:
+            return float(np.interp(wl,self.reference['wl'],np.abs(self.reference[col])))
+        hist=self.history[channel]
+        if len(hist)==0:
+            return None
+        if len(hist)==1 or hist[-1][0]==hist[-2][0]:
+            return hist[-1][1]
+        (wl0,i0),(wl1,i1)=hist[-2],hist[-1]
+        if i0<=0 or i1<=0: #log extrapolation needs positive currents
+            return max(i1,0.0)
+        slope=(np.log(i1)-np.log(i0))/(wl1-wl0) #flux changes by decades so extrapolate in log current
+        return float(np.exp(np.log(i1)+slope*(wl-wl1)))
+
+    def select_range(self,current):
+        """Smallest fixed range holding the current with headroom, kept inside the autorange limits.
+        Inputs:
+            :current(float): expected current in A
+        Returns:
+            ::range in A"""
+        lowest=min(r for r in PICOA_RANGES if r>=self.llim)
+        highest=min(r for r in PICOA_RANGES if r>=self.ulim)
+        for rng in PICOA_RANGES:
+            if rng>=abs(current)*self.headroom:
+                return min(max(rng,lowest),highest)
+        return highest
+
+    def lock(self,picoa,channel,rng):
+        """Sets a fixed range on a channel. Skips the write if the channel is already locked to that range.
+        Inputs:
+            :picoa(string): rm.open_resource(asrl)
+            :channel(integer): picoammeter channel
+            :rng(float): range in A"""
+        if self.ranges[channel]==rng:
+            return
+        if self.ranges[channel] is None: #leave autorange before setting a fixed range
+            PICOA_Send(picoa,f':SENS{channel}:CURR:RANG:AUTO OFF')
+        PICOA_Send(picoa,f':SENS{channel}:CURR:RANG {rng}')
+        self.ranges[channel]=rng
+
+    def unlock(self,picoa,channel):
+        """Returns a channel to autorange.
+        Inputs:
+            :picoa(string): rm.open_resource(asrl)
+            :channel(integer): picoammeter channel"""
+        if self.ranges[channel] is None:
+            return
+        PICOA_Send(picoa,f':SENS{channel}:CURR:RANG:AUTO ON')
+        self.ranges[channel]=None
+
+    def apply(self,picoa,wl):
+        """Locks every channel to the range predicted for a wavelength. Channels with no prediction stay in autorange.
+        Inputs:
+            :picoa(string): rm.open_resource(asrl)
+            :wl(float): wavelength in nm of the next measurement"""
+        for ch in self.channels:
+            current=self.predict(ch,wl)
+            if current is None:
+                self.unlock(picoa,ch)
+            else:
+                self.lock(picoa,ch,self.select_range(current))
+
+    def apply_dark(self,picoa):
+        """Locks every channel to the lowest allowed range for dark measurements with the shutter closed.
+        Inputs:
+            :picoa(string): rm.open_resource(asrl)"""
+        for ch in self.channels:
+            self.lock(picoa,ch,self.select_range(self.llim/self.headroom))
+
+    def check(self,picoa,reading):
+        """Checks a reading against the locked ranges and puts any channel that overflowed or underflowed back to autorange.
+        Inputs:
+            :picoa(string): rm.open_resource(asrl)
+            :reading(list): currents in A in channel order
+        Returns:
+            ::True if the reading is valid, False if it has to be taken again"""
+        valid=True
+        for ch,val in zip(self.channels,reading):
+            rng=self.ranges[ch]
+            if rng is None:
+                continue
+            over=abs(val)>=PICOA_OVERFLOW or abs(val)>rng
+            under=abs(val)<rng*self.underflow and rng>self.select_range(self.llim/self.headroom)
+            if over or under:
+                self.unlock(picoa,ch)
+                self.fallbacks+=1
+                valid=False
+        return valid
+
+    def update(self,wl,data):
+        """Adds a measured point to the history used for prediction.
+        Inputs:
+            :wl(float): wavelength in nm
+            :data(DataFrame or list): picoammeter samples, one column per channel in self.channels order then Elapsed_time"""
+        samples=np.abs(np.asarray(data,dtype=float))
+        for col,ch in enumerate(self.channels): #columns follow the channel order, as in check
+            if col<samples.shape[1]-1: #last column is elapsed time
+                self.history[ch].append((wl,float(samples[:,col].mean())))
+
+class PicoaWriter:
+    """Writes picoammeter data to csv on a background thread so the next grating move can start while the last point is saved.
+    Completed measurements go through a bounded queue. When the queue is full the scan waits, which is counted as back-pressure.
+    Inputs:
+        :maxsize(integer): number of measurements that may wait to be written"""
+    def __init__(self,maxsize=16):
+        self.queue=queue.Queue(maxsize=maxsize)
+        self.written=0 #measurements saved to disk
+        self.blocked=0 #submits that had to wait for a free slot in the queue
+        self.blocked_time=0.0 #seconds the scan spent waiting on the queue
+        self.errors=[] #(filename, error) for writes that failed
+        self.thread=threading.Thread(target=self._run,daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item=self.queue.get()
+            if item is None: #sentinel from close
+                self.queue.task_done()
+                return
+            filename,rows,columns=item
+            try:
+                outdf=pd.DataFrame(rows,columns=columns)
+                outdf.to_csv(filename)
+                self.written+=1
+            except Exception as ex:
+                self.errors.append((filename,ex))
+                print(f"Error, could not save picoammeter data to {filename}. Error: {ex}")
+            self.queue.task_done()
+
+    def submit(self,filename,rows,columns=['Ch1','Ch2','Elapsed_time']):
+        """Queues a measurement to be saved. Waits only if the queue is full.
+        Inputs:
+            :filename(string): destination address for csv file
+            :rows(list): samples, one list per reading
+            :columns(list): column names for the csv file"""
+        try:
+            self.queue.put_nowait((filename,rows,columns))
+        except queue.Full:
+            self.blocked+=1
+            t0=time.perf_counter()
+            self.queue.put((filename,rows,columns))
+            self.blocked_time+=time.perf_counter()-t0
+
+    def flush(self):
+        """Waits until every queued measurement is on disk."""
+        self.queue.join()
+
+    def backpressure(self):
+        """State of the write queue.
+        Returns:
+            ::dictionary of pending, maxsize, written, blocked, blocked_time and errors"""
+        return {'pending':self.queue.qsize(),'maxsize':self.queue.maxsize,'written':self.written,
+                'blocked':self.blocked,'blocked_time':self.blocked_time,'errors':len(self.errors)}
+
+    def close(self):
+        """Flushes the queue and stops the writer thread."""
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+class DarkModel:
+    """Fits the picoammeter dark current against elapsed time, and a temperature proxy when one is given, from the darks taken so far.
+    Science points use the dark predicted by the fit. A new dark is only needed when the predicted uncertainty is over the threshold,
+    or after max_points points without one as the fixed dark counter did.
+    Only the channels behind the shutter are modelled, a monitor diode that sees the lamp with the shutter closed has no dark to model.
+    Inputs:
+        :channels(list): picoammeter channels in use, 1 and/or 2, in the order of the sample columns
+        :threshold(float): largest allowed uncertainty of a predicted dark in A
+        :min_darks(integer): measured darks needed before the model is used
+        :max_age(float): seconds after the last dark when a new one is taken regardless of the model
+        :dark_channels(list): channels behind the shutter, all channels in use if None
+        :max_points(integer): science points after the last dark when a new one is taken regardless of the model"""
+    def __init__(self,channels=[1,2],threshold=1e-12,min_darks=3,max_age=1800.0,dark_channels=None,max_points=10):
+        self.channels=list(channels)
+        self.dark_channels=[ch for ch in (self.channels if dark_channels is None else dark_channels) if ch in self.channels]
+        self.threshold=threshold
+        self.min_darks=min_darks
+        self.max_age=max_age
+        self.max_points=max_points
+        self.points_since=0 #science points since the last dark
+        self.times=[] #elapsed time of each dark in s
+        self.temperatures=[] #temperature proxy of each dark, None if not recorded
+        self.means={ch:[] for ch in self.dark_channels} #mean dark current per channel in A
+        self.sems={ch:[] for ch in self.dark_channels} #standard error of each dark mean in A
+
+    def add_dark(self,t,data,temperature=None):
+        """Adds a measured dark to the model.
+        Inputs:
+            :t(float): elapsed time of the dark in s
+            :data(DataFrame or list): picoammeter samples, one column per channel in self.channels order then Elapsed_time
+            :temperature(float): temperature proxy when the dark was taken
+        Returns:
+            ::True if the dark was added, False if the samples could not be used and the model is unchanged"""
+        if data is None: #measurement failed
+            print("Dark measurement failed, dark model not updated")
+            return False
+        try:
+            samples=np.asarray(data,dtype=float)
+        except (TypeError,ValueError):
+            samples=None
+        if samples is None or samples.ndim!=2 or len(samples)==0 or samples.shape[1]<len(self.channels):
+            print("Dark samples could not be read, dark model not updated")
+            return False
+        stats={} #checked for every channel before the model changes
+        for idx,ch in enumerate(self.channels):
+            if ch in self.dark_channels:
+                col=samples[:,idx]
+                stats[ch]=(float(col.mean()),float(col.std(ddof=1)/np.sqrt(len(col))) if len(col)>1 else 0.0)
+        self.times.append(float(t))
+        self.temperatures.append(temperature)
+        for ch,(mean,sem) in stats.items():
+            self.means[ch].append(mean)
+            self.sems[ch].append(sem)
+        self.points_since=0
+        return True
+
+    def _uses_temperature(self):
+        """True once there are enough darks and all of them have a temperature. Decided from the stored darks only so the
+        prediction row always has the columns of the fit."""
+        return len(self.times)>=4 and all(T is not None for T in self.temperatures)
+
+    def _design(self,times,temperatures):
+        """Columns of the fit: constant, elapsed time, and temperature once there are enough darks with temperatures.
+        A missing temperature is filled with the last one measured."""
+        n=len(self.times)
+        cols=[np.ones(len(times))]
+        if n>=3:
+            cols.append(np.asarray(times,dtype=float))
+        if self._uses_temperature():
+            cols.append(np.asarray([self.temperatures[-1] if T is None else T for T in temperatures],dtype=float))
+        return np.column_stack(cols)
+
+    def predict(self,t,temperature=None):
+        """Predicted dark current and its uncertainty on each channel.
+        Inputs:
+            :t(float): elapsed time in s
+            :temperature(float): temperature proxy
+        Returns:
+            ::dictionary of channel to (dark current in A, uncertainty in A), empty if there are no darks"""
+        if len(self.times)==0:
+            return {}
+        X=self._design(self.times,self.temperatures)
+        x=self._design([t],[temperature])[0]
+        n,p=X.shape
+        XtX_inv=np.linalg.pinv(X.T@X)
+        leverage=float(x@XtX_inv@x)
+        prediction={}
+        for ch in self.dark_channels:
+            y=np.asarray(self.means[ch])
+            coef=np.linalg.lstsq(X,y,rcond=None)[0]
+            noise=float(np.mean(np.square(self.sems[ch]))) #scatter expected from the dark samples alone
+            if n>p:
+                resid=y-X@coef
+                noise=max(noise,float(resid@resid)/(n-p)) #drift the model does not follow shows up in the residuals
+            prediction[ch]=(float(x@coef),float(np.sqrt(noise*leverage)))
+        return prediction
+
+    def needs_dark(self,t,temperature=None):
+        """Decides if a dark has to be measured before the next science point. Call once per science point, the points that
+        use the model are counted towards max_points.
+        Inputs:
+            :t(float): elapsed time in s
+            :temperature(float): temperature proxy
+        Returns:
+            ::True if a dark should be taken"""
+        if len(self.times)<self.min_darks or t-self.times[-1]>self.max_age or self.points_since>=self.max_points:
+            return True
+        if any(sigma>self.threshold for dark,sigma in self.predict(t,temperature).values()):
+            return True
+        self.points_since+=1
+        return False
+
+def picoa_get_measurement_ranged(picoa,filename,wl,range_manager,interval=0.1,nsamples=50,dark=False,writer=None):
+    """Saves data samples to csv file with the picoammeter locked to the range predicted for the wavelength.
+    Readings that overflow or underflow are taken again in autorange.
+    Inputs:
+        :picoa(string): rm.open_resource(asrl)
+        :filename(string): destination address for csv file
+        :wl(float): wavelength in nm
+        :range_manager(PicoaRangeManager): range predictor for the picoammeter
+        :interval(float): separation between samples
+        :nsamples(integer): number of samples taken
+        :dark(boolean): True if the shutter is closed, uses the lowest range and is not added to the prediction history
+        :writer(PicoaWriter): background writer for the csv file, saved before returning if None
+    Returns:
+        ::DataFrame of samples, list of sample rows when a writer is given
+        ::error message if measurement could not be taken"""
+    try:
+        if dark:
+            range_manager.apply_dark(picoa)
+        else:
+            range_manager.apply(picoa,wl)
+        StartTime = time.time() #current computer time
+        outlist=[]
+        while len(outlist)<nsamples:
+            rawout=PICOA_Request(picoa,':READ?').strip() #reading for each channel
+            reading=[float(s) for s in rawout.split(',')]
+            if not range_manager.check(picoa,reading): #out of range, read again in autorange
+                continue
+            outlist.append(reading+[time.time()-StartTime])
+        if not dark:
+            range_manager.update(wl,outlist)
+        if writer is not None: #DataFrame and csv are made on the writer thread
+            writer.submit(filename,outlist)
+            return outlist
+        outdf=pd.DataFrame(outlist)
+        outdf.columns=['Ch1','Ch2','Elapsed_time']
+        outdf.to_csv(filename)
+        return outdf
+    except Exception as ex:
+        msg =f"Error, could not take measurement with picoammeter. Error: {ex}"
+        print(msg)
+        return
+
 def picoa_set_folder(exp_folder,parent_diretory):
     """Create new folder to store the experiment files and subfiles.
         Inputs:
@@ -273,9 +630,22 @@ def savefile(Lamp,slitsize,start_wl,end_wl):
         print(msg)
         return 
 
-def MC_run_exp(): #move to different file? 
+RUN_SETTINGS=['Ch1ON','Ch2ON','interval','nsamples','start_wl','end_wl','wl_step','exp_directory','exp_filenames_basename','exp_filenames_basename_dark'] #module globals of MC_run_exp, set by command.py
+
+def MC_run_exp(range_reference=None,dark_threshold=1e-12,temperature=None,checkpoint=None,adaptive=None,dry_run=False,dark_channels=[1],settings=None): #move to different file? 
     """Runs experiment.
     Inputs:
+        :range_reference(string or DataFrame): reference lamp spectrum for picoammeter range prediction, previous points are used if None
+        :dark_threshold(float): largest allowed uncertainty in A of a modelled dark before a new dark is measured
+        :temperature(function): returns a temperature proxy for the dark model, time only if None
+        :checkpoint(ScanCheckpoint): checkpoint to resume from, see checkpoint.resume. A new scan writes <basename>_checkpoint.json in the experiment directory
+        :adaptive(AdaptiveSampler or dictionary): refine the wl_step grid where interpolation between points is off by more than its tolerance,
+            see adaptive.py. A dictionary holds the AdaptiveSampler inputs
+        :dry_run(boolean): print and return the time estimate of the scan from estimate.py without touching the devices, an adaptive scan
+            with every refinement pass its budget and min_step allow
+        :dark_channels(list): picoammeter channels behind the shutter that the dark model follows, Ch2 is the monitor diode
+        :settings(dictionary): values of the RUN_SETTINGS globals below, taken from the module when None. Saved in the checkpoint
+            so a resume in a new session writes to the same files with the same picoammeter settings
         :Ch1ON(string): 1 = on, 0 = off
         :Ch2ON(string): 1 = on, 0 = off
         :interval(float): time between measurements in s
@@ -293,58 +663,174 @@ def MC_run_exp(): #move to different file?
         ::pre dark frames taken
         ::filenames experiment data will be stored in
         ::picoammeter measurements taken
-        ::dark frames taken
+        ::dark frames taken when the dark model uncertainty is over the threshold
+        ::dark log csv with the dark source of every point
+        ::checkpoint saved after every point
+        ::refinement passes of an adaptive scan, each in increasing wavelength
         ::movement messages
         ::filter change confimation following the filter table
+        ::duration and critical path of every point, the next move overlaps the shutter close and the data writer
         ::post dark froms taken
         ::exit picoammeter
         ::files saved in their directories
         ::monochromator homing after experiment is complete
-        ::error message if scan run is interrupted or issue occurs"""
+        ::command latency table saved as <basename>_latency.csv
+        ::error message if scan run is interrupted or issue occurs
+        ::Estimate of the scan if dry_run"""
+    if settings is None:
+        settings = {name:globals().get(name) for name in RUN_SETTINGS}
+    Ch1ON,Ch2ON,interval,nsamples,start_wl,end_wl,wl_step,exp_directory,exp_filenames_basename,exp_filenames_basename_dark = [settings[name] for name in RUN_SETTINGS]
+    if dry_run: #walks the plan only
+        est = estimate.photodiode_scan(start_wl,end_wl,wl_step,nsamples=nsamples,adaptive=adaptive) #refinement passes at the worst case of the budget
+        est.report()
+        return est
+    if isinstance(adaptive,dict): #settings saved in the checkpoint of a resumed scan
+        adaptive = adapt.AdaptiveSampler(**adaptive)
+    writer = None
+    scheduler = None
     try:
+        latency.recorder.reset() #command latencies of this run only
         picoa = picoammeter_initialize(Ch1ON,Ch2ON,interval,nsamples,picoasrl,debug=False) #intiallize picoammeter with the settings. 
-        mcapi.go_to_fromhome(MCPort,start_wl) #scan to start wavelength
-        current_wl = start_wl #begins current wavelength check at first wavelength
+        channels=[ch for ch,on in [(1,Ch1ON),(2,Ch2ON)] if on]
+        picoa_ranges = PicoaRangeManager(channels,reference=range_reference) #lock ranges per wavelength instead of autoranging every reading
+        writer = PicoaWriter() #saves data while the grating moves to the next wavelength
+        if checkpoint is None:
+            wavelengths = [] #same stepping as the scan loop so file names match
+            wl = start_wl
+            while wl <= end_wl:
+                wavelengths.append(wl)
+                wl = wl+wl_step
+            plan = {'range_reference':range_reference if isinstance(range_reference,str) else None,'dark_threshold':dark_threshold,'dark_channels':dark_channels,
+                    'adaptive':adaptive.settings() if adaptive is not None else None,'settings':settings}
+            checkpoint = ckpt.ScanCheckpoint(os.path.join(exp_directory, exp_filenames_basename+'_checkpoint.json'),'MC_run_exp',plan,
+                                             [[fw.which_filter(wl),wl] for wl in wavelengths])
+            checkpoint.save()
+            first = 0
+            ckpt.home_to(MCPort,checkpoint,start_wl) #scan to start wavelength, step count saved for a resume
+        else:
+            first = checkpoint.next_index()
+            ckpt.resume_position(MCPort,checkpoint,checkpoint.points[first][1]) #skip homing if the grating is where the checkpoint left it
+        points = checkpoint.points
+        current_wl = points[first][1] #begins current wavelength check at first wavelength
         select_filter = fw.which_filter(current_wl) #print which filter is for start wavelength
         filternum = fw.get_fw_position(FWPort) #which filter is currently used
         time.sleep(3) #pause for three seconds to give system time before filter change. used in testing
         if filternum != select_filter: 
             filternum = fw.set_fw_to_position(select_filter,FWPort) #move filter if not used for start wavelength
         shutter.shutclose(shutterport) #close shutter
+        dark_model = DarkModel(channels,threshold=dark_threshold,dark_channels=dark_channels) #darks are modelled and only taken when the model is uncertain
+        dark_log = list(checkpoint.records) #dark source for every point
+        if adaptive is not None:
+            for record in dark_log: #signal of the points measured before a resume
+                if record.get('signal') is not None:
+                    adaptive.add(record['wl'],record['signal'])
+        t_start = time.time()
+        def read_temperature():
+            return temperature() if temperature is not None else None
+        def take_dark(dark_filename):
+            t = time.time()-t_start
+            T = read_temperature()
+            data = picoa_get_measurement_ranged(picoa,dark_filename,current_wl,picoa_ranges,interval,nsamples,dark=True,writer=writer)
+            if not dark_model.add_dark(t,data,T): #a failed read is skipped, the point uses the model
+                return None
+            return data
         print("Taking pre dark")
-        filename = exp_filenames_basename_dark+'_pre.csv' #save file for pre darks
+        filename = exp_filenames_basename_dark+('_pre.csv' if first == 0 else f'_pre_resume_{first}.csv') #save file for pre darks
         dark_filename = os.path.join(exp_directory, filename) #sets dark data file save name for pre dark
-        data = picoa_get_measurement(picoa,dark_filename,interval,nsamples) #take picoammeter reading for pre dark
-        counter = int(1)
-        while current_wl <= end_wl: #until the end of list of wavelengths
-            counter = counter+int(1) #counter to take dark for every 10 lamp exposures 
+        data = take_dark(dark_filename) #take picoammeter reading for pre dark
+        scheduler = sched.StepScheduler() #runs the steps of each point as soon as the steps they wait for are done
+        position = current_wl
+        def point_indices(): #an adaptive scan adds a refinement pass once the points before it are measured
+            nonlocal filternum, position
+            idx = first
+            while idx < len(points):
+                yield idx
+                idx += 1
+                if idx == len(points) and adaptive is not None:
+                    new_wls = adaptive.next_pass()
+                    if not new_wls:
+                        break
+                    print(f"Refinement pass {adaptive.passes}: {len(new_wls)} points from {new_wls[0]} to {new_wls[-1]} nm")
+                    points.extend([[fw.which_filter(wl),wl] for wl in new_wls])
+                    checkpoint.save()
+                    for wl in adaptive.approach(position,new_wls[0]): #back down below the first point, then up to it
+                        mcapi.go_to_from(MCPort,position,wl)
+                        position = wl
+                    select_filter = fw.which_filter(new_wls[0])
+                    if filternum != select_filter:
+                        filternum = fw.set_fw_to_position(select_filter,FWPort)
+        measured = {} #samples of the last point for the adaptive sampler
+        for idx in point_indices(): #until the end of list of wavelengths
+            if checkpoint.is_done(idx):
+                continue
+            current_wl = points[idx][1]
+            t = time.time()-t_start
+            T = read_temperature()
+            steps = []
+            if dark_model.needs_dark(t,T): #shutter is still closed from the last point
+                print("Taking wl dark")
+                filename = exp_filenames_basename_dark+f'_Filter_{filternum}'+f'_wl_{current_wl}nm'+'.csv' #save file for darks
+                dark_filename = os.path.join(exp_directory, filename) #sets dark data file save name
+                steps.append(sched.Step('dark',lambda fn=dark_filename: take_dark(fn))) #take picoammeter reading for dark
+                dark_source = dark_filename
+            else:
+                dark_source = 'model'
             filename = exp_filenames_basename+f'_Filter_{filternum}'+f'_wl_{current_wl}nm'+'.csv' #add filter used and wavelength for picoammeter data taken
             filename = os.path.join(exp_directory, filename) #save file in directory for late use
             print(f"Taking data for {current_wl}")
-            shutter.shutopen(shutterport) #open shutter
-            data = picoa_get_measurement(picoa,filename,interval,nsamples) #take science image and save data
-            shutter.shutclose(shutterport)#close shutter
-            if counter == int(10): #taking dark for every 10 lamp exposures 
-                counter = int(1) #begin counter for number of exposures
-                filename = exp_filenames_basename_dark+f'_Filter_{filternum}'+f'_wl_{current_wl}nm'+'.csv' #save file for darks
-                dark_filename = os.path.join(exp_directory, filename) #sets dark data file save name
-                data = picoa_get_measurement(picoa,dark_filename,interval,nsamples)#take picoammeter reading for dark
-                print("Taking wl dark")
-            print(f"Going to {current_wl+wl_step} nm") 
-            mcapi.go_to_from(MCPort,current_wl,float(current_wl+wl_step)) #movement to next wavelength
-            current_wl = current_wl+wl_step #increments current wavelength to next wavelength in list
-            select_filter = fw.which_filter(current_wl) #checks if filter is correct for wavelength based on filter wheel map file
-            if filternum != select_filter: #check if filter wheel needs to change position for wavelength
-                filternum = fw.set_fw_to_position(select_filter,FWPort) #change position
-            print("Taking post dark")
-            filename = exp_filenames_basename_dark+f'_Filter_{filternum}'+'_post.csv' #save file for post dark
-            dark_filename = os.path.join(exp_directory, filename) #sets post dark data file name
-            data = picoa_get_measurement(picoa,dark_filename,interval,nsamples) #takes picoameter reading for post dark
-            picoammeter_end(picoa) #close picoameter serial connection
-            print(f"All data taken and stored in {exp_directory}")
-            print("Monochromator is going home!")
-            mcapi.home(MCPort) #home at end of experiment
+            def measure(fn=filename,wl=current_wl):
+                t = time.time()-t_start
+                measured['data'] = picoa_get_measurement_ranged(picoa,fn,wl,picoa_ranges,interval,nsamples,writer=writer) #take science image, saved by the writer thread
+                return t
+            steps.append(sched.Step('shutter open',lambda: shutter.shutopen(shutterport),after=['dark' if dark_source != 'model' else None])) #open shutter
+            steps.append(sched.Step('measure',measure,after=['shutter open']))
+            steps.append(sched.Step('shutter close',lambda: shutter.shutclose(shutterport),after=['measure'])) #close shutter
+            steps.append(sched.Step('flush',writer.flush,after=['measure'])) #point is only marked done once its data is on disk
+            position = current_wl
+            if idx+1 < len(points): #grating and filter wheel move while the shutter closes and the writer saves the last point
+                next_wl = points[idx+1][1]
+                print(f"Going to {next_wl} nm") 
+                steps.append(sched.Step('move',lambda wl=current_wl,nwl=next_wl: mcapi.go_to_from(MCPort,wl,float(nwl)),after=['measure'])) #movement to next wavelength
+                position = next_wl
+                select_filter = fw.which_filter(next_wl) #checks if filter is correct for wavelength based on filter wheel map file
+                if filternum != select_filter: #check if filter wheel needs to change position for wavelength
+                    steps.append(sched.Step('filter',lambda f=select_filter: fw.set_fw_to_position(f,FWPort),after=['measure'])) #change position
+            report = scheduler.run(steps,label=f"{current_wl} nm")
+            if dark_source != 'model' and report.results.get('dark') is None: #dark read failed
+                dark_source = 'model'
+            dark_row = {'wl':current_wl,'filternum':filternum,'filename':filename,'dark_source':dark_source,'time':report.results['measure']}
+            for ch,(dark,sigma) in dark_model.predict(report.results['measure'],read_temperature()).items():
+                dark_row[f'Ch{ch}_dark'] = dark
+                dark_row[f'Ch{ch}_dark_sigma'] = sigma
+            if adaptive is not None and measured.get('data') is not None:
+                dark_row['signal'] = adapt.signal_of(measured['data'],0,dark_row.get(f'Ch{channels[0]}_dark') or 0.0) #first channel on
+                adaptive.add(current_wl,dark_row['signal'])
+            dark_log.append(dark_row)
+            if 'filter' in report.results:
+                filternum = report.results['filter']
+            checkpoint.point_done(idx,position,filternum,files=[fn for fn in (filename,dark_source) if fn != 'model'],record=dark_row)
+        print("Taking post dark")
+        filename = exp_filenames_basename_dark+f'_Filter_{filternum}'+'_post.csv' #save file for post dark
+        dark_filename = os.path.join(exp_directory, filename) #sets post dark data file name
+        data = take_dark(dark_filename) #takes picoameter reading for post dark
+        dark_log_df = pd.DataFrame(dark_log)
+        dark_log_df.to_csv(os.path.join(exp_directory, exp_filenames_basename+'_dark_log.csv')) #dark source and modelled dark for every point
+        print(f"{len(dark_model.times)} darks measured for {len(dark_log)} points")
+        picoammeter_end(picoa) #close picoameter serial connection
+        writer.flush() #wait for queued data to reach the disk
+        print(f"All data taken and stored in {exp_directory}")
+        print("Monochromator is going home!")
+        mcapi.home(MCPort) #home at end of experiment
+        latency.recorder.to_csv(os.path.join(exp_directory, exp_filenames_basename+'_latency.csv')) #time spent in each serial and VISA command
+        latency.recorder.print_table()
     except Exception as ex:
         msg = f"Error, could not establish communication, check serial connection Error: {ex}"
         print(msg)
-        return
\ No newline at end of file
+        return
+    finally: #points already queued are saved even when the scan stops early
+        if scheduler is not None:
+            scheduler.close()
+            print(f"Step scheduler: {scheduler.summary()}")
+        if writer is not None:
+            writer.close()
+            print(f"Data writer: {writer.backpressure()}")
\ No newline at end of file
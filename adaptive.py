@@ -0,0 +1,99 @@
+import numpy as np
+
+"""Adaptive wavelength sampling for MC_run_exp. A scan starts on the coarse wl_step grid, then each refinement pass adds the midpoints of the
+intervals where straight-line interpolation between the measured points is off by more than a tolerance, until no interval is or the point
+budget is used. Each pass is measured in increasing wavelength so the grating always approaches a point from below."""
+
+LOWER_LIMIT=100.1 #nm #go_to_from does not move to 100 nm or below
+
+class AdaptiveSampler:
+    """Chooses the refinement points of a scan from the signal measured so far.
+    The interpolation error of an interval is estimated at its midpoint as the difference between the line through its ends and the
+    parabolas through its ends and the next point on either side.
+    Inputs:
+        :tol(float): largest allowed interpolation error as a fraction of the signal, keep it above the relative noise of a point's mean
+        :budget(integer): most points of the whole scan, coarse grid included, no limit if None
+        :min_step(float): narrowest interval in nm, intervals under 2*min_step are not split
+        :floor(float): signal in A under which errors are compared to floor instead, 1e-3 of the largest signal if None
+        :overshoot(float): nm below the first point of a pass the grating goes to before moving up to it, as the backlash removal of mcapi.home"""
+    def __init__(self,tol=0.02,budget=None,min_step=0.5,floor=None,overshoot=8.0):
+        self.tol=tol
+        self.budget=budget
+        self.min_step=min_step
+        self.floor=floor
+        self.overshoot=overshoot
+        self.signal={} #wavelength to measured signal
+        self.passes=0
+
+    def settings(self):
+        """Inputs of the sampler, saved in the scan checkpoint."""
+        return {'tol':self.tol,'budget':self.budget,'min_step':self.min_step,'floor':self.floor,'overshoot':self.overshoot}
+
+    def add(self,wl,signal):
+        """Records the dark subtracted signal of a point.
+        Inputs:
+            :wl(float): wavelength in nm
+            :signal(float): signal in A"""
+        self.signal[float(wl)]=float(signal)
+
+    def errors(self):
+        """Estimated interpolation error of each interval between measured points, relative to the signal.
+        Returns:
+            ::list of (relative error, lower wavelength, upper wavelength)"""
+        wls=np.array(sorted(self.signal))
+        if len(wls)<3:
+            return []
+        y=np.array([self.signal[wl] for wl in wls])
+        floor=self.floor if self.floor is not None else 1e-3*np.max(np.abs(y))
+        out=[]
+        for i in range(len(wls)-1):
+            x0,x1=wls[i],wls[i+1]
+            mid=(x0+x1)/2
+            line=(y[i]+y[i+1])/2
+            err=0.0
+            for j in (i-1,i+2): #parabola with the neighbour on each side
+                if 0<=j<len(wls):
+                    idx=sorted((i,i+1,j))
+                    err=max(err,abs(np.polyval(np.polyfit(wls[idx]-mid,y[idx],2),0.0)-line))
+            out.append((err/max(abs(line),floor),x0,x1))
+        return out
+
+    def next_pass(self):
+        """Wavelengths of the next refinement pass, worst intervals first when the budget runs short.
+        Returns:
+            ::increasing list of wavelengths, empty when the scan is done"""
+        candidates=[(err,x0,x1) for err,x0,x1 in self.errors() if err>self.tol and x1-x0>=2*self.min_step]
+        candidates.sort(reverse=True)
+        if self.budget is not None:
+            candidates=candidates[:max(self.budget-len(self.signal),0)]
+        if candidates:
+            self.passes+=1
+        return sorted(float(round((x0+x1)/2,4)) for err,x0,x1 in candidates)
+
+    def approach(self,position,wl):
+        """Moves to a point of a new pass so the grating arrives moving up.
+        Inputs:
+            :position(float): grating wavelength in nm
+            :wl(float): first point of the pass in nm
+        Returns:
+            ::list of wavelengths to go to in order, the last one wl"""
+        below=max(wl-self.overshoot,LOWER_LIMIT)
+        if wl>=position or below>=wl:
+            return [wl]
+        return [below,wl]
+
+    def interpolate(self,wls):
+        """Signal at any wavelengths from the measured points, for comparing with a uniform scan."""
+        known=sorted(self.signal)
+        return np.interp(wls,known,[self.signal[wl] for wl in known])
+
+def signal_of(data,column=0,dark=0.0):
+    """Mean of one channel of picoammeter samples with the dark subtracted.
+    Inputs:
+        :data(list or DataFrame): picoammeter samples, one column per channel that is on, then Elapsed_time
+        :column(integer): column of the channel, 0 for the first channel that is on
+        :dark(float): dark current in A
+    Returns:
+        ::signal in A"""
+    values=np.asarray(data,dtype=float)[:,column]
+    return float(np.mean(values))-dark
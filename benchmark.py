@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+import device_sim
+import camserver_sim
+import latency
+
+"""Throughput benchmarks of the experiment functions against the simulated bench in device_sim.py and camserver_sim.py.
+Each workload reports points per hour, dead-time fraction and the time of each phase in bench seconds, and the results are saved as JSON
+so runs from different commits can be compared with compare().
+
+The simulated devices run 1/time_scale times faster than real ones. Time spent waiting on a device is scaled back up by 1/time_scale,
+time the computer spends working (thread CPU time) is counted as is, so the per point Python overhead is not inflated. Waits between threads
+of this process are scaled up too, so phases that overlap with others read up to a few ms/time_scale long."""
+
+LIVE_PHASES=('sample','exposure') #phases that collect light, everything else is dead time
+
+class PhaseTimer:
+    """Times calls of the experiment's device functions by phase. Time in a call nested inside another timed call counts for the inner phase only.
+    Inputs:
+        :time_scale(float): computer seconds per device second"""
+    def __init__(self,time_scale):
+        self.time_scale=time_scale
+        self.phases={}
+        self.calls={}
+        self.local=threading.local()
+        self.lock=threading.Lock()
+        self.patched=[]
+
+    def bench_time(self,wall,cpu):
+        """Bench seconds of wall s of computer time of which cpu s were spent computing."""
+        return max(wall-cpu,0)/self.time_scale+cpu
+
+    def wrap(self,owner,name,phase):
+        """Replaces owner.name with a timed version. phase is a string, or a function of the call arguments returning one."""
+        func=getattr(owner,name)
+        timer=self
+        def timed(*args,**kwargs):
+            stack=getattr(timer.local,'stack',None)
+            if stack is None:
+                stack=timer.local.stack=[]
+            label=phase(*args,**kwargs) if callable(phase) else phase
+            stack.append(0.0) #bench time of nested calls
+            wall,cpu=time.perf_counter(),time.thread_time()
+            try:
+                return func(*args,**kwargs)
+            finally:
+                elapsed=timer.bench_time(time.perf_counter()-wall,time.thread_time()-cpu)
+                nested=stack.pop()
+                if stack:
+                    stack[-1]+=elapsed
+                with timer.lock:
+                    timer.phases[label]=timer.phases.get(label,0.0)+elapsed-nested
+                    timer.calls[label]=timer.calls.get(label,0)+1
+        self.patched.append((owner,name,func))
+        setattr(owner,name,timed)
+
+    def restore(self):
+        for owner,name,func in reversed(self.patched):
+            setattr(owner,name,func)
+        self.patched=[]
+
+def timed_phases(timer):
+    """Wraps the device functions the experiments call."""
+    import monochromatorapi as mcapi
+    import fwapi as fw
+    import shutterapi as shutter
+    import PhotodiodeLinux as mclinux
+    import nuvu
+    timer.wrap(mcapi,'home','home')
+    timer.wrap(mcapi,'go_to_from','move')
+    timer.wrap(mcapi,'go_to_fromhome','move')
+    timer.wrap(fw,'set_fw_to_position','filter')
+    timer.wrap(fw,'get_fw_position','filter')
+    timer.wrap(shutter,'shutopen','shutter')
+    timer.wrap(shutter,'shutclose','shutter')
+    timer.wrap(mclinux,'picoammeter_initialize','setup')
+    timer.wrap(mclinux,'picoa_get_measurement_ranged',lambda *args,**kwargs:'dark' if kwargs.get('dark') else 'sample')
+    timer.wrap(nuvu.NuvuCamera,'bias','bias')
+    timer.wrap(nuvu.NuvuCamera,'dark','camera dark')
+    timer.wrap(nuvu.NuvuCamera,'expose','exposure')
+
+def photodiode_scan(start_wl,end_wl,wl_step,edges=(240,350,500,605,700),nsamples=50,adaptive=None):
+    """Workload running PhotodiodeLinux.MC_run_exp over a wavelength range, adaptive is a dictionary of AdaptiveSampler inputs."""
+    def run(sim,workdir):
+        import PhotodiodeLinux as mclinux
+        import fwapi as fw
+        import checkpoint as ckpt
+        fw.update_filter_change_map(list(edges))
+        sim.picoa.edges=list(edges)
+        exp_directory=os.path.join(workdir,'photodiode')
+        os.makedirs(exp_directory,exist_ok=True)
+        settings={'Ch1ON':1,'Ch2ON':1,'interval':0.1,'nsamples':nsamples,'picoasrl':'PicoPort','MCPort':'MCPort','FWPort':'FWPort',
+                  'shutterport':'ShutPort','start_wl':start_wl,'end_wl':end_wl,'wl_step':wl_step,'exp_directory':exp_directory,
+                  'exp_filenames_basename':'bench','exp_filenames_basename_dark':'bench_dark'} #globals MC_run_exp reads, set by command.py on the bench
+        for name,value in settings.items():
+            setattr(mclinux,name,value)
+        mclinux.MC_run_exp(adaptive=adaptive)
+        return len(ckpt.load_checkpoint(os.path.join(exp_directory,'bench_checkpoint.json')).completed)
+    return run
+
+def camera_workload(kind,**options):
+    """Workload running qe.get_qe_data or ptc.run_ptc against the camserver stand-in."""
+    def run(sim,workdir):
+        import nuvu
+        import fwapi as fw
+        fw.update_filter_change_map()
+        data_dir=os.path.join(workdir,kind)+'/'
+        server=camserver_sim.start_camserver_sim(path=data_dir,time_scale=sim.time_scale)
+        camera=nuvu.NuvuCamera(cam_comm=camserver_sim.cam_comm(server)) #cam_cit command line, the default camera path
+        try:
+            if kind=='qe':
+                import qe as module
+                module.picoasrl,module.MCPort='PicoPort','MCPort'
+            else:
+                import ptc as module
+            module.FWPort='FWPort'
+            module.input=lambda prompt='':'Y' #confirms the data directory
+            try:
+                if kind=='qe':
+                    module.get_qe_data(camera=camera,**options)
+                else:
+                    module.run_ptc(camera=camera,**options)
+            finally:
+                del module.input
+        finally:
+            camera.close()
+            camserver_sim.stop_camserver_sim(server)
+        frames=[json.loads(line) for line in open(data_dir+('scan_log.jsonl' if kind=='qe' else 'ptc_log.jsonl'))]
+        return sum(1 for frame in frames if frame.get('imtype') in ('Exposure','Flat'))
+    return run
+
+def home_workload(sim,workdir):
+    import monochromatorapi as mcapi
+    mcapi.home('MCPort')
+    return 1
+
+WORKLOADS={'home':(home_workload,home_workload,{'wl':400.0}),
+           'photodiode_scan':(photodiode_scan(100,700,1),photodiode_scan(100,700,25),{}),
+           'adaptive_scan':(photodiode_scan(110,690,10,adaptive={'tol':0.05,'min_step':1}),photodiode_scan(110,690,40,adaptive={'tol':0.05,'min_step':5}),{}),
+           'filter_scan':(photodiode_scan(101,160,1,edges=(110,120,130,140,700)),photodiode_scan(101,160,5,edges=(110,120,130,140,700)),{}),
+           'qe_scan':(camera_workload('qe',wl_min=400,wl_max=500,exp_time=1,step=5,flist=[1,2]),camera_workload('qe',wl_min=400,wl_max=420,exp_time=1,step=10,flist=[1,2]),{}),
+           'ptc_ladder':(camera_workload('ptc',wl=500,filtnum=3),camera_workload('ptc',wl=500,filtnum=3),{})} #full run, quick run, DeviceSim options
+
+def git_commit():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],capture_output=True,text=True,cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_workload(name,time_scale=0.01,quick=False,verbose=False):
+    """Runs one workload on a fresh simulated bench in a temporary directory.
+    Inputs:
+        :name(string): key of WORKLOADS
+        :time_scale(float): computer seconds per device second
+        :quick(boolean): run the short version of the workload
+        :verbose(boolean): show the experiment's printed output
+    Returns:
+        ::dictionary of points, points_per_hour, dead_time_fraction, bench_s, wall_s, cpu_s, phases and devices"""
+    full,short,options=WORKLOADS[name]
+    workload=short if quick else full
+    cwd=os.getcwd()
+    timer=PhaseTimer(time_scale)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir) #port cache and filter change map are written to the working directory
+        try:
+            with device_sim.DeviceSim(time_scale=time_scale,**options) as sim:
+                timed_phases(timer)
+                latency.recorder.reset()
+                out=sys.stdout if verbose else open(os.devnull,'w')
+                try:
+                    with contextlib.redirect_stdout(out):
+                        wall,cpu=time.perf_counter(),time.process_time()
+                        points=workload(sim,workdir)
+                        wall,cpu=time.perf_counter()-wall,time.process_time()-cpu
+                finally:
+                    timer.restore()
+                    if out is not sys.stdout:
+                        out.close()
+                counts=sim.counts()
+        finally:
+            os.chdir(cwd)
+    bench=timer.bench_time(wall,cpu)
+    live=sum(timer.phases.get(phase,0.0) for phase in LIVE_PHASES)
+    phases={phase:round(seconds,3) for phase,seconds in sorted(timer.phases.items(),key=lambda item:-item[1])}
+    phases['other']=round(bench-sum(timer.phases.values()),3) #negative when phases ran at the same time
+    return {'points':points,'points_per_hour':round(3600*points/bench,2) if bench else None,
+            'dead_time_fraction':round(1-live/bench,4) if bench else None,'bench_s':round(bench,3),'wall_s':round(wall,3),'cpu_s':round(cpu,3),
+            'phases':phases,'calls':timer.calls,'devices':counts,'commands':sum(row['count'] for row in latency.recorder.table())}
+
+def run_benchmarks(names=None,filename='benchmark.json',time_scale=0.01,quick=False,verbose=False):
+    """Runs the workloads and saves the results.
+    Inputs:
+        :names(list): workloads to run, all if None
+        :filename(string): JSON file for the results, not saved if None
+        :time_scale(float): computer seconds per device second
+        :quick(boolean): run the short versions of the workloads
+        :verbose(boolean): show the experiment's printed output
+    Returns:
+        ::dictionary of run information and results per workload"""
+    results={'commit':git_commit(),'date':time.strftime('%Y-%m-%d %H:%M:%S'),'python':platform.python_version(),
+             'time_scale':time_scale,'quick':quick,'workloads':{}}
+    for name in names or list(WORKLOADS):
+        print(f"Running {name}")
+        try:
+            result=run_workload(name,time_scale,quick,verbose)
+        except Exception as ex:
+            result={'error':str(ex)}
+            print(f"Benchmark {name} failed. Error: {ex}")
+        results['workloads'][name]=result
+        if 'error' not in result:
+            print(f"{name}: {result['points']} points, {result['points_per_hour']} points/hour, dead time {result['dead_time_fraction']:.1%}, {result['bench_s']/3600:.2f} bench hours in {result['wall_s']:.1f} s")
+    if filename is not None:
+        with open(filename,'w') as fp:
+            json.dump(results,fp,indent=1)
+        print(f"Results saved in {filename}")
+    return results
+
+def compare(before,after):
+    """Prints the change in points per hour and dead time between two result files.
+    Inputs:
+        :before(string): JSON file of the earlier run
+        :after(string): JSON file of the later run"""
+    with open(before) as fp:
+        old=json.load(fp)
+    with open(after) as fp:
+        new=json.load(fp)
+    print(f"{'workload':<16} {'points/hour':>24} {'change':>8} {'dead time':>18}")
+    for name,result in new['workloads'].items():
+        previous=old['workloads'].get(name)
+        if not previous or 'error' in previous or 'error' in result:
+            continue
+        change=result['points_per_hour']/previous['points_per_hour']-1 if previous['points_per_hour'] else float('nan')
+        print(f"{name:<16} {previous['points_per_hour']:>11} > {result['points_per_hour']:<10} {change:>+8.1%} {previous['dead_time_fraction']:>8.1%} > {result['dead_time_fraction']:<8.1%}")
+
+if __name__=='__main__':
+    run_benchmarks(quick='--quick' in sys.argv)
@@ -0,0 +1,119 @@
+import socketserver
+import threading
+import socket
+import shlex
+import time
+import sys
+import os
+
+"""Local stand-in for the NUVU camserver_cit, so camera code can run off the bench. Running this file is a stand-in cam_cit,
+either for one command on its command line as the old nuvu functions ran it, or for command lines read from its input as
+nuvu.NuvuCamera runs it, see cam_comm(server). Every command gets one reply line."""
+
+class CamserverState:
+    """Camera state kept by the stand-in server.
+    Inputs:
+        :path(string): data directory reported to clients
+        :imno(integer): image number of the next frame
+        :time_scale(float): fraction of the exposure time to sleep for each frame, 0 returns at once"""
+    def __init__(self,path='/tmp/nuvu_sim/',imno=1,time_scale=0.0):
+        self.path=path
+        self.imno=imno
+        self.time_scale=time_scale
+        self.settings={'burst':'1','exptime':'0.0'}
+        self.commands=[] #every command received, for checking what a client sent
+        self.lock=threading.Lock()
+
+    def run(self,line):
+        """Runs one command line and returns the reply line: the value of a setting, imno or path, or the first image number of an action."""
+        parts=line.replace('=',' ').split()
+        if not parts:
+            return 'empty command'
+        name,args=parts[0],parts[1:]
+        with self.lock:
+            self.commands.append(line)
+            if name in self.settings:
+                if args:
+                    self.settings[name]=args[0]
+                return self.settings[name]
+            if name=='imno':
+                return str(self.imno)
+            if name=='path':
+                return self.path
+            if name in ('bias','dark','expose'):
+                burst=int(self.settings['burst'])
+                exptime=0.0 if name=='bias' else float(self.settings['exptime'])
+                first=self.imno
+                self.imno+=burst
+            else:
+                return f'unknown command {name}'
+        time.sleep(exptime*burst*self.time_scale) #exposure runs outside the lock like a real readout
+        return str(first)
+
+class CamserverHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw in self.rfile:
+            reply=self.server.state.run(raw.decode('ascii').strip())
+            self.wfile.write((reply+'\n').encode('ascii'))
+
+class CamserverSim(socketserver.ThreadingTCPServer):
+    allow_reuse_address=True
+    daemon_threads=True
+
+def start_camserver_sim(host='localhost',port=0,**state):
+    """Starts the stand-in camera server on a background thread.
+    Inputs:
+        :host(string): address to listen on
+        :port(integer): TCP port, 0 picks a free port
+        :state: arguments for CamserverState
+    Returns:
+        ::server, server.server_address has the port to connect nuvu.NuvuCamera to"""
+    server=CamserverSim((host,port),CamserverHandler)
+    server.state=CamserverState(**state)
+    os.makedirs(server.state.path,exist_ok=True)
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server
+
+def stop_camserver_sim(server):
+    """Stops the stand-in camera server."""
+    server.shutdown()
+    server.server_close()
+
+def cam_comm(server):
+    """cam_cit command for nuvu.NuvuCamera(cam_comm=...) that runs this file as the client of a stand-in server."""
+    host,port=server.server_address
+    return f'{shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))} --host {host} --port {port}'
+
+def cam_cit(argv,stdin=None,stdout=None):
+    """Stand-in cam_cit. Sends the command on its command line to the stand-in server, or with no command every line of its
+    input over one connection, and prints each reply line.
+    Inputs:
+        :argv(list): --host HOST --port PORT then an optional command, such as ['--port','5000','exptime','2.0']
+    Returns:
+        ::exit status"""
+    stdin=stdin or sys.stdin
+    stdout=stdout or sys.stdout
+    host='localhost'
+    port=None
+    while argv and argv[0] in ('--host','--port'):
+        if argv[0]=='--host':
+            host=argv[1]
+        else:
+            port=int(argv[1])
+        argv=argv[2:]
+    if port is None:
+        print("Usage: camserver_sim.py [--host HOST] --port PORT [COMMAND [VALUE]]",file=sys.stderr)
+        return 2
+    with socket.create_connection((host,port)) as sock:
+        reader=sock.makefile('r',encoding='ascii')
+        lines=[' '.join(argv)] if argv else stdin
+        for line in lines:
+            if not line.strip():
+                continue
+            sock.sendall((line.strip()+'\n').encode('ascii'))
+            stdout.write(reader.readline())
+            stdout.flush() #the camera client waits for each reply
+    return 0
+
+if __name__=='__main__':
+    sys.exit(cam_cit(sys.argv[1:]))
@@ -0,0 +1,284 @@
+import os
+import re
+import json
+import time
+import sqlite3
+
+"""SQLite index of the experiment folders. Run folders from PhotodiodeLinux.savefile, the per-point picoammeter files and the NUVU frame logs
+are parsed once and kept in run_catalog.sqlite, so questions such as "all D2 runs with filter 3 covering 250 nm" do not need to glob and parse
+file names. update() only reads folders and files that are new or changed since the last update."""
+
+RUN_PATTERN=re.compile(r'Exp(?P<date>\d{8})_(?P<lamp>[^_]+)_slit_(?P<slit>[\d.]+)micron_(?P<start>[\d.]+)nmto(?P<end>[\d.]+)nm$') #folders from savefile
+POINT_PATTERN=re.compile(r'(?P<dark>_dark)?_Filter_(?P<filtnum>\d+)_wl_(?P<wl>[\d.]+)nm\.csv$') #points from MC_run_exp
+DARK_PATTERN=re.compile(r'_dark(_Filter_(?P<filtnum>\d+))?_(?P<which>pre|post|pre_resume_\d+)\.csv$') #pre and post darks from MC_run_exp
+PICOA_PATTERN=re.compile(r'picoa_(?P<imtype>[A-Za-z]+)_f(?P<filtnum>\d+)_(?P<wl>[\d.]+)nm_(?P<imno>\d+)\.csv$') #points from qe.get_qe_data, same as qe_analysis
+FRAME_LOGS={'scan_log.jsonl':'nuvu','ptc_log.jsonl':'ptc'} #append-only frame logs from nuvu.ExperimentLog
+KIND_RANK={'photodiode':0,'nuvu':1,'ptc':2,'qe':2} #a folder with several kinds of files takes the highest
+
+SCHEMA="""
+create table if not exists runs(id integer primary key, path text unique, kind text, date text, lamp text, slit real, start_wl real, end_wl real);
+create table if not exists dirs(path text primary key, mtime integer);
+create table if not exists files(id integer primary key, run_id integer, path text unique, size integer, mtime integer, kind text,
+                                 imtype text, filtnum integer, wl real, imno integer, dark integer, offset integer);
+create table if not exists frames(file_id integer, run_id integer, time text, imtype text, exp_time real, lamp text, wl real, imno integer, filtnum integer);
+create index if not exists files_run on files(run_id);
+create index if not exists files_point on files(filtnum, wl);
+create index if not exists frames_run on frames(run_id);
+create index if not exists frames_point on frames(filtnum, wl);
+create index if not exists runs_lamp on runs(lamp);
+create view if not exists points as select run_id,filtnum,wl from files where wl is not null
+    union all select run_id,filtnum,wl from frames where imtype in ('Exposure','Flat');
+"""
+
+def parse_run_folder(name):
+    """Reads date, lamp, slit and wavelength range from a run folder name made by PhotodiodeLinux.savefile.
+    Returns:
+        ::dictionary of date (YYYY-MM-DD), lamp, slit, start_wl, end_wl, None if the name does not match"""
+    match=RUN_PATTERN.match(name)
+    if match is None:
+        return None
+    date=match['date']
+    return {'date':f"{date[4:]}-{date[:2]}-{date[2:4]}",'lamp':match['lamp'],'slit':float(match['slit']),
+            'start_wl':float(match['start']),'end_wl':float(match['end'])}
+
+def parse_data_filename(name):
+    """Reads the point metadata from a data file name.
+    Returns:
+        ::dictionary of kind, imtype, filtnum, wl, imno and dark, None if the name is not a data file"""
+    match=PICOA_PATTERN.search(name)
+    if match:
+        return {'kind':'picoa','imtype':match['imtype'],'filtnum':int(match['filtnum']),'wl':float(match['wl']),'imno':int(match['imno']),
+                'dark':int(match['imtype']=='Dark')}
+    match=POINT_PATTERN.search(name)
+    if match:
+        dark=match['dark'] is not None
+        return {'kind':'point','imtype':'Dark' if dark else 'Data','filtnum':int(match['filtnum']),'wl':float(match['wl']),'imno':None,'dark':int(dark)}
+    match=DARK_PATTERN.search(name)
+    if match:
+        return {'kind':'dark','imtype':'Dark_'+match['which'].split('_')[0],'filtnum':None if match['filtnum'] is None else int(match['filtnum']),
+                'wl':None,'imno':None,'dark':1}
+    if name in FRAME_LOGS:
+        return {'kind':'frame_log','imtype':None,'filtnum':None,'wl':None,'imno':None,'dark':0}
+    return None
+
+class RunCatalog:
+    """Run and point index of a data directory tree.
+    Inputs:
+        :path(string): SQLite file of the catalog"""
+    def __init__(self,path='run_catalog.sqlite'):
+        self.path=path
+        self.db=sqlite3.connect(path)
+        self.db.row_factory=sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def run_id(self,folder,kind):
+        """Id of the run in a folder, added if it is new."""
+        row=self.db.execute('select id,kind from runs where path=?',(folder,)).fetchone()
+        if row is not None:
+            if KIND_RANK[kind]>KIND_RANK[row['kind']]:
+                self.db.execute('update runs set kind=? where id=?',(kind,row['id']))
+            return row['id']
+        info=parse_run_folder(os.path.basename(folder)) or {}
+        cur=self.db.execute('insert into runs(path,kind,date,lamp,slit,start_wl,end_wl) values(?,?,?,?,?,?,?)',
+                            (folder,kind,info.get('date'),info.get('lamp'),info.get('slit'),info.get('start_wl'),info.get('end_wl')))
+        return cur.lastrowid
+
+    def index_frames(self,file_id,run_id,filename,offset):
+        """Adds the frame records written to a frame log after offset.
+        Returns:
+            ::new offset, lamp and time of the last record"""
+        lamp=stamp=None
+        rows=[]
+        with open(filename,'rb') as fp:
+            fp.seek(offset)
+            for line in fp:
+                if not line.endswith(b'\n'): #record still being written
+                    break
+                offset+=len(line)
+                try:
+                    record=json.loads(line)
+                except ValueError:
+                    continue
+                lamp=record.get('Lamp',lamp)
+                stamp=record.get('time',stamp)
+                rows.append((file_id,run_id,record.get('time'),record.get('imtype'),record.get('Exp_time'),record.get('Lamp'),
+                             record.get('wl'),record.get('imno'),record.get('filtnum')))
+        self.db.executemany('insert into frames values(?,?,?,?,?,?,?,?,?)',rows)
+        return offset,lamp,stamp
+
+    def index_file(self,folder,name,stat,known):
+        """Adds or updates one file.
+        Returns:
+            ::True if the file was read"""
+        filename=os.path.join(folder,name)
+        old=known.get(filename)
+        if old is not None and old['size']==stat.st_size and old['mtime']==stat.st_mtime_ns:
+            return False
+        info=parse_data_filename(name)
+        if info is None:
+            return False
+        if info['kind']=='frame_log':
+            kind=FRAME_LOGS[name]
+        elif info['kind']=='picoa':
+            kind='qe'
+        else:
+            kind='photodiode'
+        run_id=self.run_id(folder,kind)
+        offset=0
+        if old is None:
+            cur=self.db.execute('insert into files(run_id,path,size,mtime,kind,imtype,filtnum,wl,imno,dark,offset) values(?,?,?,?,?,?,?,?,?,?,0)',
+                                (run_id,filename,stat.st_size,stat.st_mtime_ns,info['kind'],info['imtype'],info['filtnum'],info['wl'],info['imno'],info['dark']))
+            file_id=cur.lastrowid
+        else:
+            file_id=old['id']
+            offset=old['offset'] or 0
+            if info['kind']=='frame_log' and stat.st_size<offset: #log was rewritten, not appended to
+                self.db.execute('delete from frames where file_id=?',(file_id,))
+                offset=0
+            self.db.execute('update files set size=?,mtime=? where id=?',(stat.st_size,stat.st_mtime_ns,file_id))
+        if info['kind']=='frame_log':
+            offset,lamp,stamp=self.index_frames(file_id,run_id,filename,offset)
+            self.db.execute('update files set offset=? where id=?',(offset,file_id))
+            self.db.execute('update runs set lamp=coalesce(lamp,?),date=coalesce(date,?) where id=?',(lamp,stamp and stamp[:10],run_id)) #no folder name to read them from
+        return True
+
+    def update(self,parent_directory):
+        """Indexes new and changed files under a data directory and drops files that were deleted.
+        Folders whose modification time has not changed are not listed again, only their frame logs are checked for appended records.
+        Inputs:
+            :parent_directory(string): directory holding the experiment folders
+        Returns:
+            ::dictionary of folders listed, files read and files removed"""
+        t0=time.perf_counter()
+        parent_directory=os.path.abspath(parent_directory)
+        prefix=parent_directory+os.sep
+        dirs={row['path']:row['mtime'] for row in self.db.execute('select path,mtime from dirs where path=? or substr(path,1,?)=?',(parent_directory,len(prefix),prefix))}
+        listed=read=removed=0
+        seen=set()
+        with self.db:
+            for folder,subdirs,names in os.walk(parent_directory):
+                seen.add(folder)
+                mtime=os.stat(folder).st_mtime_ns
+                prefix=folder+os.sep #paths are compared as strings, like would treat the _ of the folder names as a wildcard
+                known={row['path']:row for row in self.db.execute('select id,path,size,mtime,offset from files where substr(path,1,?)=? and instr(substr(path,?),?)=0',
+                                                                    (len(prefix),prefix,len(prefix)+1,os.sep))}
+                if dirs.get(folder)==mtime: #same files as last time, only logs can have grown
+                    names=[os.path.basename(filename) for filename in known if os.path.basename(filename) in FRAME_LOGS]
+                else:
+                    listed+=1
+                    present={os.path.join(folder,name) for name in names}
+                    gone=[row['id'] for filename,row in known.items() if filename not in present]
+                    for file_id in gone:
+                        self.db.execute('delete from frames where file_id=?',(file_id,))
+                        self.db.execute('delete from files where id=?',(file_id,))
+                    removed+=len(gone)
+                    self.db.execute('insert or replace into dirs(path,mtime) values(?,?)',(folder,mtime))
+                for name in names:
+                    try:
+                        stat=os.stat(os.path.join(folder,name))
+                    except OSError: #deleted while indexing
+                        continue
+                    read+=self.index_file(folder,name,stat,known)
+            for folder in set(dirs)-seen: #folders that were deleted
+                self.db.execute('delete from dirs where path=?',(folder,))
+                prefix=folder+os.sep
+                for row in self.db.execute('select id from files where substr(path,1,?)=? and instr(substr(path,?),?)=0',(len(prefix),prefix,len(prefix)+1,os.sep)).fetchall():
+                    self.db.execute('delete from frames where file_id=?',(row['id'],))
+                    self.db.execute('delete from files where id=?',(row['id'],))
+                    removed+=1
+            self.db.execute('delete from runs where id not in (select distinct run_id from files)')
+        print(f"Catalog updated in {time.perf_counter()-t0:.2f} s: {listed} folders listed, {read} files read, {removed} removed")
+        return {'listed':listed,'read':read,'removed':removed}
+
+    def find_runs(self,lamp=None,filtnum=None,covers=None,kind=None,since=None,until=None):
+        """Runs with points matching all the given conditions.
+        Inputs:
+            :lamp(string): D2 or Xe
+            :filtnum(integer): filter used for at least one point or camera exposure
+            :covers(float): wavelength in nm between the first and last point of that filter
+            :kind(string): 'photodiode', 'qe', 'nuvu' or 'ptc'
+            :since(string): first date, YYYY-MM-DD
+            :until(string): last date, YYYY-MM-DD
+        Returns:
+            ::list of dictionaries of run path, kind, date, lamp, slit, wavelength range and number of wavelengths"""
+        where,args=['1'],[]
+        for column,value in (('r.lamp',lamp),('p.filtnum',filtnum),('r.kind',kind)):
+            if value is not None:
+                where.append(f'{column}=?')
+                args.append(value)
+        if since is not None:
+            where.append('r.date>=?')
+            args.append(since)
+        if until is not None:
+            where.append('r.date<=?')
+            args.append(until)
+        having=''
+        if covers is not None:
+            having='having min(p.wl)<=? and max(p.wl)>=?'
+            args+=[covers,covers]
+        sql=f"""select r.path,r.kind,r.date,r.lamp,r.slit,min(p.wl) as wl_min,max(p.wl) as wl_max,count(distinct p.wl) as wavelengths
+                from runs r join points p on p.run_id=r.id where {' and '.join(where)} group by r.id {having} order by r.date,r.path"""
+        return [dict(row) for row in self.db.execute(sql,args)]
+
+    def find_points(self,lamp=None,filtnum=None,wl=None,wl_min=None,wl_max=None,dark=None,run=None):
+        """Data files of single points.
+        Inputs:
+            :lamp(string): D2 or Xe
+            :filtnum(integer): filter
+            :wl(float): wavelength in nm
+            :wl_min(float): lowest wavelength in nm
+            :wl_max(float): highest wavelength in nm
+            :dark(boolean): only darks if True, no darks if False
+            :run(string): run folder
+        Returns:
+            ::list of dictionaries of file path, run path, imtype, filter, wavelength, image number and dark flag"""
+        where,args=['f.wl is not null'],[]
+        for column,value in (('r.lamp',lamp),('f.filtnum',filtnum),('f.wl',wl),('r.path',run)):
+            if value is not None:
+                where.append(f'{column}=?')
+                args.append(value)
+        if wl_min is not None:
+            where.append('f.wl>=?')
+            args.append(wl_min)
+        if wl_max is not None:
+            where.append('f.wl<=?')
+            args.append(wl_max)
+        if dark is not None:
+            where.append('f.dark=?')
+            args.append(int(dark))
+        sql=f"""select f.path,r.path as run,f.imtype,f.filtnum,f.wl,f.imno,f.dark from files f join runs r on f.run_id=r.id
+                where {' and '.join(where)} order by r.path,f.filtnum,f.wl"""
+        return [dict(row) for row in self.db.execute(sql,args)]
+
+    def find_frames(self,imtype=None,lamp=None,filtnum=None,wl=None,exp_time=None):
+        """NUVU frames from the frame logs.
+        Returns:
+            ::list of dictionaries of run path, time, imtype, exposure time, lamp, wavelength, image number and filter"""
+        where,args=['1'],[]
+        for column,value in (('fr.imtype',imtype),('fr.lamp',lamp),('fr.filtnum',filtnum),('fr.wl',wl),('fr.exp_time',exp_time)):
+            if value is not None:
+                where.append(f'{column}=?')
+                args.append(value)
+        sql=f"""select r.path as run,fr.time,fr.imtype,fr.exp_time,fr.lamp,fr.wl,fr.imno,fr.filtnum from frames fr join runs r on fr.run_id=r.id
+                where {' and '.join(where)} order by r.path,fr.imno"""
+        return [dict(row) for row in self.db.execute(sql,args)]
+
+def update_catalog(parent_directory,path='run_catalog.sqlite'):
+    """Updates the catalog of a data directory and returns it open for queries.
+    Inputs:
+        :parent_directory(string): directory holding the experiment folders
+        :path(string): SQLite file of the catalog
+    Returns:
+        ::RunCatalog"""
+    catalog=RunCatalog(path)
+    catalog.update(parent_directory)
+    return catalog
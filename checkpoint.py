@@ -0,0 +1,183 @@
+import os
+import json
+import time
+
+"""Checkpoints for long wavelength scans. A scan writes its plan and progress after every completed point so it can be resumed after a failure."""
+
+STEPS_PER_NM=9000 #microsteps #1nm = 9000 microsteps, as in monochromatorapi
+
+def _plain(value):
+    """JSON value for numpy scalars in records."""
+    return value.item() if hasattr(value,'item') else str(value)
+
+class ScanCheckpoint:
+    """Progress of one scan, saved as JSON after every completed point.
+    Inputs:
+        :filename(string): checkpoint file
+        :scan(string): scan entry point, 'MC_run_exp', 'scan_with_nuvu', 'get_qe_data' or 'experimentrun'
+        :plan(dictionary): arguments needed to run the scan again
+        :points(list): planned points in scan order, each a list of [filter, wavelength]"""
+    def __init__(self,filename,scan,plan,points):
+        self.filename=filename
+        self.scan=scan
+        self.plan=plan
+        self.points=[list(p) for p in points]
+        self.completed=[] #indices of finished points
+        self.position=None #wavelength the grating was last sent to, nm
+        self.filternum=None #filter wheel position
+        self.offsets={} #data file to byte offset after the last completed point
+        self.starts={} #data file to byte offset where the scan's first records begin
+        self.files=[] #data files written by completed points
+        self.records=[] #per point log rows the scan writes at the end, kept so a resumed scan writes the whole log
+        self.reference=None #[wavelength in nm, controller step count] read after the grating was last homed
+
+    def to_dict(self):
+        return {'scan':self.scan,'plan':self.plan,'points':self.points,'completed':self.completed,
+                'position':self.position,'filternum':self.filternum,'offsets':self.offsets,'starts':self.starts,'files':self.files,
+                'records':self.records,'reference':self.reference,'updated':time.strftime('%Y-%m-%d %H:%M:%S')}
+
+    def save(self):
+        """Writes the checkpoint. The file is replaced in one step so a crash while saving leaves the previous checkpoint."""
+        tmp=self.filename+'.tmp'
+        with open(tmp,'w') as fp:
+            json.dump(self.to_dict(),fp,indent=1,default=_plain)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp,self.filename)
+
+    def point_done(self,idx,position,filternum=None,offsets=None,files=None,record=None):
+        """Records a completed point and saves the checkpoint.
+        Inputs:
+            :idx(integer): index of the point in points
+            :position(float): grating wavelength in nm
+            :filternum(integer): filter wheel position
+            :offsets(dictionary): data file to byte offset after this point
+            :files(list): data files written for this point
+            :record(dictionary): log row for this point"""
+        if idx not in self.completed:
+            self.completed.append(idx)
+        self.position=float(position)
+        if filternum is not None:
+            self.filternum=int(filternum)
+        if offsets:
+            self.offsets.update(offsets)
+        if files:
+            self.files.extend(files)
+        if record is not None:
+            self.records.append(record)
+        self.save()
+
+    def next_index(self):
+        """Index of the first point not completed, len(points) if the scan is finished."""
+        done=set(self.completed)
+        for idx in range(len(self.points)):
+            if idx not in done:
+                return idx
+        return len(self.points)
+
+    def is_done(self,idx):
+        return idx in self.completed
+
+    def truncate_files(self):
+        """Cuts appended data files back to their offset at the last completed point, dropping records of a half finished point."""
+        for fn,offset in self.offsets.items():
+            if os.path.exists(fn) and os.path.getsize(fn)>offset:
+                with open(fn,'r+') as fp:
+                    fp.truncate(offset)
+                print(f"Truncated {fn} to the last completed point")
+
+def load_checkpoint(filename):
+    """Reads a checkpoint file.
+    Returns:
+        ::ScanCheckpoint"""
+    with open(filename) as fp:
+        data=json.load(fp)
+    ckpt=ScanCheckpoint(filename,data['scan'],data['plan'],data['points'])
+    ckpt.completed=data['completed']
+    ckpt.position=data['position']
+    ckpt.filternum=data['filternum']
+    ckpt.offsets=data['offsets']
+    ckpt.starts=data.get('starts',{})
+    ckpt.files=data['files']
+    ckpt.records=data.get('records',[])
+    ckpt.reference=data.get('reference')
+    return ckpt
+
+def home_to(MCPort,ckpt,wl):
+    """Homes the grating, moves it to a wavelength and saves the controller step count there as the reference verify_position works from.
+    Inputs:
+        :MCPort(string): serial address for scan controller
+        :ckpt(ScanCheckpoint): checkpoint of the scan
+        :wl(float): wavelength in nm"""
+    import monochromatorapi as mcapi
+    mcapi.go_to_fromhome(MCPort,wl)
+    steps=mcapi.readposition(MCPort)
+    ckpt.reference=[float(wl),steps] if isinstance(steps,int) else None #a resume homes again without a reference
+    ckpt.save()
+
+def verify_position(MCPort,ckpt,tol=0.1):
+    """Checks that the grating is at the checkpoint wavelength, using the step count of the controller.
+    The step count moved since the reference of home_to gives the grating wavelength, which catches a controller that was power cycled
+    or lost steps.
+    Inputs:
+        :MCPort(string): serial address for scan controller
+        :ckpt(ScanCheckpoint): checkpoint being resumed
+        :tol(float): largest allowed difference in nm
+    Returns:
+        ::True if the checkpoint position can be trusted"""
+    import monochromatorapi as mcapi
+    if ckpt.position is None or ckpt.reference is None:
+        return False
+    steps=mcapi.readposition(MCPort)
+    if not isinstance(steps,int): #step count could not be read
+        return False
+    ref_wl,ref_steps=ckpt.reference
+    wl=ref_wl+(steps-ref_steps)/STEPS_PER_NM
+    if abs(wl-ckpt.position)>tol:
+        print(f"Controller step count puts the grating at {wl:.3f} nm, checkpoint has {ckpt.position} nm")
+        return False
+    return True
+
+def resume_position(MCPort,ckpt,wl):
+    """Moves the grating to the wavelength of the next point. Moves from the checkpoint position if it is verified, otherwise homes first.
+    Inputs:
+        :MCPort(string): serial address for scan controller
+        :ckpt(ScanCheckpoint): checkpoint being resumed
+        :wl(float): wavelength of the next point in nm"""
+    import monochromatorapi as mcapi
+    if verify_position(MCPort,ckpt):
+        print(f"Grating position {ckpt.position} nm verified, resuming without homing")
+        if ckpt.position!=wl:
+            mcapi.go_to_from(MCPort,ckpt.position,wl)
+    else:
+        print("Grating position could not be verified, homing before resuming")
+        home_to(MCPort,ckpt,wl)
+
+def resume(filename,**kwargs):
+    """Resumes a scan at the next incomplete point of its checkpoint.
+    Inputs:
+        :filename(string): checkpoint file written by the scan
+        :kwargs: scan arguments that could not be saved in the checkpoint, such as a temperature function or camera client
+    Returns:
+        ::return value of the scan entry point"""
+    ckpt=load_checkpoint(filename)
+    idx=ckpt.next_index()
+    if idx>=len(ckpt.points):
+        print(f"Scan in {filename} is already complete")
+        return
+    print(f"Resuming {ckpt.scan} at point {idx+1} of {len(ckpt.points)}")
+    ckpt.truncate_files()
+    kwargs={**ckpt.plan,**kwargs}
+    if ckpt.scan=='MC_run_exp':
+        import PhotodiodeLinux as mclinux
+        return mclinux.MC_run_exp(checkpoint=ckpt,**kwargs)
+    if ckpt.scan=='scan_with_nuvu':
+        import nuvu
+        return nuvu.scan_with_nuvu(checkpoint=ckpt,**kwargs)
+    if ckpt.scan=='get_qe_data':
+        import qe
+        return qe.get_qe_data(checkpoint=ckpt,**kwargs)
+    if ckpt.scan=='experimentrun':
+        import pixisapi as pixis
+        return pixis.experimentrun(checkpoint=ckpt,**kwargs)
+    raise ValueError(f"Unknown scan {ckpt.scan} in {filename}")
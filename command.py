@@ -1,23 +1,18 @@
 import codecs
 import time
-import serial
-import serial.tools.list_ports
-import pandas as pd
-import numpy as np
+import lazy
 import datetime
 import os
 import sys
-import pyvisa as visa
 import monochromatorapi as mcapi
 #import shutterapi as shutter
 #import pixisapi as pixis
 #import fwapi as fw
 #import PhotodiodeLinux as mclinux
 import port_utils as pt
+np = lazy.module('numpy') #imported on first use, a status query does not need it
 #import nuvu as nuvu
-import clr # Import the .NET class library
-import sys # Import python sys module
-import os # Import os module
+#import clr # Import the .NET class library
 #"""libraries for PIXIS"""
 #from System.IO import * # Import System.IO for saving and opening files
 # Import C compatible List and String
@@ -41,13 +36,15 @@ import os # Import os module
 """Import any global variables from updated or new experiments. Run commands in this file imported from function libraries."""
 
 """Port Variables""" #used for connection to devices in experiment, including moving the grating
-ports = pt.update_port_databse(path="port_database.csv")
-port_database=pt.get_port_database()
-MCPort = port_database[port_database['Port_Alias']=='MCPort']['Port_Name'].values[0]
-shutterport= port_database[port_database['Port_Alias']=='ShutPort']['Port_Name'].values[0]
-PicoPort=port_database[port_database['Port_Alias']=='PicoPort']['Port_Name'].values[0]
-picoasrl='ASRL'+PicoPort+'::INSTR' #port for the picoammeter
-FWPort=port_database[port_database['Port_Alias']=='FWPort']['Port_Name'].values[0]
+def load_ports():
+    """Updates the port database from the connected USB devices and sets the port variables. Run when this file is run, not when it is imported."""
+    global port_database,MCPort,shutterport,PicoPort,picoasrl,FWPort
+    port_database=pt.get_resolver(path="port_database.csv") #enumerates the USB bus only if a cached port has disappeared
+    MCPort = port_database.resolve('MCPort')
+    shutterport= port_database.resolve('ShutPort')
+    PicoPort=port_database.resolve('PicoPort')
+    picoasrl=port_database.visa('PicoPort') #port for the picoammeter
+    FWPort=port_database.resolve('FWPort')
 
 """PhotodiodeLinux experiment funciton settings"""
 #mcapi.go_to_from(MCPort,600,610) #power recycling issue so 10 nm offset, assumes scan controller is already at home
@@ -71,7 +68,9 @@ interval=0.1 #rate of samples for picoameter to take
 #mcapi.go_to_from(MCPort,631.26,640)
 #pt.setports()
 #pt.get_port_database(path="port_database.csv")
-mcapi.home(MCPort)
+if __name__=='__main__': #ports are looked up and the grating homed only when this file is run
+    load_ports()
+    mcapi.home(MCPort)
 #mcapi.stop(MCPort)
 
 """NUVU experiment function settings"""
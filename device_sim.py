@@ -0,0 +1,313 @@
+import re
+import time
+import threading
+import numpy as np
+import instruments
+import transcript
+
+"""Stand-ins for the 789A-4 scan controller, 747 filter wheel, VCM-D1 shutter and 6482 picoammeter. They answer the same bytes as the real
+devices through the pooled sessions in instruments.py, so the experiment functions run unchanged off the bench. Device time runs 1/time_scale
+times faster than the computer clock, and the sleeps in the driver modules are shortened by the same factor."""
+
+HOME_WL=631.26 #nm #home wavelength of the scan controller
+STEPS_PER_NM=9000 #microsteps #1nm = 9000 microsteps
+
+class ScanControllerSim:
+    """789A-4 scan controller. Position is in microsteps from home, positive above the home wavelength.
+    Inputs:
+        :clock(function): device time in s
+        :wl(float): starting wavelength in nm
+        :rate(float): speed of relative moves in microsteps/s"""
+    def __init__(self,clock,wl=HOME_WL,rate=23000):
+        self.clock=clock
+        self.rate=rate
+        self.lower=(0.1-HOME_WL)*STEPS_PER_NM #device limits
+        self.upper=(999.9-HOME_WL)*STEPS_PER_NM
+        self.pos=(wl-HOME_WL)*STEPS_PER_NM
+        self.motion=None #[start time, start position, velocity, target or None for constant velocity]
+        self.moves=0
+
+    def position(self):
+        if self.motion is None:
+            return self.pos
+        t0,pos0,velocity,target=self.motion
+        pos=pos0+velocity*(self.clock()-t0)
+        if target is not None and (pos-target)*np.sign(velocity)>=0: #relative move finished
+            pos=target
+            self.pos,self.motion=pos,None
+        elif not self.lower<=pos<=self.upper: #ran into a limit
+            pos=min(max(pos,self.lower),self.upper)
+            self.pos,self.motion=pos,None
+        return pos
+
+    def wavelength(self):
+        return HOME_WL+self.position()/STEPS_PER_NM
+
+    def move(self,velocity,target=None):
+        self.pos=self.position()
+        self.motion=[self.clock(),self.pos,velocity,target] if velocity else None
+        self.moves+=1
+
+    def command(self,data):
+        """Runs one command line and returns the reply bytes."""
+        cmd=data.decode('ascii','replace').strip()
+        pos=self.position()
+        if cmd==']': #limit status, 0 above home and 32 below, 2 more while moving
+            return f"]   {(32 if pos<0 else 0)+(2 if self.motion else 0)}\r\n".encode()
+        if cmd=='Z': #position counter
+            return f"Z   {int(round(pos))}\r\n".encode()
+        if cmd=='^': #moving status
+            moving=0 if self.motion is None else (2 if self.motion[3] is None else 1)
+            return f"^   {moving}\r\n".encode()
+        if cmd=='@': #soft stop
+            self.move(0)
+        elif re.fullmatch(r'[+-]\d+',cmd): #relative move
+            steps=int(cmd)
+            self.move(np.sign(steps)*self.rate,pos+steps)
+        elif re.fullmatch(r'[mM][+-]?\d+',cmd): #constant velocity
+            self.move(int(cmd[1:]))
+        elif cmd.startswith('F'): #find the edge of the home flag
+            speed=int(cmd[1:].split(',')[0])
+            self.move(-np.sign(pos)*speed if pos else 0,0.0)
+        return (cmd+'\r\n').encode()
+
+class FilterWheelSim:
+    """747 filter wheel controller with five filters.
+    Inputs:
+        :clock(function): device time in s
+        :position(integer): starting filter
+        :step_time(float): time to turn one slot in s"""
+    def __init__(self,clock,position=1,step_time=1.5):
+        self.clock=clock
+        self.filter=position
+        self.step_time=step_time
+        self.busy_until=0.0
+        self.steps=0
+
+    def command(self,data):
+        if data==b'N!\x05': #enquiry
+            return b'N!\x06'
+        if data.startswith(b'\x01'): #header
+            if data[3:4]==b'0': #read position
+                return b'\x02000'+f'{self.filter:02d}'.encode()+b'\x03\r\n'
+            return b'N!\x06'
+        if data.startswith(b'\x02'): #data of an increment
+            self.filter=self.filter%5+1
+            self.busy_until=max(self.busy_until,self.clock())+self.step_time
+            self.steps+=1
+            return b'N!\x06'
+        return b''
+
+class ShutterSim:
+    """VCM-D1 shutter controller."""
+    def __init__(self):
+        self.open=False
+        self.toggles=0
+
+    def command(self,data):
+        for byte in data:
+            if byte==ord('@'):
+                self.open=True
+                self.toggles+=1
+            elif byte==ord('A'):
+                self.open=False
+                self.toggles+=1
+        return b''
+
+def d2_spectrum(wl):
+    """Relative D2 lamp intensity, a continuum falling to the red with the Balmer lines."""
+    continuum=np.exp(-(wl-160.0)/120.0)+0.02
+    lines=sum(amp*np.exp(-0.5*((wl-center)/0.6)**2) for center,amp in [(656.3,3.0),(486.1,0.8),(434.0,0.3)])
+    return continuum+lines
+
+class PicoammeterSim:
+    """Keithley 6482 on VISA. Ch1 sees the monochromator beam through the shutter and filter, Ch2 is a monitor diode.
+    Inputs:
+        :mc(ScanControllerSim): gives the wavelength
+        :fw(FilterWheelSim): gives the filter
+        :shutter(ShutterSim): gives the shutter state
+        :sleep(function): waits device time in s
+        :peak(float): Ch1 current at the peak of the lamp in A
+        :edges(list): filter change wavelengths, each filter passes up to its edge
+        :nplc(float): integration time in power line cycles of each channel
+        :seed(integer): noise seed"""
+    def __init__(self,mc,fw,shutter,sleep,peak=2e-8,edges=(240,350,500,605,700),nplc=1,seed=0):
+        self.mc=mc
+        self.fw=fw
+        self.shutter=shutter
+        self.sleep=sleep
+        self.peak=peak
+        self.edges=list(edges)
+        self.nplc=nplc
+        self.rng=np.random.default_rng(seed)
+        self.ranges={1:None,2:None} #None is autorange
+        self.reply=[]
+        self.reads=0
+
+    def transmission(self,wl):
+        lower=([0]+self.edges)[self.fw.filter-1]
+        upper=self.edges[self.fw.filter-1]
+        return 0.9 if lower<wl<=upper+20 else 0.05 #filters leak a little outside their band
+
+    def current(self,channel):
+        wl=self.mc.wavelength()
+        light=self.peak*d2_spectrum(wl)/d2_spectrum(160.0)
+        if channel==1:
+            value=light*self.transmission(wl) if self.shutter.open else 0.0
+        else:
+            value=0.5*light
+        value+=2e-13+self.rng.normal(0,1e-14)+0.01*value*self.rng.normal()
+        rng=self.ranges[channel]
+        if rng is not None and abs(value)>1.05*rng:
+            return 9.9e37 #overflow of the locked range
+        return value
+
+    def write(self,cmd):
+        cmd=cmd.strip()
+        match=re.fullmatch(r':SENS(\d):CURR:RANG(:AUTO)? (\S+)',cmd)
+        if match:
+            channel=int(match[1])
+            if match[2]:
+                if match[3]=='ON':
+                    self.ranges[channel]=None
+            else:
+                self.ranges[channel]=float(match[3])
+        elif re.fullmatch(r':SENS\d:CURR:NPLC \S+',cmd):
+            self.nplc=float(cmd.split()[-1])
+        elif cmd=='*IDN?':
+            self.reply.append('KEITHLEY INSTRUMENTS INC.,MODEL 6482,SIM,1.0')
+        elif cmd=='*OPC?':
+            self.reply.append('1')
+        elif cmd==':READ?':
+            self.sleep(2*self.nplc/60+0.01) #both channels integrate, plus the RS-232 transfer
+            self.reads+=1
+            self.reply.append(f"{self.current(1):.6e},{self.current(2):.6e}")
+        return len(cmd)
+
+    def read(self):
+        return self.reply.pop(0) if self.reply else ''
+
+class SimSerial:
+    """Serial connection to a simulated device, replies are buffered until read.
+    Inputs:
+        :device: simulated device with command(bytes) returning the reply bytes
+        :lock(threading.Lock): lock of the simulated bench"""
+    def __init__(self,device,lock):
+        self.device=device
+        self.lock=lock
+        self.buffer=b''
+        self.is_open=True
+        self.timeout=None #accepted, replies are immediate
+
+    def write(self,data):
+        with self.lock:
+            self.buffer+=self.device.command(bytes(data))
+        return len(data)
+
+    def take(self,n):
+        data,self.buffer=self.buffer[:n],self.buffer[n:]
+        return data
+
+    def read(self,size=1):
+        return self.take(size)
+
+    def read_until(self,expected=b'\n',size=None):
+        end=self.buffer.find(expected)
+        n=len(self.buffer) if end<0 else end+len(expected)
+        return self.take(n if size is None else min(n,size))
+
+    def readline(self):
+        return self.read_until(b'\n')
+
+    def readlines(self):
+        return self.take(len(self.buffer)).splitlines(keepends=True)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.buffer=b''
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def close(self):
+        self.is_open=False
+
+class SimVisa:
+    """VISA resource of the simulated picoammeter. Serial settings and terminations are accepted and ignored."""
+    def __init__(self,device,resource_name):
+        self.device=device
+        self.resource_name=resource_name
+
+    def write(self,cmd):
+        return self.device.write(cmd)
+
+    def read(self):
+        return self.device.read()
+
+    def query(self,cmd):
+        self.write(cmd)
+        return self.read()
+
+    def close(self):
+        pass
+
+class DeviceSim:
+    """Simulated bench connected in place of the serial and VISA devices while active.
+    Inputs:
+        :time_scale(float): computer seconds per device second, such as 0.001
+        :wl(float): starting wavelength of the grating in nm
+        :filternum(integer): starting filter
+        :seed(integer): noise seed of the picoammeter"""
+    def __init__(self,time_scale=0.001,wl=HOME_WL,filternum=1,seed=0):
+        self.time_scale=time_scale
+        self.t0=time.perf_counter()
+        self.lock=threading.Lock()
+        self.mc=ScanControllerSim(self.clock,wl)
+        self.fw=FilterWheelSim(self.clock,filternum)
+        self.shutter=ShutterSim()
+        self.picoa=PicoammeterSim(self.mc,self.fw,self.shutter,self.sleep,seed=seed)
+        self.devices={'MCPort':self.mc,'FWPort':self.fw,'ShutPort':self.shutter}
+        self.patched={}
+
+    def clock(self):
+        """Device time in s."""
+        return (time.perf_counter()-self.t0)/self.time_scale
+
+    def sleep(self,seconds):
+        time.sleep(seconds*self.time_scale)
+
+    def open(self,kind,label,opener):
+        if kind=='visa':
+            if label!='PicoPort':
+                raise ConnectionError(f"No simulated VISA device {label}")
+            return SimVisa(self.picoa,label)
+        if label not in self.devices:
+            raise ConnectionError(f"No simulated serial device {label}")
+        return SimSerial(self.devices[label],self.lock)
+
+    def __enter__(self):
+        if self.patched: #already running
+            return self
+        instruments.get_registry().set_backend(self.open)
+        self.patched=transcript.scale_driver_sleeps(self.time_scale)
+        return self
+
+    def __exit__(self,*exc):
+        self.stop()
+
+    def stop(self):
+        """Puts back the real devices and time module."""
+        instruments.get_registry().set_backend(None)
+        transcript.restore_driver_sleeps(self.patched)
+        self.patched={}
+
+    def counts(self):
+        """Operations done by the simulated devices."""
+        return {'grating_moves':self.mc.moves,'filter_steps':self.fw.steps,'shutter_toggles':self.shutter.toggles,'picoa_reads':self.picoa.reads}
+
+def start_device_sim(**options):
+    """Connects a simulated bench, see DeviceSim. Call stop() on the returned bench to put back the real devices."""
+    return DeviceSim(**options).__enter__()
@@ -0,0 +1,330 @@
+import csv
+import math
+import time
+import statistics
+
+"""Dry-run time estimates of the experiment plans. The moves, filter changes, shutter toggles, picoammeter samples, darks and camera frames
+of MC_run_exp, qe.get_qe_data and ptc.run_ptc are walked in the same order and overlap as the experiment runs them, without touching any
+device, and costed with CostModel. Phases have the same names as in benchmark.py."""
+
+HOME_WL=631.26 #nm #home wavelength of the scan controller
+STEPS_PER_NM=9000 #microsteps #1nm = 9000 microsteps
+FILTER_EDGES=[240,350,500,605,700] #nm #default of fwapi.update_filter_change_map
+
+class CostModel:
+    """Time in s of each device operation, from the sleeps and polling in the driver modules.
+    Inputs:
+        :rate(float): scan controller speed in microsteps/s
+        :poll(float): wait before each status read of a move or homing, waittime of movestat and checkstatus
+        :io(float): one serial command and its reply
+        :read(float): one picoammeter :READ? of both channels, 2*nplc/60+0.01 if None
+        :nplc(float): picoammeter integration time in power line cycles
+        :setup(float): picoammeter_initialize
+        :readout(float): camera readout and server overhead of each frame"""
+    def __init__(self,rate=23000,poll=1.0,io=0.02,read=None,nplc=1,setup=1.0,readout=1.0):
+        self.rate=rate
+        self.poll=poll
+        self.io=io
+        self.read=2*nplc/60+0.01 if read is None else read
+        self.setup=setup
+        self.readout=readout
+
+    @classmethod
+    def from_latency(cls,filename,**options):
+        """Cost model with the serial and picoammeter times measured in a run, from the <basename>_latency.csv or latency.csv it saved.
+        Inputs:
+            :filename(string): csv saved by latency.LatencyRecorder.to_csv
+            :options: other CostModel inputs
+        Returns:
+            ::CostModel"""
+        with open(filename,newline='') as fp:
+            rows=[row for row in csv.DictReader(fp) if row['complete_p50']]
+        reads=[float(row['complete_p50'])/1e3 for row in rows if row['command']==':READ?']
+        serial=[float(row['complete_p50'])/1e3 for row in rows if row['command']!=':READ?']
+        if reads:
+            options.setdefault('read',reads[0])
+        if serial:
+            options.setdefault('io',statistics.median(serial))
+        return cls(**options)
+
+    def move(self,wlstart,wlend):
+        """mcapi.go_to_from, polled every poll s until the grating stops."""
+        travel=abs(wlend-wlstart)*STEPS_PER_NM/self.rate
+        polls=max(1,math.ceil(travel/self.poll))
+        return self.io+polls*(self.poll+self.io)+(self.io if polls>1 else 0) #move, status reads, stop
+
+    def home(self,wl):
+        """mcapi.home from a wavelength, the run at constant velocity past the home flag and the fixed backlash and flag finding waits."""
+        wl+=8 #+72000 steps before homing
+        travel=abs(wl-HOME_WL)*STEPS_PER_NM/self.rate
+        fixed=0.8+4+3+15 if wl>=HOME_WL else 0.8+3+2+12 #sleeps of the two branches of home
+        return 8*self.io+(1+math.ceil(travel/self.poll))*(self.poll+self.io)+fixed
+
+    def filter_position(self):
+        """fw.get_fw_position."""
+        return 1+3*self.io
+
+    def filter_set(self,current,target):
+        """fw.set_fw_to_position, one slot at a time in increasing order."""
+        steps=(target-current)%5
+        return self.filter_position()+3+steps*(1+1+3+4*self.io+3+self.filter_position()+3)
+
+    def shutter(self):
+        return self.io
+
+    def sample(self,nsamples):
+        """picoa_get_measurement_ranged, ranges set then nsamples readings."""
+        return 4*self.io+nsamples*self.read
+
+    def frame(self,exptime,nburst=1):
+        """One NUVU bias, dark or exposure command."""
+        return exptime*nburst+self.readout
+
+class Estimate:
+    """Time estimate of a plan, split into phases on the critical path. Time of steps that run while a longer step runs is kept in overlapped.
+    Inputs:
+        :plan(string): name of the plan
+        :settings(dictionary): plan inputs"""
+    def __init__(self,plan,settings):
+        self.plan=plan
+        self.settings=settings
+        self.phases={}
+        self.overlapped={}
+        self.counts={}
+        self.points=0
+
+    def add(self,phase,seconds,count=1):
+        self.phases[phase]=self.phases.get(phase,0.0)+seconds
+        self.counts[phase]=self.counts.get(phase,0)+count
+
+    def parallel(self,*branches):
+        """Steps that start together, each branch a list of (phase, seconds) run one after another. The longest branch is on the critical path."""
+        branches=[branch for branch in branches if branch]
+        if not branches:
+            return
+        longest=max(branches,key=lambda branch:sum(seconds for phase,seconds in branch))
+        for branch in branches:
+            for phase,seconds in branch:
+                if branch is longest:
+                    self.add(phase,seconds)
+                else:
+                    self.overlapped[phase]=self.overlapped.get(phase,0.0)+seconds
+                    self.counts[phase]=self.counts.get(phase,0)+1
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+    def dominant(self,fraction=0.2):
+        """Phases taking at least fraction of the total, longest first.
+        Returns:
+            ::list of (phase, seconds)"""
+        total=self.total
+        return [(phase,seconds) for phase,seconds in sorted(self.phases.items(),key=lambda item:-item[1]) if total and seconds>=fraction*total]
+
+    def summary(self):
+        """Dictionary of the estimate, like the results of benchmark.run_workload."""
+        live=sum(self.phases.get(phase,0.0) for phase in ('sample','exposure'))
+        total=self.total
+        return {'plan':self.plan,'points':self.points,'total_s':round(total,1),'points_per_hour':round(3600*self.points/total,2) if total else None,
+                'dead_time_fraction':round(1-live/total,4) if total else None,
+                'phases':{phase:round(seconds,1) for phase,seconds in sorted(self.phases.items(),key=lambda item:-item[1])},
+                'overlapped':{phase:round(seconds,1) for phase,seconds in self.overlapped.items()},'counts':dict(self.counts),
+                'dominant':[phase for phase,seconds in self.dominant()]}
+
+    def report(self,start=None):
+        """Prints the total, the end time and the phases, with the dominant ones marked.
+        Inputs:
+            :start(float): start time as time.time(), now if None"""
+        total=self.total
+        end=(time.time() if start is None else start)+total
+        print(f"{self.plan}: {self.points} points in {total/3600:.2f} h, ends at {time.strftime('%a %H:%M',time.localtime(end))}")
+        dominant=dict(self.dominant())
+        for phase,seconds in sorted(self.phases.items(),key=lambda item:-item[1]):
+            flag=' <- dominant' if phase in dominant else ''
+            print(f"  {phase:<12} {seconds/60:>8.1f} min {seconds/total if total else 0:>6.1%} {self.counts.get(phase,0):>6} calls{flag}")
+        for phase,seconds in self.overlapped.items():
+            print(f"  {phase:<12} {seconds/60:>8.1f} min hidden behind longer steps")
+
+def filter_edges():
+    """Filter change wavelengths of Filter_change_map.csv, FILTER_EDGES if the map cannot be read."""
+    try:
+        import fwapi as fw
+        return [float(edge) for edge in fw.get_filter_change_map()['Change_Wavelength']]
+    except Exception:
+        return FILTER_EDGES
+
+def filter_for(wl,edges):
+    """Filter fw.which_filter selects for a wavelength."""
+    if wl<100 or wl>700:
+        return 1
+    for filternum,edge in enumerate(edges,1):
+        if wl<=edge:
+            return filternum
+    return None
+
+def photodiode_scan(start_wl,end_wl,wl_step,nsamples=50,edges=None,dark_every=None,min_darks=3,max_age=1800.0,max_points=10,wl=HOME_WL,filternum=1,costs=None,adaptive=None):
+    """Estimate of PhotodiodeLinux.MC_run_exp.
+    Inputs:
+        :start_wl(float): wavelength in nm
+        :end_wl(float): wavelength in nm
+        :wl_step(float): interval between wavelengths in nm
+        :nsamples(integer): picoammeter readings per point
+        :edges(list): filter change wavelengths, from Filter_change_map.csv if None
+        :dark_every(integer): points between darks, None follows the dark model (min_darks darks, then one every max_age s or max_points points), 0 takes only the pre and post darks
+        :min_darks(integer): darks measured before the dark model is used
+        :max_age(float): s after the last dark when the dark model takes a new one
+        :max_points(integer): points after the last dark when the dark model takes a new one
+        :wl(float): grating wavelength before the scan in nm
+        :filternum(integer): filter before the scan
+        :costs(CostModel): device costs, CostModel() if None
+        :adaptive(AdaptiveSampler or dictionary): sampler of an adaptive scan or its inputs, refinement passes are costed with adaptive_passes
+    Returns:
+        ::Estimate"""
+    costs=CostModel() if costs is None else costs
+    edges=filter_edges() if edges is None else edges
+    if isinstance(adaptive,dict):
+        import adaptive as adapt
+        adaptive=adapt.AdaptiveSampler(**adaptive)
+    est=Estimate('MC_run_exp',{'start_wl':start_wl,'end_wl':end_wl,'wl_step':wl_step,'nsamples':nsamples,'dark_every':dark_every,
+                               'adaptive':adaptive.settings() if adaptive is not None else None})
+    wavelengths=[] #same stepping as MC_run_exp
+    current=start_wl
+    while current<=end_wl:
+        wavelengths.append(current)
+        current=current+wl_step
+    if not wavelengths:
+        return est
+    est.add('setup',costs.setup)
+    est.add('home',costs.home(wl))
+    est.add('move',costs.move(HOME_WL,start_wl))
+    est.add('filter',costs.filter_position())
+    est.add('other',3) #pause before the first filter change
+    select=filter_for(start_wl,edges)
+    if select!=filternum:
+        est.add('filter',costs.filter_set(filternum,select))
+        filternum=select
+    est.add('shutter',costs.shutter())
+    est.add('dark',costs.sample(nsamples)) #pre dark
+    passes=[wavelengths]+(adaptive_passes(wavelengths,adaptive) if adaptive is not None else [])
+    ndarks,last_dark,since=1,est.total,0
+    position=start_wl
+    for npass,pass_wls in enumerate(passes):
+        if npass>0: #approach from below and filter change before a refinement pass, nothing overlaps them
+            for approach_wl in adaptive.approach(position,pass_wls[0]):
+                est.add('move',costs.move(position,approach_wl))
+                position=approach_wl
+            select=filter_for(pass_wls[0],edges)
+            if select is not None and select!=filternum:
+                est.add('filter',costs.filter_set(filternum,select))
+                filternum=select
+        for idx,current in enumerate(pass_wls):
+            if dark_every is None:
+                needs_dark=ndarks<min_darks or est.total-last_dark>max_age or since>=max_points
+                since=0 if needs_dark else since+1
+            else:
+                needs_dark=dark_every>0 and est.points%dark_every==dark_every-1
+            if needs_dark:
+                est.add('dark',costs.sample(nsamples))
+                ndarks,last_dark=ndarks+1,est.total
+            est.add('shutter',costs.shutter())
+            est.add('sample',costs.sample(nsamples))
+            branches=[[('shutter',costs.shutter())]] #close, the data writer saves in the background
+            position=current
+            if idx+1<len(pass_wls):
+                branches.append([('move',costs.move(current,pass_wls[idx+1]))])
+                position=pass_wls[idx+1]
+                select=filter_for(pass_wls[idx+1],edges)
+                if select is not None and select!=filternum:
+                    branches.append([('filter',costs.filter_set(filternum,select))])
+                    filternum=select
+            est.parallel(*branches)
+            est.points+=1
+    est.add('dark',costs.sample(nsamples)) #post dark
+    est.add('home',costs.home(position))
+    return est
+
+def adaptive_passes(wavelengths,sampler):
+    """Refinement passes of an adaptive scan in the worst case, where every interval is off by more than the tolerance. Each pass splits
+    the widest intervals of at least 2*min_step until the budget of the sampler is used, so the estimate is an upper bound.
+    Inputs:
+        :wavelengths(list): coarse grid in nm
+        :sampler(AdaptiveSampler): sampler of the scan, only its settings are used
+    Returns:
+        ::list of passes, each an increasing list of wavelengths"""
+    known=sorted(wavelengths)
+    passes=[]
+    while True:
+        candidates=sorted(((x1-x0,x0,x1) for x0,x1 in zip(known,known[1:]) if x1-x0>=2*sampler.min_step),reverse=True)
+        if sampler.budget is not None:
+            candidates=candidates[:max(sampler.budget-len(known),0)]
+        if not candidates:
+            return passes
+        new_wls=sorted(float(round((x0+x1)/2,4)) for width,x0,x1 in candidates)
+        passes.append(new_wls)
+        known=sorted(known+new_wls)
+
+def qe_scan(wl_min,wl_max,exp_time,step,flist=[1,2,3],nburst=1,wl=HOME_WL,filternum=1,costs=None):
+    """Estimate of qe.get_qe_data.
+    Inputs:
+        :wl_min(float): wavelength in nm
+        :wl_max(float): wavelength in nm
+        :exp_time(float): exposure time in seconds
+        :step(float): interval between wavelengths in nm
+        :flist(list): filters scanned
+        :nburst(integer): number of images in each exposure burst
+        :wl(float): grating wavelength before the scan in nm
+        :filternum(integer): filter before the scan
+        :costs(CostModel): device costs, CostModel() if None
+    Returns:
+        ::Estimate"""
+    import numpy as np
+    costs=CostModel() if costs is None else costs
+    est=Estimate('get_qe_data',{'wl_min':wl_min,'wl_max':wl_max,'exp_time':exp_time,'step':step,'flist':list(flist),'nburst':nburst})
+    wl_list=np.arange(wl_min,wl_max+step,step) #same list as get_qe_data
+    est.add('setup',costs.setup)
+    for filtnum in flist:
+        for idx,next_wl in enumerate(wl_list):
+            bias=[('bias',costs.frame(0))]
+            if idx==0: #filter, homing and move to the first wavelength overlap the bias frame
+                est.parallel([('filter',costs.filter_set(filternum,filtnum))],[('home',costs.home(wl)),('move',costs.move(HOME_WL,next_wl))],bias)
+                filternum=filtnum
+            else:
+                est.parallel([('move',costs.move(wl,next_wl))],bias)
+            est.add('camera dark',costs.frame(exp_time)) #photodiode is sampled during the frames
+            est.add('exposure',costs.frame(exp_time,nburst))
+            wl=next_wl
+            est.points+=1
+    return est
+
+def ptc_ladder(exptimes=None,filtnum=1,current_filter=1,costs=None):
+    """Estimate of ptc.run_ptc.
+    Inputs:
+        :exptimes(list): exposure times in s, ptc.EXPTIMES if None
+        :filtnum(integer): filter of the ladder
+        :current_filter(integer): filter before the ladder
+        :costs(CostModel): device costs, CostModel() if None
+    Returns:
+        ::Estimate"""
+    costs=CostModel() if costs is None else costs
+    if exptimes is None:
+        import ptc
+        exptimes=ptc.EXPTIMES
+    est=Estimate('run_ptc',{'exptimes':len(exptimes),'filtnum':filtnum})
+    est.add('filter',costs.filter_set(current_filter,filtnum))
+    for et in exptimes:
+        est.add('bias',2*costs.frame(0),2) #pre and post bias
+        est.add('camera dark',2*costs.frame(et),2) #pre and post dark
+        est.add('exposure',2*costs.frame(et),2) #two flats
+        est.points+=1
+    return est
+
+def compare(estimates):
+    """Prints estimates of alternative plans side by side.
+    Inputs:
+        :estimates(dictionary): label to Estimate, such as {'1 nm':photodiode_scan(200,700,1),'2 nm':photodiode_scan(200,700,2)}"""
+    print(f"{'plan':<16} {'points':>7} {'hours':>7} {'points/hour':>12} {'dead time':>10}  dominant")
+    for label,est in estimates.items():
+        result=est.summary()
+        dead=result['dead_time_fraction']
+        print(f"{label:<16} {result['points']:>7} {result['total_s']/3600:>7.2f} {result['points_per_hour'] or 0:>12} {0 if dead is None else dead:>10.1%}  {', '.join(result['dominant'])}")
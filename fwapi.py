@@ -1,22 +1,14 @@
 import time
-import pyvisa as visa
 import datetime
 import os
 import sys
 import codecs
-import pandas as pd
-import serial
-import serial.tools.list_ports
 import numpy as np
-import PhotodiodeLinux as mclinux
-import shutterapi as shutter
-import monochromatorapi as mcapi
-import port_utils as pt
-import command
-import serial.tools.list_ports
+import instruments
 import time
 import codecs
-import serial
+import lazy
+pd=lazy.module('pandas') #imported on first use
 
 """McPherson 747 Filter Wheel Controller commands using variables stored in command.py"""
 
@@ -67,6 +59,7 @@ def which_filter(current_wl):
     except:
         return("Some error has occured. Please check the wavelength input")
 
+@instruments.releases_ports
 def set_fw_to_position(filternum,FWPort):
     """Increments filter wheel position for any filter.
     Inputs:
@@ -107,14 +100,7 @@ def connect_FW(FWPort):
         ::Error message if exception occured"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=FWPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per FW manual. bits/sec
-                            timeout = None, #per FW manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per FW manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per FW manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per FW manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per FW manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(FWPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         return ser
     except Exception as ex:
@@ -138,6 +124,7 @@ def enquiry(ser):
     assert ack == ack_check, "ACK not received. Instead got: "+repr(ack)
     return ack
 
+@instruments.releases_ports
 def get_fw_position(FWPort):
     """Opens serial connection, sends enquire and recieves acknowledgement. 
         Creates several header entities and sends them to the controller. Reads response, gets acknowledgement, closes connection.
@@ -176,6 +163,7 @@ def get_fw_position(FWPort):
     print(f"Filter Wheel is at position {position}")
     return position
 
+@instruments.releases_ports
 def increment_fw_position(FWPort):
     """Opens serial connection, sends enquire and recieves acknowledgement. Creates several header entities and sends them to the controller. 
         Reads response, gets acknowledgement, closes connection.
@@ -0,0 +1,378 @@
+import time
+import atexit
+import threading
+import contextlib
+import functools
+import serial
+import port_utils as pt
+import latency
+
+"""Registry of pooled instrument connections. Each physical device gets one session that is opened on first use, shared by every experiment module and closed at exit."""
+
+SERIAL_SETTINGS={'baudrate':9600, #per 789A-4, 747 and VCMD1 manuals. bits/sec
+                 'timeout':None, #Add time when sending or recieveing transmissions
+                 'xonxoff':True, #Software flow control between computer and device
+                 'parity':serial.PARITY_NONE, #Checks if byte is even or odd
+                 'stopbits':serial.STOPBITS_ONE, #Adds stop byte after transmission ends
+                 'bytesize':serial.EIGHTBITS} #Number of data bits in transmission
+
+VISA_SETTINGS={'baud_rate':9600, #6482 front panel: RS-232, 9600 Baud
+               'data_bits':8, #8 data bits
+               'parity':0, #visa.constants.Parity.none
+               'flow_control':0} #visa.constants.VI_ASRL_FLOW_NONE
+
+class InstrumentSession:
+    """One pooled connection to a device, used by one thread at a time.
+    Inputs:
+        :name(string): device path or VISA resource
+        :opener(function): opens and returns a new connection
+        :retries(integer): reconnect attempts before giving up
+        :backoff(float): wait in s before the first reconnect attempt, doubled for each further attempt"""
+    def __init__(self,name,opener,retries=3,backoff=0.5):
+        self.name=name
+        self.opener=opener
+        self.retries=retries
+        self.backoff=backoff
+        self.label=name #device alias used in the latency table
+        self.lock=threading.RLock()
+        self.conn=None
+        self.opens=0 #connections opened, more than one means reconnects happened
+
+    def connection(self):
+        """The open connection, opened now if needed."""
+        if self.conn is None or not getattr(self.conn,'is_open',True):
+            self.conn=self.opener()
+            self.opens+=1
+        return self.conn
+
+    def reconnect(self):
+        """Closes the connection and opens it again, retrying with backoff while the device is away, such as after a USB-serial dropout."""
+        self.close()
+        wait=self.backoff
+        for attempt in range(self.retries):
+            time.sleep(wait)
+            try:
+                return self.connection()
+            except Exception as ex:
+                print(f"Reconnect to {self.name} failed, attempt {attempt+1} of {self.retries}. Error: {ex}")
+                wait*=2
+        raise ConnectionError(f"Could not reconnect to {self.name}")
+
+    def close(self):
+        """Closes the connection. The next use opens it again."""
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn=None
+
+class InstrumentRegistry:
+    """Pooled sessions for the serial and VISA devices, keyed by the physical port so aliases of the same device share a session.
+    Inputs:
+        :path(string): port database used to resolve aliases"""
+    def __init__(self,path="port_database.csv"):
+        self.path=path
+        self.sessions={}
+        self.lock=threading.Lock()
+        self.resource_manager=None
+        self.backend=None #opens connections in place of pyserial and PyVISA, see transcript.py
+
+    def set_backend(self,backend):
+        """Closes every session and opens the next connections through backend(kind,label,opener) instead of opener(), None for the real devices."""
+        self.close_all()
+        self.backend=backend
+
+    def _open(self,kind,session,opener):
+        if self.backend is not None:
+            return self.backend(kind,session.label,opener)
+        return opener()
+
+    def _label(self,resolver,port):
+        return next((alias for alias,path in resolver.ports.items() if path==port),port)
+
+    def serial(self,name,**settings):
+        """Session for a serial device.
+        Inputs:
+            :name(string): alias such as 'MCPort', adapter serial number or device path
+            :settings: pyserial settings replacing SERIAL_SETTINGS
+        Returns:
+            ::InstrumentSession"""
+        resolver=pt.get_resolver(self.path)
+        port=resolver.resolve(name)
+        options={**SERIAL_SETTINGS,**settings}
+        with self.lock:
+            if port not in self.sessions:
+                session=InstrumentSession(port,None)
+                session.label=self._label(resolver,port)
+                session.opener=lambda:self._open('serial',session,lambda:serial.Serial(port=port,**options))
+                self.sessions[port]=session
+            return self.sessions[port]
+
+    def visa(self,name):
+        """Session for a VISA serial instrument such as the picoammeter.
+        Inputs:
+            :name(string): alias such as 'PicoPort' or a resource string such as 'ASRL/dev/ttyUSB3::INSTR'
+        Returns:
+            ::InstrumentSession"""
+        resolver=pt.get_resolver(self.path)
+        resource=name if name.upper().startswith('ASRL') else resolver.visa(name)
+        with self.lock:
+            if resource not in self.sessions:
+                session=InstrumentSession(resource,None)
+                session.label=self._label(resolver,resolver.resolve(resource))
+                session.opener=lambda:self._open('visa',session,lambda:self._open_visa(resource))
+                self.sessions[resource]=session
+            return self.sessions[resource]
+
+    def _open_visa(self,resource):
+        if self.resource_manager is None:
+            import pyvisa as visa
+            self.resource_manager=visa.ResourceManager()
+        conn=self.resource_manager.open_resource(resource)
+        for name,value in VISA_SETTINGS.items():
+            setattr(conn,name,value)
+        return conn
+
+    @contextlib.contextmanager
+    def use(self,name,kind='serial'):
+        """Exclusive use of a device's connection. A connection error closes the session so the next use reconnects.
+        Inputs:
+            :name(string): device alias, port or VISA resource
+            :kind(string): 'serial' or 'visa'
+        Returns:
+            ::open connection, held by this thread until the block ends"""
+        session=self.visa(name) if kind=='visa' else self.serial(name)
+        with session.lock:
+            try:
+                yield session.connection()
+            except (serial.SerialException,OSError):
+                session.close()
+                raise
+
+    def close_all(self):
+        """Closes every session."""
+        with self.lock:
+            for session in self.sessions.values():
+                with session.lock:
+                    session.close()
+            self.sessions={}
+
+    def status(self):
+        """Open state and number of opens of each session."""
+        return {name:{'open':session.conn is not None,'opens':session.opens} for name,session in self.sessions.items()}
+
+registry=None #shared InstrumentRegistry, see get_registry
+
+def get_registry():
+    """Shared registry, closed when Python exits."""
+    global registry
+    if registry is None:
+        registry=InstrumentRegistry()
+        atexit.register(registry.close_all)
+    return registry
+
+held_handles=threading.local() #SerialHandles each thread has open, see releases_ports
+
+def _held():
+    if not hasattr(held_handles,'handles'):
+        held_handles.handles=[]
+    return held_handles.handles
+
+def releases_ports(func):
+    """Decorator for driver functions. Hands back every serial session the function opened and did not close, also when it
+    returned from an except block or raised, so a failed command never leaves the device locked for other threads."""
+    @functools.wraps(func)
+    def wrapper(*args,**kwargs):
+        handles=_held()
+        start=len(handles)
+        try:
+            return func(*args,**kwargs)
+        finally:
+            while len(handles)>start:
+                handles[-1].close()
+    return wrapper
+
+class SerialHandle:
+    """Pooled stand-in for the serial.Serial objects the driver functions make. open() takes the session for this thread
+    and clears stale input, close() hands it back, so the open/close pairs in the drivers no longer open the port each time.
+    Functions using it are wrapped in releases_ports, or use it in a with block, so the session is handed back on errors too.
+    Every write starts a command in latency.recorder, the reads after it until the next write or close are its response.
+    Reads take the first byte on its own so the time to the first byte of a reply is measured apart from the rest.
+    Inputs:
+        :session(InstrumentSession): session of the device"""
+    def __init__(self,session):
+        self.session=session
+        self.held=0
+        self.command=None #[command, start ns, write ns, first byte ns, end ns, bytes sent, bytes received]
+
+    def open(self):
+        self.session.lock.acquire()
+        if self.held==0:
+            _held().append(self)
+        self.held+=1
+        try:
+            self.session.connection().reset_input_buffer()
+        except (serial.SerialException,OSError): #port dropped out since the last use
+            try:
+                self.session.reconnect().reset_input_buffer()
+            except Exception:
+                self.close()
+                raise
+
+    def close(self):
+        self.end_command()
+        if self.held:
+            handles=_held()
+            if self in handles:
+                handles.remove(self)
+        while self.held:
+            self.held-=1
+            self.session.lock.release()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    @property
+    def is_open(self):
+        return self.held>0
+
+    def end_command(self):
+        """Records the command in progress."""
+        if self.command is not None:
+            command,start,write,first,end,sent,received=self.command
+            self.command=None
+            latency.recorder.record(self.session.label,command,sent,received,write,first,end)
+
+    def received(self,data,start):
+        now=time.perf_counter_ns()
+        if self.command is None: #read without a command, such as draining the buffer
+            self.command=['(read)',start,0,None,0,0,0]
+        if data:
+            if self.command[3] is None:
+                self.command[3]=now-self.command[1]
+            self.command[6]+=len(data)
+        self.command[4]=now-self.command[1]
+        return data
+
+    def write(self,data):
+        self.end_command()
+        start=time.perf_counter_ns()
+        try:
+            n=self.session.connection().write(data)
+        except serial.SerialException:
+            n=self.session.reconnect().write(data) #port dropped out, data was not sent
+        write=time.perf_counter_ns()-start
+        self.command=[data,start,write,None,write,len(data),0]
+        return n
+
+    def flush(self):
+        return self.session.connection().flush()
+
+    def read(self,size=1):
+        connection=self.session.connection()
+        start=time.perf_counter_ns()
+        data=self.received(connection.read(min(size,1)),start)
+        if data and size>1:
+            data+=self.received(connection.read(size-1),start)
+        return data
+
+    def read_until(self,expected=b'\n',size=None):
+        connection=self.session.connection()
+        start=time.perf_counter_ns()
+        data=self.received(connection.read(1),start) #first byte alone, the rest of the reply follows it
+        while data and not data.endswith(expected) and (size is None or len(data)<size):
+            more=connection.read_until(expected[-1:],None if size is None else size-len(data)) #last byte of the terminator, then check all of it
+            if not more: #timeout
+                break
+            data+=self.received(more,start)
+        return data
+
+    def readline(self):
+        return self.read_until(b'\n')
+
+    def readlines(self):
+        connection=self.session.connection()
+        start=time.perf_counter_ns()
+        first=self.received(connection.read(1),start)
+        lines=connection.readlines()
+        self.received(b''.join(lines),start)
+        if first:
+            if lines and not first.endswith(b'\n'):
+                lines[0]=first+lines[0]
+            else:
+                lines.insert(0,first)
+        return lines
+
+    @property
+    def in_waiting(self):
+        return self.session.connection().in_waiting
+
+    @property
+    def timeout(self):
+        return self.session.connection().timeout
+
+    @timeout.setter
+    def timeout(self,value):
+        self.session.connection().timeout=value #shared by every user of the session, put back SERIAL_SETTINGS['timeout'] after
+
+class VisaHandle:
+    """Pooled PyVISA resource that records the latency of every write, read and query. VISA reads return whole messages,
+    so the first byte and complete times of a query are the same. Other attributes, such as the terminations, go to the resource.
+    Inputs:
+        :session(InstrumentSession): session of the device"""
+    def __init__(self,session):
+        object.__setattr__(self,'session',session)
+
+    def __getattr__(self,name):
+        return getattr(self.session.connection(),name)
+
+    def __setattr__(self,name,value):
+        setattr(self.session.connection(),name,value)
+
+    def write(self,cmd):
+        with self.session.lock:
+            start=time.perf_counter_ns()
+            n=self.session.connection().write(cmd)
+            write=time.perf_counter_ns()-start
+        latency.recorder.record(self.session.label,cmd,len(cmd),0,write,None,write)
+        return n
+
+    def read(self):
+        with self.session.lock:
+            start=time.perf_counter_ns()
+            response=self.session.connection().read()
+            end=time.perf_counter_ns()-start
+        latency.recorder.record(self.session.label,'(read)',0,len(response),0,end,end)
+        return response
+
+    def query(self,cmd):
+        with self.session.lock: #write and read of one query are not split by another thread
+            conn=self.session.connection()
+            start=time.perf_counter_ns()
+            conn.write(cmd)
+            write=time.perf_counter_ns()-start
+            response=conn.read()
+            end=time.perf_counter_ns()-start
+        latency.recorder.record(self.session.label,cmd,len(cmd),len(response),write,end,end)
+        return response
+
+def serial_port(port):
+    """Pooled serial connection for a driver function, see SerialHandle.
+    Inputs:
+        :port(string): device path or alias
+    Returns:
+        ::SerialHandle"""
+    return SerialHandle(get_registry().serial(port))
+
+def visa_resource(name):
+    """Pooled VISA resource, see VisaHandle.
+    Inputs:
+        :name(string): alias such as 'PicoPort' or a resource string such as 'ASRL/dev/ttyUSB3::INSTR'
+    Returns:
+        ::VisaHandle"""
+    return VisaHandle(get_registry().visa(name))
@@ -0,0 +1,152 @@
+import re
+import csv
+import threading
+
+"""Latency of every serial and VISA command, recorded by the pooled sessions in instruments.py. Times are taken with time.perf_counter_ns
+and kept in HDR style histograms per device and command, so the cost is the same for a short test as for an overnight scan."""
+
+SUB_BUCKET_BITS=5 #32 sub-buckets per power of two, values are kept to about 3%
+
+class Histogram:
+    """Log-linear histogram of integer values such as latencies in ns. Values below 2**SUB_BUCKET_BITS are exact,
+    larger ones are rounded down to SUB_BUCKET_BITS significant bits."""
+    def __init__(self):
+        self.counts={}
+        self.count=0
+        self.total=0
+        self.min=None
+        self.max=None
+
+    def bucket(self,value):
+        shift=max(value.bit_length()-SUB_BUCKET_BITS,0)
+        return (value>>shift)<<shift #lowest value of the bucket
+
+    def record(self,value):
+        value=max(int(value),0)
+        key=self.bucket(value)
+        self.counts[key]=self.counts.get(key,0)+1
+        self.count+=1
+        self.total+=value
+        self.min=value if self.min is None else min(self.min,value)
+        self.max=value if self.max is None else max(self.max,value)
+
+    def percentile(self,p):
+        """Value below which p percent of the recorded values fall, None if nothing was recorded."""
+        if not self.count:
+            return None
+        rank=p/100*self.count
+        seen=0
+        for key in sorted(self.counts):
+            seen+=self.counts[key]
+            if seen>=rank:
+                return min(max(key,self.min),self.max)
+        return self.max
+
+    def mean(self):
+        return self.total/self.count if self.count else None
+
+    def merge(self,other):
+        for key,n in other.counts.items():
+            self.counts[key]=self.counts.get(key,0)+n
+        self.count+=other.count
+        self.total+=other.total
+        for value in (other.min,other.max):
+            if value is not None:
+                self.min=value if self.min is None else min(self.min,value)
+                self.max=value if self.max is None else max(self.max,value)
+
+def command_key(data):
+    """Groups commands that differ only in their numeric arguments, such as b'+72000 \\r' and b'+36000 \\r' as '+#'.
+    Inputs:
+        :data(bytes or string): command sent
+    Returns:
+        ::command name"""
+    if isinstance(data,bytes):
+        data=data.decode('latin-1')
+    data=data.strip()
+    data=re.sub(r'[-+]?\d+(\.\d*)?([eE][-+]?\d+)?',lambda m:m.group(0)[0]+'#' if m.group(0)[0] in '+-' else '#',data)
+    data=''.join(c if c.isprintable() else f'\\x{ord(c):02x}' for c in data)
+    return data[:24] or '(empty)'
+
+class CommandStats:
+    """Histograms of one command on one device."""
+    def __init__(self):
+        self.write=Histogram() #ns to send the command
+        self.first=Histogram() #ns from the start of the write to the first byte of the response
+        self.complete=Histogram() #ns from the start of the write to the end of the response
+        self.sent=0
+        self.received=0
+
+class LatencyRecorder:
+    """Latency statistics per device and command.
+    Inputs:
+        :enabled(boolean): record commands"""
+    def __init__(self,enabled=True):
+        self.enabled=enabled
+        self.stats={}
+        self.lock=threading.Lock()
+
+    def record(self,device,command,sent,received,write_ns,first_ns,complete_ns):
+        """Adds one command. first_ns is None if no response was read.
+        Inputs:
+            :device(string): device alias or port
+            :command(bytes or string): command sent, grouped with command_key
+            :sent(integer): bytes sent
+            :received(integer): bytes received
+            :write_ns(integer): time to send in ns
+            :first_ns(integer): time to the first byte received in ns
+            :complete_ns(integer): time to the end of the response in ns"""
+        if not self.enabled:
+            return
+        key=(device,command_key(command))
+        with self.lock:
+            stats=self.stats.get(key)
+            if stats is None:
+                stats=self.stats[key]=CommandStats()
+            stats.write.record(write_ns)
+            if first_ns is not None:
+                stats.first.record(first_ns)
+            stats.complete.record(complete_ns)
+            stats.sent+=sent
+            stats.received+=received
+
+    def reset(self):
+        with self.lock:
+            self.stats={}
+
+    def table(self):
+        """One row per device and command with counts, bytes and latency percentiles in ms, slowest total time first.
+        Returns:
+            ::list of dictionaries"""
+        ms=lambda ns:None if ns is None else round(ns/1e6,3)
+        rows=[]
+        with self.lock:
+            items=list(self.stats.items())
+        for (device,command),stats in items:
+            rows.append({'device':device,'command':command,'count':stats.complete.count,
+                         'bytes_sent':stats.sent,'bytes_received':stats.received,
+                         'write_p50':ms(stats.write.percentile(50)),'write_p99':ms(stats.write.percentile(99)),
+                         'first_p50':ms(stats.first.percentile(50)),'first_p99':ms(stats.first.percentile(99)),
+                         'complete_p50':ms(stats.complete.percentile(50)),'complete_p90':ms(stats.complete.percentile(90)),
+                         'complete_p99':ms(stats.complete.percentile(99)),'complete_max':ms(stats.complete.max),
+                         'total_s':round(stats.complete.total/1e9,3)})
+        rows.sort(key=lambda row:-row['total_s'])
+        return rows
+
+    def to_csv(self,filename):
+        """Saves the table to a csv file."""
+        rows=self.table()
+        if not rows:
+            return
+        with open(filename,'w',newline='') as fp:
+            writer=csv.DictWriter(fp,fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def print_table(self,limit=20):
+        """Prints the commands that took the most time."""
+        print(f"{'device':<10} {'command':<24} {'count':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'total s':>9}")
+        for row in self.table()[:limit]:
+            print(f"{row['device']:<10} {row['command']:<24} {row['count']:>6} {row['complete_p50']:>9} {row['complete_p99']:>9} {row['complete_max']:>9} {row['total_s']:>9}")
+
+recorder=LatencyRecorder() #shared by all sessions
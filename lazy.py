@@ -0,0 +1,24 @@
+import importlib
+
+"""Modules loaded on first use, so importing the drivers stays fast and does not need every dependency installed."""
+
+class LazyModule:
+    """Stand-in for a module that imports it the first time one of its attributes is used.
+    Inputs:
+        :name(string): module name, such as 'pandas'"""
+    def __init__(self,name):
+        self._name=name
+        self._module=None
+
+    def __getattr__(self,attr):
+        if self._module is None:
+            self._module=importlib.import_module(self._name)
+        return getattr(self._module,attr)
+
+    def __repr__(self):
+        state='loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module {self._name}, {state}>"
+
+def module(name):
+    """Lazily imported module, use as pd=lazy.module('pandas') at the top of a driver module."""
+    return LazyModule(name)
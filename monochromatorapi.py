@@ -1,14 +1,13 @@
 import codecs
+import re
 import time
-import serial
-import pandas as pd
-import numpy as np
-import pyvisa as visa
+import instruments
+import lazy
 import datetime
 import os
 import sys
-from yaml import scan
 import port_utils as pt
+np = lazy.module('numpy') #imported on first use, a status query does not need it
 
 """Commands for McPherson 789-A Scan Controller movement and status"""
 
@@ -18,8 +17,9 @@ def whereishome():
         ::None
     Return: 
         ::Home wavelnegth(float)"""
-    return float(np.round(631.26,2))
+    return 631.26
 
+@instruments.releases_ports
 def checkstatus(MCPort,waittime=1):
     """Gives value of limit switch to determine if the scan controller is at a wavelength greater than or less than home wavelength. Used in home function.(our home is 631.26nm)
     Return values are taken from McPherson 789A-4 scan controller manual.
@@ -34,14 +34,7 @@ def checkstatus(MCPort,waittime=1):
         :: Error message due to improper connection"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         time.sleep(waittime) #gives time to readout full message from serial reciever
         ser.open() #open ser conection for write command
@@ -63,6 +56,7 @@ def checkstatus(MCPort,waittime=1):
         msg =f"Limit Status Could Not Be Read. Error Code: {ex}"
         return msg
 
+@instruments.releases_ports
 def stop(MCPort):
     """Immediate stop of scan controller. Command which is a part of homing procedure.
         Inputs:
@@ -71,14 +65,7 @@ def stop(MCPort):
             ::Error message if exception occurs."""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(b'@ \r'); #ASCII key for soft stop sent as byte
@@ -92,6 +79,7 @@ def stop(MCPort):
         print(msg)
         return 
 
+@instruments.releases_ports
 def home(MCPort):
     """Moves the scan controller from any wavelength to home. Important for conducting other movement functions that assume you begin at home.
         Home function power cycling needed rarely due to error in function.
@@ -103,14 +91,7 @@ def home(MCPort):
         ::Error message and code when exception occurs"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open()
         ser.write(b'+72000 \r'); #increase wavelength for 2 motor revolutions to prevent power switch issue seen during testing
@@ -226,6 +207,7 @@ def home(MCPort):
         print(msg)
         return
 
+@instruments.releases_ports
 def movestat(MCPort,waittime=1):
     """Checks if scan controller is moving or not. Used in movement functions so once a movement is stopped the code moves to the next line in the function.
     Return values are taken from McPherson 789A-4 scan controller manual.
@@ -241,14 +223,7 @@ def movestat(MCPort,waittime=1):
             ::Error message if exception occurs"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         time.sleep(waittime) #user input of time to read moving status
         ser.open() #open ser conection for write command
@@ -274,6 +249,42 @@ def movestat(MCPort,waittime=1):
         print(msg)
         return movenow,msg
 
+@instruments.releases_ports
+def readposition(MCPort,timeout=2.0):
+    """Reads the position counter of the scan controller with Z. Used to check the grating position when a scan is resumed.
+    Z is not in the command list of the 789A-4 manual used for the other functions, so the read gives up after timeout instead of
+    waiting forever, and anything but a Z reply with a step count is treated as no position.
+        Inputs:
+            :MCPort(string): Serial Port connection
+            :timeout(float): seconds to wait for the reply
+        Returns:
+            ::Step count (int), changes by 9000 microsteps per nm, up for longer wavelengths
+            ::Error message if the position could not be read"""
+    try:
+        #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
+        ser.close() #close open ser connection
+        ser.open() #open ser conection for write command
+        ser.timeout = timeout #bounded read, the port normally waits forever
+        try:
+            ser.write(b'Z \r'); #read position counter
+            s=ser.read_until(size=None)
+        finally:
+            ser.timeout = instruments.SERIAL_SETTINGS['timeout']
+        ser.close()
+        read = codecs.decode(s,errors='replace')
+        match = re.search(r'Z\s+([+-]?\d+)',read) #reply is the command followed by the step count
+        if match is None:
+            msg = f"Position Could Not Be Read. No step count in reply {read!r}"
+            print(msg)
+            return msg
+        return int(match.group(1))
+    except Exception as ex:
+        msg =f"Position Could Not Be Read. Error Code: {ex}"
+        print(msg)
+        return msg
+
+@instruments.releases_ports
 def go_to_fromhome(MCPort,wl):
     """Moves scan controller to one wavelength starting from home wavelength. Movements converts wavelength to mechanical steps and revolutions, then to bytes sent to scan controller.
         Inputs:
@@ -300,14 +311,7 @@ def go_to_fromhome(MCPort,wl):
             gotostr = bytes(tempstr, 'ascii')
         if lowlim < wl < uplim:
             #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-            ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                                baudrate = 9600, #per 789A-4 manual. bits/sec
-                                timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                                xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                                parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                                stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                                bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                                )      
+            ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
             ser.close() #close open ser connection
             ser.open() #open ser conection for write command
             ser.write(gotostr); #command to move scan controller sent as bytes
@@ -333,6 +337,7 @@ def go_to_fromhome(MCPort,wl):
         print(msg)
         return
 
+@instruments.releases_ports
 def go_to_from(MCPort,wlstart,wlend):
     """Moves scan controller from wlstart to wlend wavelength. Movements converts wavelength to mechanical steps and revolutions, then to bytes sent to scan controller.
         Inputs:
@@ -364,14 +369,7 @@ def go_to_from(MCPort,wlstart,wlend):
             gotostr = bytes(tempstr, 'ascii')
         if lowlim < wlend < uplim:
             #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-            ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                                baudrate = 9600, #per 789A-4 manual. bits/sec
-                                timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                                xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                                parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                                stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                                bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                                )      
+            ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
             ser.close() #close open ser connection
             ser.open() #open ser conection for write command
             ser.write(gotostr); 
@@ -399,6 +397,7 @@ def go_to_from(MCPort,wlstart,wlend):
 
 """Original commands to communicate through putty to 789A-4 controller. refer to manual for details on commands"""
 
+@instruments.releases_ports
 def initialize(MCPort): 
     """Original command for putty from device manual. Used for diagnostics in communication.
     Tests if scan controller serial parameters are correct and if port to scan controller is closed or open. 
@@ -409,14 +408,7 @@ def initialize(MCPort):
         ::Error message if exception occured"""
     try: 
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(b' \r'); #ASCII key for pressing enter on keyboard sent as byte
@@ -451,6 +443,7 @@ def makescanarray(wlstart,wlend,wlstep,exposuretimes):
     else: 
         raise ValueError("Incorrect data type. Expecting float or Numpy Array") 
 
+@instruments.releases_ports
 def moveit(MCPort,move):
     """Continous scanning movement at given speed. Must run stop command to stop.
         Inputs:
@@ -464,14 +457,7 @@ def moveit(MCPort,move):
         move2bytes = bytes(strmove, 'ascii')
         print(f"MUST RUN mcapi.stop(port) TO STOP CONTINUOUS MOTION!")
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(move2bytes); #continuous move
@@ -493,6 +479,7 @@ def moveit(MCPort,move):
         print(msg)
         return
 
+@instruments.releases_ports
 def param(MCPort):
     """Parameters for scan controller. Lists values of ramp speed, starting velocity, scanning velocity respectively.
         Inputs:
@@ -502,14 +489,7 @@ def param(MCPort):
             ::Error message if exception occurs"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(b'X \r'); #X=K(ramp speed),I(starting velocity),V(scanning velocity)
@@ -524,6 +504,7 @@ def param(MCPort):
         print(msg)
         return
 
+@instruments.releases_ports
 def rspeed(MCPort,Rspeed):
     """Scanning ramp speed.
         Inputs:
@@ -536,14 +517,7 @@ def rspeed(MCPort,Rspeed):
         stringRspeed = (f'K{Rspeed}' + '\r')
         speed2bytes = bytes(stringRspeed, 'ascii')
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(speed2bytes); #ramp speed
@@ -558,6 +532,7 @@ def rspeed(MCPort,Rspeed):
         print(msg)
         return
 
+@instruments.releases_ports
 def startvel(MCPort,Startvel):
     """Starting velocity of scan controller.
         Inputs:
@@ -570,14 +545,7 @@ def startvel(MCPort,Startvel):
         stringStartvel = (f'I{Startvel}' + '\r')
         Startvel2bytes = bytes(stringStartvel, 'ascii')
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(Startvel2bytes); #starting velocity
@@ -592,6 +560,7 @@ def startvel(MCPort,Startvel):
         print(msg)
         return
 
+@instruments.releases_ports
 def scanvel(MCPort,Scanvel):
     """Scanning velocity.
         Inputs:
@@ -604,14 +573,7 @@ def scanvel(MCPort,Scanvel):
         stringScanvel = (f'G{Scanvel}' + '\r')
         Scanvel2bytes = bytes(stringScanvel, 'ascii')
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(Scanvel2bytes); #scanning velocity
@@ -626,6 +588,7 @@ def scanvel(MCPort,Scanvel):
         print(msg)
         return
 
+@instruments.releases_ports
 def edge(MCPort):
     """Finds edge of limit switch when scan controller is close to home. Slow scanning speed of 4500 steps/rev. Must run hcircuit and acircuit functions before running this command.
         Inputs:
@@ -635,14 +598,7 @@ def edge(MCPort):
             ::Exception if error occurs"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(b'F4500,0 \r'); #find edge. home swtich must be blocked. motor moves upward 4500steps/sec
@@ -656,6 +612,7 @@ def edge(MCPort):
         print(msg)
         return
 
+@instruments.releases_ports
 def hcircuit(MCPort):
     """Switches home circuit to on. Used for fine, slow movements.
         Inputs:
@@ -665,14 +622,7 @@ def hcircuit(MCPort):
             ::Error message if exception occurs"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(b'A8 \r'); #enable home circuit
@@ -685,6 +635,7 @@ def hcircuit(MCPort):
         print(msg)
         return
 
+@instruments.releases_ports
 def dcircuit(MCPort):
     """Switches home circuit to off. Used for fine, slow movements.
         Inputs:
@@ -694,14 +645,7 @@ def dcircuit(MCPort):
             ::Error message if exception occurs"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(b'A0 \r'); #Disable Home Circuit
@@ -714,6 +658,7 @@ def dcircuit(MCPort):
         print(msg)
         return
 
+@instruments.releases_ports
 def acircuit(MCPort):
     """Switches home accuracy circuit to on. Used for fine, slow movements.
         Inputs:
@@ -723,14 +668,7 @@ def acircuit(MCPort):
             ::Error message if exception occurs"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(b'A24 \r'); #home accuracy circuit enabled
@@ -743,6 +681,7 @@ def acircuit(MCPort):
         print(msg)
         return
 
+@instruments.releases_ports
 def exep(MCPort,progname):
     """Runs user's premade scan controller movement program from files.
         Inputs:
@@ -755,14 +694,7 @@ def exep(MCPort,progname):
         strprog = (f'G{progname}' + '\r')
         prog2bytes = bytes(strprog, 'ascii')
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(prog2bytes); #exectues program 
@@ -776,6 +708,7 @@ def exep(MCPort,progname):
         print(msg)
         return
 
+@instruments.releases_ports
 def store(MCPort):
     """Saves current scan controller parameters to non-volitile memory.
         Inputs:
@@ -785,14 +718,7 @@ def store(MCPort):
             ::Error message if exception occurs"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(b'S \r'); #store parameters 
@@ -806,6 +732,7 @@ def store(MCPort):
         print(msg)
         return
 
+@instruments.releases_ports
 def clear(MCPort):
     """Erases current scan controller parameters.
         Inputs:
@@ -815,14 +742,7 @@ def clear(MCPort):
             ::Error message if exception occurs"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(b'C1 \r'); #clear
@@ -836,6 +756,7 @@ def clear(MCPort):
         print(msg)
         return
 
+@instruments.releases_ports
 def reset(MCPort):
     """Stops movement of scan controller. Assumes idle state.
         Inputs:
@@ -845,14 +766,7 @@ def reset(MCPort):
             ::Error message if exception occurs"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(b'^C \r'); #Reset
@@ -866,6 +780,7 @@ def reset(MCPort):
         print(msg)  
         return
 
+@instruments.releases_ports
 def exit(MCPort):
     """Exit program mode. Run before closing code window.
         Inputs:
@@ -875,14 +790,7 @@ def exit(MCPort):
             ::Error message if exception occurs"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=MCPort, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per 789A-4 manual. bits/sec
-                            timeout = None, #per 789A-4 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per 789A-4 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per 789A-4 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per 789A-4 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per 789A-4 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(MCPort) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser conection for write command
         ser.write(b'P \r'); #enter or exit
@@ -1,30 +1,179 @@
 import time
-import pyvisa as visa
 import datetime
 from datetime import datetime,timedelta
 import os.path
 import os
 import sys
 import codecs
-import pandas as pd
 import logging
 import subprocess
 from subprocess import Popen, PIPE, STDOUT
+import socket
+import json
+import threading
 import serial
 import serial.tools.list_ports
 import numpy as np
-import matplotlib.pyplot as plt
-import command
 import shutterapi as shutter
 import fwapi as fw
 import monochromatorapi as mcapi
 import PhotodiodeLinux as mclinux
 import port_utils as pt
-import ptc as ptc
+from port_utils import MCPort,FWPort #port database aliases, resolved by the instrument registry
+import checkpoint as ckpt
+import lazy
+pd = lazy.module('pandas') #imported on first use
 #import clr # Import the .NET class library
 
 """NUVU controller commands for connecting to server, using shutter, and camera controls. Uses variables in command.py and port_utils.py."""
 
+CAM_COMM='/home/nuvu_setup/nuvu/nuvuserver/server_CIT/bin/cam_cit' #command line client of camserver_cit
+CAMSERVER_HOST='localhost' #host running camserver_cit
+CAMSERVER_PORT=None #TCP port for a direct line connection to camserver_cit, not confirmed on the bench yet. None runs cam_cit
+
+class NuvuCamera:
+    """Camera client that keeps one cam_cit process open instead of running cam_cit in a shell for every setting.
+    Commands such as 'burst 1', 'exptime 2.0', 'dark', 'imno' or 'path' are written as lines to its input and every command
+    prints one reply line. With a port it instead keeps one TCP connection open to camserver_cit and sends the same lines.
+    Settings and the action are sent together in one batch, and settings that have not changed since the last write, such as burst 1, are skipped.
+    The image number is counted locally. It is read from the server once at start and checked every sync_every frames.
+    Inputs:
+        :cam_comm(string): cam_cit command, may include arguments such as the interpreter of a simulated client
+        :host(string): host running camserver_cit
+        :port(integer): TCP port of camserver_cit, None to use cam_cit
+        :timeout(float): seconds to wait for a TCP reply, None waits until the exposure is done
+        :sync_every(integer): frames between checks of the local image number against the server"""
+    def __init__(self,cam_comm=CAM_COMM,host=CAMSERVER_HOST,port=CAMSERVER_PORT,timeout=None,sync_every=50):
+        self.cam_comm=cam_comm
+        self.host=host
+        self.port=port
+        self.proc=None
+        self.sock=None
+        if port is None: #one cam_cit for the whole session
+            self.proc=subprocess.Popen(cam_comm,shell=True,stdin=subprocess.PIPE,stdout=subprocess.PIPE,text=True,bufsize=1)
+            self.writer,self.reader=self.proc.stdin,self.proc.stdout
+        else:
+            self.sock=socket.create_connection((host,port),timeout=timeout)
+            self.writer=self.sock.makefile('w',encoding='ascii',newline='\n')
+            self.reader=self.sock.makefile('r',encoding='ascii',newline='\n')
+        self.settings={} #last value written for each setting
+        self.sync_every=sync_every
+        self.imno=None #image number of the next frame, None until synced with the server
+        self.frames_since_sync=0
+
+    def _batch(self,commands):
+        """Sends commands in one write and reads one reply line per command.
+        Inputs:
+            :commands(list): command strings without line endings
+        Returns:
+            ::list of replies
+            ::ConnectionError if cam_cit or the server stopped answering"""
+        try:
+            self.writer.write(''.join(cmd+'\n' for cmd in commands))
+            self.writer.flush()
+        except OSError as ex:
+            self.settings={} #camera state unknown after a dropped connection
+            self.imno=None
+            raise ConnectionError(f"camera connection closed before '{commands[0]}'. Error: {ex}")
+        replies=[]
+        for cmd in commands:
+            res=self.reader.readline()
+            if res=='':
+                self.settings={}
+                self.imno=None
+                raise ConnectionError(f"camera connection closed during '{cmd}'")
+            replies.append(res.strip())
+        return replies
+
+    def _changed(self,settings):
+        """Setting commands for values that differ from the cached ones."""
+        return [f'{name} {value}' for name,value in settings.items() if self.settings.get(name)!=str(value)]
+
+    def set(self,**settings):
+        """Writes settings that changed, for example set(burst=1,exptime=2.0).
+        Returns:
+            ::number of settings written"""
+        commands=self._changed(settings)
+        if commands:
+            self._batch(commands)
+            self.settings.update({name:str(value) for name,value in settings.items()})
+        return len(commands)
+
+    def sync(self):
+        """Reads the image number from the server and resets the local counter to it.
+        Returns:
+            ::image number of the next frame"""
+        server_imno=int(self.query('imno'))
+        if self.imno is not None and server_imno!=self.imno:
+            print(f"Warning: local image number {self.imno} does not match camera server {server_imno}. Using the server value.")
+        self.imno=server_imno
+        self.frames_since_sync=0
+        return self.imno
+
+    def acquire(self,action,**settings):
+        """Writes changed settings and runs an action in one batch. Returns when the server has finished the action.
+        Inputs:
+            :action(string): 'bias', 'dark' or 'expose'
+            :settings: setting values for the action
+        Returns:
+            ::image number of the first frame taken"""
+        if self.imno is None:
+            self.sync()
+        commands=self._changed(settings)+[action]
+        self._batch(commands)
+        self.settings.update({name:str(value) for name,value in settings.items()})
+        first=self.imno
+        self.imno+=int(self.settings.get('burst','1'))
+        self.frames_since_sync+=1
+        if self.frames_since_sync>=self.sync_every:
+            self.sync()
+        return first
+
+    def query(self,name):
+        """Reads a value from the server, such as imno or path.
+        Returns:
+            ::reply string"""
+        return self._batch([name])[0]
+
+    def bias(self):
+        """Take bias frame, no exposure and shutter closed."""
+        return self.acquire('bias',burst=1,exptime=0.0)
+
+    def dark(self,exptime):
+        """Take dark frame with exposure time.
+        Inputs:
+            :exptime(float): exposure time in seconds"""
+        return self.acquire('dark',burst=1,exptime=exptime)
+
+    def expose(self,exptime,nburst=1):
+        """Burst of images for exposure.
+        Inputs:
+            :exptime(float): exposure time in seconds
+            :nburst(integer): number of images in the burst"""
+        return self.acquire('expose',burst=nburst,exptime=exptime)
+
+    def getpath(self):
+        """Data directory of the camera server."""
+        return self.query('path')
+
+    def getimno(self):
+        """Image number of the next frame from the local counter."""
+        if self.imno is None:
+            return self.sync()
+        return self.imno
+
+    def close(self):
+        """Ends cam_cit or closes the connection to the camera server."""
+        try:
+            self.writer.close() #cam_cit exits at the end of its input
+            self.reader.close()
+            if self.proc is not None:
+                self.proc.wait(timeout=10)
+            if self.sock is not None:
+                self.sock.close()
+        except Exception as ex:
+            print(f"Error! Camera connection already closed. Error {ex}")
+
 def start_camserver(ros):
     """Open NUVU controller camera server.
     Inputs:
@@ -108,15 +257,20 @@ def getimno(cam_comm):
         print(msg)
         return
 
-def run_dark_exp(exptime=None):
+def run_dark_exp(exptime=None,camera=None):
     """Dark exposure.
+    Inputs:
+        :exptime(list): exposure times in seconds
+        :camera(NuvuCamera): open camera server connection, one is opened if None
     Returns:
         ::directory path verification prompt to user
         ::exposure time default if no exptime value specified
         ::loop messages for darks and biases taken
         ::error message if controller server cannot connect"""
     try:
-        data_dir = getpath() #run getpath to return cam_comm variable with path flag
+        if camera is None: #one connection for all exposure times
+            camera = NuvuCamera()
+        data_dir = camera.getpath() #data directory of the camera server
         print(f'The current working directory is {data_dir}') 
         val = input("Is this the correct data directory? (Y/N)") #prompt user to verify file location
         if val == 'Y': #If Yes, continue in code
@@ -146,17 +300,14 @@ def run_dark_exp(exptime=None):
         for et in exptime: #for item in exposure time array
             fp = open(fn, 'a+') #open directory with a+
             t1 = time.time() #add current computer time
-            imb1 = getimno() #add image number for pre-bias
-            bias() #run bias function as specified above
+            imb1 = camera.bias() #image number of the pre-bias
 
             print(f'Exposure time is {et} seconds') #current exposure time for dark
-            imd = getimno() #add image number for dark
-            dark(et) #run dark function as specified above with exposure time
+            imd = camera.dark(et) #image number of the dark
             t2 = time.time() #add current computer time
             print('Finished dark exposure.')
 
-            imb2 = getimno() #add image number for post-bias
-            bias() #run bias function as specified above
+            imb2 = camera.bias() #image number of the post-bias
             t3 = time.time() #add current computer time
             print(f'Exposure time is {t3-t2} seconds') 
             i=i+1 #add one to counter to move to next exposure time
@@ -190,69 +341,87 @@ def exposure_burst(exptime,nburst,cam_comm):
         msg = f"Could not open Nuvu camera server. Error {ex}"
         return msg
 
-def exposure_wt_pdiode(exptime,nburst,picoa,picoa_filename,cam_comm):
-    """Exposure to photodiode specification.
+def acquire_wt_pdiode(camera,action,picoa,picoa_filename,exptime,nburst=1,interval=0.1):
+    """Runs a camera frame and samples the picoammeter on a separate thread for exactly as long as the frame takes.
     Inputs:
-        :exptime(integer): exposure time in seconds
-        :nburst(integer): number of bursts
-        :picoa(string): picoammeter 
+        :camera(NuvuCamera): open camera server connection
+        :action(string): 'dark' or 'expose'
+        :picoa(string): rm.open_resource(asrl)
         :picoa_filename(string): directory for picoammeter data to be saved
-        :cam_comm(string): directory address for camera controller server
+        :exptime(float): exposure time in seconds
+        :nburst(integer): number of images in the burst
+        :interval(float): shortest time between picoammeter readings in seconds
     Returns:
-        ::error message if NUVU controller server not connecting"""
+        ::image number of the first frame
+        ::DataFrame of Ch1, Ch2, Elapsed_time samples, time in seconds from the start of the frame
+        ::error message if the camera or picoammeter could not be read"""
     try:
-        exposure_burst(exptime,nburst,cam_comm) #run function specified above
-        p=subprocess.Popen(command2,shell=True) #run command in shell
-        picoaflag=0 #counter to zero
-        while True:
-            if picoaflag == 0: 
-                picodata = mclinux.picoa_get_measurement_nosave(picoa,0.1,10) #run preliminary check
-                picoaflag = 1 #change value after taking measurement with no save
-                if p.poll() == 0: #save data
-                    picodata.to_csv(picoa_filename) #save data to csv
-                    break
-            else: 
-                picodata=pd.concat([picodata,mclinux.picoa_get_measurement_nosave(picoa,interval=0.1,nsamples=5)],ignore_index=True) #?
-                if p.poll() == 0: #save data
-                    picodata.to_csv(picoa_filename) #save data to csv
-                break
+        done=threading.Event() #set when the camera server reports the frame finished
+        samples=[]
+        errors=[]
+        def sample():
+            while not done.is_set():
+                try:
+                    t_send=time.perf_counter()
+                    rawout=mclinux.PICOA_Request(picoa,':READ?').strip()
+                    t_recv=time.perf_counter()
+                except Exception as ex:
+                    errors.append(ex)
+                    return
+                if t_send<=t_end[0]: #reading started before the frame ended
+                    samples.append([float(v) for v in rawout.split(',')]+[(t_send+t_recv)/2-t_start])
+                done.wait(interval)
+        t_end=[float('inf')] #replaced by the frame end time
+        sampler=threading.Thread(target=sample,daemon=True)
+        t_start=time.perf_counter()
+        sampler.start()
+        try:
+            if action=='dark':
+                imno=camera.dark(exptime)
+            else:
+                imno=camera.expose(exptime,nburst)
+        finally:
+            t_end[0]=time.perf_counter()
+            done.set()
+            sampler.join()
+        if errors:
+            print(f"Picoammeter stopped sampling during the frame. Error {errors[0]}")
+        picodata=pd.DataFrame(samples,columns=['Ch1','Ch2','Elapsed_time'])
+        picodata.to_csv(picoa_filename) #save data to csv
+        print(f"{len(picodata)} picoammeter samples during {t_end[0]-t_start:.2f} s frame")
+        return imno,picodata
     except Exception as ex:
-        msg = f"Could not open Nuvu camera server. Error {ex}"
+        msg = f"Could not take frame with photodiode. Error {ex}"
         print(msg)
         return
 
-def dark_wt_pdiode(exptime,nburst,picoa,picoa_filename,cam_comm):
-    """Explanation
+def exposure_wt_pdiode(exptime,nburst,picoa,picoa_filename,camera):
+    """Exposure with the photodiode sampled for the length of the exposure.
+    Inputs:
+        :exptime(integer): exposure time in seconds
+        :nburst(integer): number of bursts
+        :picoa(string): picoammeter 
+        :picoa_filename(string): directory for picoammeter data to be saved
+        :camera(NuvuCamera): open camera server connection
+    Returns:
+        ::image number and picoammeter DataFrame
+        ::error message if NUVU controller server not connecting"""
+    return acquire_wt_pdiode(camera,'expose',picoa,picoa_filename,exptime,nburst)
+
+def dark_wt_pdiode(exptime,nburst,picoa,picoa_filename,camera):
+    """Dark with the photodiode sampled for the length of the dark.
     Inputs:
-        :exptime(integer):
-        :nburst(integer):
-        :picoa(string):
-        :picoa_filename(string):
-        :cam_comm(string):
+        :exptime(integer): exposure time in seconds
+        :nburst(integer): number of bursts, darks are taken one frame at a time
+        :picoa(string): picoammeter
+        :picoa_filename(string): directory for picoammeter data to be saved
+        :camera(NuvuCamera): open camera server connection
     Returns:
+        ::image number and picoammeter DataFrame
         ::error message if NUVU controller not connecting"""
-    try:
-        dark(exptime, cam_comm) #run dark function as specified above
-        p=subprocess.Popen(command2,shell=True) #run in shell
-        picoaflag=0 #set value to zero
-        while True:
-            if picoaflag==0: 
-                picodata= mclinux.picoa_get_measurement_nosave(picoa,0.1,10) #run preliminary check
-                picoaflag==1 #change value after taking measurement with no save
-                if p.poll()==0: #save data
-                    picodata.to_csv(picoa_filename) #save data to csv
-                    break
-            else: 
-                picodata=pd.concat([picodata,mclinux.picoa_get_measurement_nosave(picoa,interval=0.1,nsamples=5)],ignore_index=True)#?
-                if p.poll()==0: #save data
-                    picodata.to_csv(picoa_filename) #save data to csv
-                break
-    except Exception as ex:
-        msg = f"Could not open Nuvu camera server. Error {ex}"
-        print(msg)
-        return
+    return acquire_wt_pdiode(camera,'dark',picoa,picoa_filename,exptime)
 
-def scan_with_nuvu(wl_min,wl_max,exp_time,step,lamp,nburst=1,flist=[1]):
+def scan_with_nuvu(wl_min,wl_max,exp_time,step,lamp,nburst=1,flist=[1],camera=None,checkpoint=None):
     """Experiment example running NUVU controller with scanning implemented
     Inputs:
         :wl_min(integer): wavelength in nm
@@ -262,13 +431,18 @@ def scan_with_nuvu(wl_min,wl_max,exp_time,step,lamp,nburst=1,flist=[1]):
         :lamp(string): Xe=Xenon, D2=Deuterium lamp selected
         :nburst(integer): number of burst
         :flist(integer): item in array for filter list slots
+        :camera(NuvuCamera): open camera server connection, one is opened if None
+        :checkpoint(ScanCheckpoint): checkpoint to resume from, see checkpoint.resume. A new scan writes scan_checkpoint.json in the data directory
     Returns:
         ::directory path verification prompt to user
         ::exposure time default if no exptime value specified
         ::loop messages for darks,biases,exposures taken
+        ::checkpoint saved after every wavelength
         ::error message if NUVU controller not connecting"""
     try: 
-        data_dir = getpath() #function specified above
+        if camera is None: #one connection for the whole scan
+            camera = NuvuCamera()
+        data_dir = camera.getpath() #data directory of the camera server
         print(f'The current working directory is {data_dir}')
         val = input("Is this the correct data directory? (Y/N)") #prompt user to verify file location
         if val == 'Y': #If Yes, continue in code
@@ -287,9 +461,18 @@ def scan_with_nuvu(wl_min,wl_max,exp_time,step,lamp,nburst=1,flist=[1]):
             log.setLevel(logging.INFO)
             log.info("Starting PTC data collection ")
             log.info(f"Saving data and log in {data_dir}")
-        t0 = datetime.datetime.now() #computer time
+        t0 = datetime.now() #computer time
         log.info(f'Start time={t0}')
         fn = data_dir + 'scan_log.csv' #add flag to directory
+        log_fn = data_dir + 'scan_log.jsonl'
+        wl_list=np.arange(wl_min,wl_max+step,step) #create array of wavelengths from input variables
+        resumed = checkpoint is not None
+        if checkpoint is None:
+            plan = {'wl_min':wl_min,'wl_max':wl_max,'exp_time':exp_time,'step':step,'lamp':lamp,'nburst':nburst,'flist':list(flist)}
+            checkpoint = ckpt.ScanCheckpoint(data_dir+'scan_checkpoint.json','scan_with_nuvu',plan,[[f,wl] for f in flist for wl in wl_list])
+        frame_log = ExperimentLog(log_fn,start=checkpoint.starts.get(log_fn)) #frames are written as they are taken
+        checkpoint.starts[log_fn] = frame_log.start
+        checkpoint.save()
         dir = os.path.dirname(logfilename) 
         if not os.path.exists(dir): #create folder for data to be saved
             log.info("Log directory does not exist. Making one!")
@@ -300,68 +483,59 @@ def scan_with_nuvu(wl_min,wl_max,exp_time,step,lamp,nburst=1,flist=[1]):
         else:
             writeheader = False
             log.info("Log file exits in this folder.")
-        wl_list=np.arange(wl_min,wl_max+step,step) #create array of wavelengths from input variables
-        for filtnum in flist: #for current filter
+        nwl = len(wl_list)
+        for fi,filtnum in enumerate(flist): #for current filter
+            if all(checkpoint.is_done(fi*nwl+idx) for idx in range(nwl)): #filter finished before the scan was resumed
+                continue
             log.info(f"Scanning for filer number {filtnum}") #add movement to file
             fw.set_fw_to_position(filtnum,FWPort) #move to position
             current_wl=mcapi.whereishome #return home wavelength
             for idx,next_wl in enumerate(wl_list): #run loop for each wavlength in scan
-                if idx==0: 
-                    mcapi.go_to_fromhome(MCPort,next_wl) #move from home to first wavlength in array
+                if checkpoint.is_done(fi*nwl+idx):
+                    continue
+                if resumed: #first point after resuming
+                    ckpt.resume_position(MCPort,checkpoint,next_wl)
+                    resumed = False
+                elif idx==0: 
+                    ckpt.home_to(MCPort,checkpoint,next_wl) #move from home to first wavlength in array, step count saved for a resume
                 else: 
                     mcapi.go_to_from(MCPort,current_wl,next_wl) #move from current wavlength to next wavelength in array
                 log.info(f"Monochromator at {next_wl} nm") #add movement to file
-                t1 = datetime.datetime.now() #current computer time
+                t1 = datetime.now() #current computer time
                 log.info(f'Taking pre-bias') #add message in data file
-                imno = getimno() #run image number function specified above
-                time.sleep(0.2) #sleep for .2 seconds
+                imno = camera.bias() #image number of the bias from the camera's local counter
                 imtype='Bias' #add bias flag
-                if idx==0: 
-                    log_df=pd.DataFrame(get_log_data(imtype,exp_time,imno,next_wl,lamp)) #?
-                else: 
-                    temp_df=pd.DataFrame(get_log_data(imtype,exp_time,imno,next_wl,lamp)) #?
-                    log_df=pd.concat([log_df,temp_df],ignore_index=True)
-                bias() #run bias function specified above
-                time.sleep(0.2)
+                frame_log.append(imtype,exp_time,imno,next_wl,lamp,filtnum)
 
                 log.info(f'Taking Dark with exposure time ={exp_time} seconds') #add message in data file
-                imno = getimno() #run image number function specified above
-                time.sleep(0.2)
+                imno = camera.dark(exp_time) #run dark function with exposure time specified above
                 imtype='Dark' #add bias flag
-                temp_df=pd.DataFrame(get_log_data(imtype,exp_time,imno,next_wl,lamp)) #?
-                log_df=pd.concat([log_df,temp_df],ignore_index=True) #?
-                dark(exp_time) #run dark function with exposure time specified above
-                time.sleep(0.2)
+                frame_log.append(imtype,exp_time,imno,next_wl,lamp,filtnum)
 
                 log.info(f'Taking Exposure for {next_wl} nm with exposure time ={exp_time} seconds') #add message in data file
-                imno = getimno() #run image number function specified above
-                time.sleep(0.2)
+                imno = camera.getimno() #next image number from the local counter
                 imtype='Exposure' #add exposure flag
-                temp_df=pd.DataFrame(get_log_data(imtype,exp_time,imno,next_wl,lamp)) #?
-                log_df=pd.concat([log_df,temp_df],ignore_index=True) #?
+                frame_log.append(imtype,exp_time,imno,next_wl,lamp,filtnum)
                 #exposure_burst(exp_time,nburst)
                 current_wl=next_wl #change value to set up for next scan controller movement
-                time.sleep(0.2)
 
-                imno = getimno() #?
                 log.info(f'Taking post-bias') #add message in data file
-                imno = getimno() #run image number function specified above
-                time.sleep(0.2)
+                imno = camera.bias() #run bias function specified above
                 imtype='Bias' #add (post?)bias flag
-                temp_df=pd.DataFrame(get_log_data(imtype,exp_time,imno,next_wl,lamp)) #?
-                log_df=pd.concat([log_df,temp_df],ignore_index=True) #?
-                bias() #run bias function specified above
-                time.sleep(0.2)
-                t2 = datetime.datetime.now() #current computer time
+                frame_log.append(imtype,exp_time,imno,next_wl,lamp,filtnum)
+                t2 = datetime.now() #current computer time
                 #et = int(et/2)
                 log.info(f"Exp {idx}, exptime {exp_time} ended at {t2}")
                 log.info(f'This exposure took {t2-t1} seconds')
-            t3 = datetime.datetime.now() #current computer time
+                frame_log.sync()
+                checkpoint.point_done(fi*nwl+idx,next_wl,filtnum,offsets={log_fn:frame_log.tell()})
+            t3 = datetime.now() #current computer time
             log.info(f'This fitler took {t3-t0} seconds')
-        t4 = datetime.datetime.now() #current computer time
+        t4 = datetime.now() #current computer time
         log.info(f'This fitler took {t4-t0} seconds')
         log.info(f'Saving data log in {fn}')
-        log_df.to_csv(fn) #show data in .csv as output
+        frame_log.close()
+        frame_log.to_dataframe().to_csv(fn) #show data in .csv as output
         log.info(f'Images saved in {data_dir}')
         log.info(f'Scan complete. See scan log in {logfilename}')
     except Exception as ex:
@@ -369,6 +543,82 @@ def scan_with_nuvu(wl_min,wl_max,exp_time,step,lamp,nburst=1,flist=[1]):
         print(msg)
         return
 
+class ExperimentLog:
+    """Append-only log of the frames taken in a scan. Each frame is written to disk as one JSON line as soon as it is taken,
+    so the log survives an interrupted run and adding a frame costs the same at any point of the run.
+    Inputs:
+        :filename(string): JSON lines file, appended to if it already exists
+        :fsync_every(integer): frames between forced writes to the disk
+        :start(integer): byte offset where this run's records begin, the end of the file if None. Set it to continue a resumed run"""
+    def __init__(self,filename,fsync_every=10,start=None):
+        self.filename=filename
+        self.fsync_every=fsync_every
+        self.fp=open(filename,'a')
+        self.start=self.fp.tell() if start is None else start #byte offset where this run's records begin
+        self.unsynced=0
+
+    def append(self,imtype,et,imno,wl,lamp='D2',filtnum=1):
+        """Writes one frame record.
+        Inputs:
+            :imtype(string): 'Bias'.'Dark','Exposure','Flat'
+            :et(float): exposure time in seconds
+            :imno(integer): image number
+            :wl(float): wavelength in nm
+            :lamp(string): Xe=Xenon, D2=Deuterium lamp selected
+            :filtnum(integer): filter in filter list"""
+        record={'time':datetime.now().isoformat(),'imtype':str(imtype),'Exp_time':float(et),'Lamp':str(lamp),
+                'wl':float(wl),'imno':None if imno is None else int(imno),'filtnum':None if filtnum is None else int(filtnum)}
+        self.fp.write(json.dumps(record)+'\n')
+        self.fp.flush()
+        self.unsynced+=1
+        if self.unsynced>=self.fsync_every:
+            self.sync()
+
+    def tell(self):
+        """Byte offset after the last record written."""
+        return self.fp.tell()
+
+    def sync(self):
+        """Forces written records onto the disk."""
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.unsynced=0
+
+    def to_dataframe(self,all_runs=False):
+        """Loads the records written so far.
+        Inputs:
+            :all_runs(boolean): include records from earlier runs appended to the same file
+        Returns:
+            ::DataFrame with time, imtype, Exp_time, Lamp, wl, imno, filtnum columns"""
+        if not self.fp.closed:
+            self.fp.flush()
+        return load_experiment_log(self.filename,offset=0 if all_runs else self.start)
+
+    def close(self):
+        """Syncs and closes the log file."""
+        if not self.fp.closed:
+            self.sync()
+            self.fp.close()
+
+def load_experiment_log(filename,offset=0):
+    """Reads a JSON lines experiment log. A partly written last line from an interrupted run is skipped.
+    Inputs:
+        :filename(string): JSON lines file written by ExperimentLog
+        :offset(integer): byte offset to start reading from
+    Returns:
+        ::DataFrame with time, imtype, Exp_time, Lamp, wl, imno, filtnum columns"""
+    records=[]
+    with open(filename) as fp:
+        fp.seek(offset)
+        for line in fp:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Skipping incomplete log line in {filename}")
+    log_df=pd.DataFrame(records,columns=['time','imtype','Exp_time','Lamp','wl','imno','filtnum'])
+    log_df['time']=pd.to_datetime(log_df['time'])
+    return log_df
+
 def get_log_data(imtype,et,imno,wl,lamp='D2',filtnum=1):
     """Set data header for log file used during data analysis.
     Inputs:
@@ -388,7 +638,7 @@ def get_log_data(imtype,et,imno,wl,lamp='D2',filtnum=1):
                 'wl': [],
                 'imno':[],
                 'filtnum':[]}
-        data['time'].append(datetime.datetime.now()) #current computer time
+        data['time'].append(datetime.now()) #current computer time
         data['imtype'].append(imtype)
         data['Exp_time'].append(et)
         data['Lamp'].append(lamp)
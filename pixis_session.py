@@ -0,0 +1,395 @@
+import time
+import threading
+import numpy as np
+
+"""PIXIS session layer over a LightField experiment. Caches setting writes and takes bias and dark frames in one acquisition.
+Does not import the .NET runtime, so it runs against FakeExperiment on Linux."""
+
+SHUTTER_NORMAL=2 #LightField ShutterTimingMode, shutter opens for the exposure
+SHUTTER_CLOSED=3 #LightField ShutterTimingMode, shutter stays closed
+TEMPERATURE_LOCKED=2 #LightField SensorTemperatureStatus.Locked
+
+class SettingNames:
+    """Stand-in for the LightField CameraSettings, ExperimentSettings and DeviceType enums. Every attribute is its own name."""
+    def __getattr__(self,name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return name
+
+class AcquisitionWaiter:
+    """Waits for LightField acquisitions through the ExperimentCompleted and IsReadyToRunChanged events.
+    If the events do not arrive it falls back to polling IsRunning and IsReadyToRun at a short interval, up to a deadline.
+    Inputs:
+        :experiment(Experiment): LightField experiment, or FakeExperiment
+        :poll(float): polling interval in s for the fallback
+        :startup(float): time in s the fallback waits past the expected time for IsRunning to show, Acquire can return before it does"""
+    def __init__(self,experiment,poll=0.05,startup=1.0):
+        self.experiment=experiment
+        self.poll=poll
+        self.startup=startup
+        self.completed=threading.Event()
+        self.ready=threading.Event()
+        self.started=threading.Event()
+        self.handlers=[]
+        for name,event in (('ExperimentCompleted',self.completed),('IsReadyToRunChanged',self.ready),('ExperimentStarted',self.started)):
+            self._subscribe(name,event)
+
+    def _subscribe(self,name,event):
+        """Adds a handler to a LightField event, skipped if the experiment does not have the event."""
+        def handler(sender,args):
+            event.set()
+        try:
+            hook=getattr(self.experiment,name)
+            hook+=handler
+            setattr(self.experiment,name,hook)
+        except Exception:
+            return
+        self.handlers.append((name,handler))
+
+    def close(self):
+        """Removes the event handlers."""
+        for name,handler in self.handlers:
+            try:
+                hook=getattr(self.experiment,name)
+                hook-=handler
+                setattr(self.experiment,name,hook)
+            except Exception:
+                pass
+        self.handlers=[]
+
+    def wait_ready(self,timeout=60.0):
+        """Waits until the experiment is ready to run.
+        Inputs:
+            :timeout(float): longest wait in s
+        Returns:
+            ::seconds waited"""
+        t0=time.monotonic()
+        deadline=t0+timeout
+        while not self.experiment.IsReadyToRun:
+            if time.monotonic()>deadline:
+                raise TimeoutError(f"PIXIS not ready after {timeout} s")
+            self.ready.wait(self.poll) #wakes early on IsReadyToRunChanged
+            self.ready.clear()
+        return time.monotonic()-t0
+
+    def acquire(self,expected=0.0,timeout=60.0):
+        """Starts an acquisition and waits for it to finish.
+        Inputs:
+            :expected(float): expected acquisition time in s. The polling fallback only takes the acquisition as finished once it saw it
+            running, or after expected plus the start-up time if it never did, so a bias does not return before it started
+            :timeout(float): time allowed past the expected time in s
+        Returns:
+            ::seconds from Acquire to completion"""
+        self.completed.clear()
+        self.started.clear()
+        t0=time.monotonic()
+        deadline=t0+expected+timeout
+        self.experiment.Acquire()
+        seen_running=False
+        while not self.completed.is_set():
+            running=self.experiment.IsRunning
+            seen_running=seen_running or running or self.started.is_set()
+            if not running and (seen_running or time.monotonic()-t0>=expected+self.startup):
+                break #polling fallback, the completed event did not arrive
+            if time.monotonic()>deadline:
+                raise TimeoutError(f"PIXIS acquisition did not finish within {expected+timeout:.1f} s")
+            self.completed.wait(self.poll)
+        return time.monotonic()-t0
+
+class PixisSession:
+    """Cached access to a LightField experiment.
+    Inputs:
+        :experiment(Experiment): LightField experiment, or FakeExperiment
+        :camera_settings: LightField CameraSettings, SettingNames() if None
+        :experiment_settings: LightField ExperimentSettings, SettingNames() if None
+        :camera_type: LightField DeviceType.Camera, 'Camera' if None
+        :poll(float): polling interval in s when acquisition events do not arrive
+        :timeout(float): time allowed past the expected acquisition time in s
+        :startup(float): time in s allowed for an acquisition to show as running when events do not arrive"""
+    def __init__(self,experiment,camera_settings=None,experiment_settings=None,camera_type=None,poll=0.05,timeout=60.0,startup=1.0):
+        self.experiment=experiment
+        self.cs=camera_settings if camera_settings is not None else SettingNames()
+        self.es=experiment_settings if experiment_settings is not None else SettingNames()
+        self.camera_type=camera_type if camera_type is not None else 'Camera'
+        self.waiter=AcquisitionWaiter(experiment,poll,startup)
+        self.timeout=timeout
+        self.wait_time=0.0 #time spent waiting for ready and completion
+        self.cache={} #last value written for each setting
+        self.writes=0 #SetValue calls sent to LightField
+        self.skipped=0 #writes skipped because the value was already set
+        self.camera=None #result of device_found, checked once per session
+
+    def set(self,setting,value):
+        """Writes a setting if it exists and differs from the last value written."""
+        if setting in self.cache and self.cache[setting]==value:
+            self.skipped+=1
+            return
+        if self.experiment.Exists(setting):
+            self.experiment.SetValue(setting,value)
+            self.cache[setting]=value
+            self.writes+=1
+
+    def get(self,setting):
+        """Reads a setting from LightField, None if it does not exist."""
+        if self.experiment.Exists(setting):
+            return self.experiment.GetValue(setting)
+
+    def invalidate(self,setting=None):
+        """Forgets cached values, all of them if setting is None. Use after LightField changed settings itself, such as loading an experiment."""
+        if setting is None:
+            self.cache.clear()
+            self.camera=None
+        else:
+            self.cache.pop(setting,None)
+
+    def device_found(self):
+        """Checks once per session that a camera is in the experiment."""
+        if self.camera is None:
+            self.camera=any(device.Type==self.camera_type for device in self.experiment.ExperimentDevices)
+            if not self.camera:
+                print("Camera not found. Please add a camera and try again.")
+        return self.camera
+
+    def wait_ready(self):
+        """Waits until the experiment is ready to run."""
+        self.wait_time+=self.waiter.wait_ready(self.timeout)
+
+    def acquire_frames(self,nframes,exposure_time,shutter_mode):
+        """Captures nframes frames in one LightField acquisition.
+        Inputs:
+            :nframes(integer): frames stored by the acquisition, saved as one file
+            :exposure_time(float): exposure time per frame, in LightField units (ms)
+            :shutter_mode(integer): SHUTTER_NORMAL or SHUTTER_CLOSED
+        Returns:
+            ::True if the acquisition ran"""
+        if not self.device_found():
+            return False
+        self.set(self.cs.ShutterTimingMode,shutter_mode)
+        self.set(self.cs.ShutterTimingExposureTime,exposure_time)
+        self.set(self.es.FrameSettingsFramesToStore,int(nframes))
+        self.wait_ready()
+        expected=nframes*float(exposure_time)/1000 #LightField exposure time is in ms
+        self.wait_time+=self.waiter.acquire(expected,self.timeout)
+        return True
+
+    def bias(self,nframes):
+        """Takes nframes zero second frames with the shutter closed."""
+        return self.acquire_frames(nframes,0,SHUTTER_CLOSED)
+
+    def dark(self,nframes,exposure_time):
+        """Takes nframes frames with the shutter closed."""
+        return self.acquire_frames(nframes,exposure_time,SHUTTER_CLOSED)
+
+    def expose(self,exposure_time,nframes=1):
+        """Takes nframes frames with the shutter open."""
+        return self.acquire_frames(nframes,exposure_time,SHUTTER_NORMAL)
+
+    def stats(self):
+        """Setting writes sent and skipped, and time spent waiting on LightField."""
+        return {'writes':self.writes,'skipped':self.skipped,'wait_time':self.wait_time}
+
+    def close(self):
+        """Removes the LightField event handlers."""
+        self.waiter.close()
+
+class TemperatureController:
+    """Sets the detector temperature and follows the cool-down on a background thread so other setup can run meanwhile.
+    Readings are logged and an exponential approach to the set point is fitted to them to predict the time to lock.
+    Inputs:
+        :session(PixisSession): session of the loaded experiment
+        :interval(float): time between temperature readings in s
+        :locked_status: SensorTemperatureStatus value that means locked
+        :tolerance(float): distance from the set point in C taken as locked by the prediction"""
+    def __init__(self,session,interval=2.0,locked_status=TEMPERATURE_LOCKED,tolerance=0.5):
+        self.session=session
+        self.interval=interval
+        self.locked_status=locked_status
+        self.tolerance=tolerance
+        self.setpoint=None
+        self.readings=[] #(seconds since start, temperature in C, status)
+        self.locked=threading.Event()
+        self.stop_event=threading.Event()
+        self.thread=None
+        self.t0=None
+
+    def read(self):
+        """Reads and logs the temperature and lock status."""
+        cs=self.session.cs
+        temp=float(self.session.get(cs.SensorTemperatureReading))
+        status=self.session.get(cs.SensorTemperatureStatus)
+        self.readings.append((time.monotonic()-self.t0,temp,status))
+        if status==self.locked_status:
+            self.locked.set()
+        return temp,status
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.read()
+            except Exception as ex:
+                print(f"Could not read detector temperature. Error: {ex}")
+            if self.locked.is_set():
+                return
+            self.stop_event.wait(self.interval)
+
+    def start(self,setpoint):
+        """Writes the set point and starts following the temperature. Returns at once."""
+        self.stop()
+        self.setpoint=float(setpoint)
+        self.readings=[]
+        self.locked.clear()
+        self.stop_event.clear()
+        self.t0=time.monotonic()
+        self.session.invalidate(self.session.cs.SensorTemperatureSetPoint) #LightField may have changed it since the last write
+        self.session.set(self.session.cs.SensorTemperatureSetPoint,self.setpoint)
+        self.thread=threading.Thread(target=self._run,daemon=True)
+        self.thread.start()
+        print(f"Detector temperature is being changed to {self.setpoint}")
+
+    def stop(self):
+        """Stops following the temperature."""
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread=None
+
+    def fit(self):
+        """Fits T(t) = setpoint + A exp(-t/tau) to the readings.
+        Returns:
+            ::A in C and tau in s, None if there are not enough readings moving toward the set point"""
+        if len(self.readings)<3:
+            return None
+        t=np.array([r[0] for r in self.readings])
+        offset=np.array([r[1] for r in self.readings])-self.setpoint
+        use=np.abs(offset)>self.tolerance/10 #readings at the set point carry no slope
+        if use.sum()<3 or len(set(np.sign(offset[use])))>1:
+            return None
+        slope,intercept=np.polyfit(t[use],np.log(np.abs(offset[use])),1)
+        if slope>=0: #not approaching the set point yet
+            return None
+        return float(np.sign(offset[use][0])*np.exp(intercept)),float(-1/slope)
+
+    def predict(self):
+        """Predicted seconds until the temperature is within tolerance of the set point, 0 if locked, None if it cannot be predicted yet."""
+        if self.locked.is_set():
+            return 0.0
+        fit=self.fit()
+        if fit is None:
+            return None
+        amplitude,tau=fit
+        t_lock=tau*np.log(abs(amplitude)/self.tolerance)
+        return max(0.0,float(t_lock-(time.monotonic()-self.t0)))
+
+    def wait_locked(self,timeout=1800.0):
+        """Waits for lock, printing the temperature and predicted time left.
+        Inputs:
+            :timeout(float): longest wait in s
+        Returns:
+            ::seconds waited"""
+        t0=time.monotonic()
+        while not self.locked.wait(min(self.interval*5,timeout)):
+            if time.monotonic()-t0>timeout:
+                raise TimeoutError(f"Detector temperature did not lock within {timeout} s")
+            if self.readings:
+                left=self.predict()
+                eta='unknown' if left is None else f'{left:.0f} s'
+                print(f"Detector temperature is {self.readings[-1][1]}, set point {self.setpoint}. Predicted time to lock {eta}")
+        return time.monotonic()-t0
+
+class FakeEvent:
+    """Stand-in for a .NET event. Handlers are added with += and called with (sender, args)."""
+    def __init__(self):
+        self.handlers=[]
+
+    def __iadd__(self,handler):
+        self.handlers.append(handler)
+        return self
+
+    def __isub__(self,handler):
+        self.handlers.remove(handler)
+        return self
+
+    def fire(self,sender):
+        for handler in list(self.handlers):
+            handler(sender,None)
+
+class FakeDevice:
+    def __init__(self,type='Camera'):
+        self.Type=type
+
+class FakeExperiment:
+    """LightField experiment stand-in for running the PIXIS code without the .NET runtime.
+    Settings are kept in a dictionary and Acquire records the frames it would have stored.
+    Inputs:
+        :settings(dictionary): initial setting values, every setting written later is accepted
+        :devices(list): device types in the experiment
+        :time_scale(float): fraction of the exposure time each frame takes, 0 finishes at once
+        :events(boolean): fire ExperimentStarted, ExperimentCompleted and IsReadyToRunChanged, False to exercise the polling fallback
+        :background(boolean): run acquisitions on a thread so Acquire returns at once like LightField
+        :ambient(float): sensor temperature in C before a set point is written
+        :cool_tau(float): time constant in s of the approach to a new set point"""
+    def __init__(self,settings=None,devices=('Camera',),time_scale=0.0,events=True,background=False,ambient=23.0,cool_tau=0.0):
+        self.values=dict(settings or {})
+        self.ExperimentDevices=[FakeDevice(t) for t in devices]
+        self.time_scale=time_scale
+        self.events=events
+        self.background=background
+        self.ExperimentStarted=FakeEvent()
+        self.ExperimentCompleted=FakeEvent()
+        self.IsReadyToRunChanged=FakeEvent()
+        self.ambient=ambient
+        self.cool_tau=cool_tau
+        self.cool_start=None #time and temperature when the set point was written
+        self.IsReadyToRun=True
+        self.IsRunning=False
+        self.setvalue_calls=0
+        self.acquisitions=[] #settings of every Acquire call
+
+    def Exists(self,setting):
+        return True
+
+    def SetValue(self,setting,value):
+        self.setvalue_calls+=1
+        if setting=='SensorTemperatureSetPoint':
+            self.cool_start=(time.monotonic(),self._temperature())
+        self.values[setting]=value
+
+    def _temperature(self):
+        if self.cool_start is None:
+            return self.ambient
+        t0,start=self.cool_start
+        setpoint=float(self.values['SensorTemperatureSetPoint'])
+        if self.cool_tau<=0:
+            return setpoint
+        return setpoint+(start-setpoint)*np.exp(-(time.monotonic()-t0)/self.cool_tau)
+
+    def GetValue(self,setting):
+        if setting=='SensorTemperatureReading':
+            return round(self._temperature(),2)
+        if setting=='SensorTemperatureStatus':
+            setpoint=self.values.get('SensorTemperatureSetPoint')
+            return TEMPERATURE_LOCKED if setpoint is not None and abs(self._temperature()-setpoint)<0.05 else 1
+        return self.values.get(setting)
+
+    def _fire(self,event):
+        if self.events:
+            event.fire(self)
+
+    def _run(self,duration):
+        time.sleep(duration)
+        self.IsRunning=False
+        self.IsReadyToRun=True
+        self._fire(self.ExperimentCompleted)
+        self._fire(self.IsReadyToRunChanged)
+
+    def Acquire(self):
+        nframes=int(self.values.get('FrameSettingsFramesToStore',1))
+        exposure=float(self.values.get('ShutterTimingExposureTime',0))/1000 #LightField exposure time is in ms
+        self.acquisitions.append(dict(self.values))
+        self.IsRunning=True
+        self.IsReadyToRun=False
+        self._fire(self.ExperimentStarted)
+        if self.background:
+            threading.Thread(target=self._run,args=(nframes*exposure*self.time_scale,),daemon=True).start()
+        else:
+            self._run(nframes*exposure*self.time_scale)
@@ -1,36 +1,46 @@
 import codecs
 import time
 import serial
-import pandas as pd
 import numpy as np
-import pyvisa as visa
 import datetime
 import os
 import sys
 import monochromatorapi as mcapi # Import monochromator api
 import port_utils as pt 
-import clr # Import the .NET class library
-import sys # Import python sys module
-import os # Import os module
-from System.IO import * # Import System.IO for saving and opening files
-# Import C compatible List and String
-from System import String
-from System.Collections.Generic import List
-# Add needed dll references
-sys.path.append(os.environ['LIGHTFIELD_ROOT'])
-sys.path.append(os.environ['LIGHTFIELD_ROOT']+"\\AddInViews")
-clr.AddReference('PrincetonInstruments.LightFieldViewV5')
-clr.AddReference('PrincetonInstruments.LightField.AutomationV5')
-clr.AddReference('PrincetonInstruments.LightFieldAddInSupportServices')
-# PI imports
-from PrincetonInstruments.LightField.Automation import Automation
-from PrincetonInstruments.LightField.AddIns import ExperimentSettings
-from PrincetonInstruments.LightField.AddIns import CameraSettings
-from PrincetonInstruments.LightField.AddIns import DeviceType
-from PrincetonInstruments.LightField.AddIns import SensorTemperatureStatus
-from PrincetonInstruments.LightField.AddIns import TriggerResponse
-import PrincetonInstruments.LightField.AddIns as AddIns
+from port_utils import MCPort #port database aliases, resolved by the instrument registry
+import checkpoint as ckpt
+import pixis_session as ps
+
+lightfield_loaded=False #LightField .NET assemblies are loaded on first use, see load_lightfield
+session=None #PixisSession for the loaded experiment, see pixis_get_session
+cooling=None #TemperatureController following the last set point, see pixis_start_cooling
  
+def load_lightfield():
+    """Loads pythonnet and the LightField automation assemblies. Called by the functions that talk to LightField so importing this module needs neither."""
+    global lightfield_loaded,String,List,Path,Automation,ExperimentSettings,CameraSettings,DeviceType,SensorTemperatureStatus,TriggerResponse,AddIns
+    if lightfield_loaded:
+        return
+    import clr # Import the .NET class library
+    from System.IO import Path # Import System.IO for saving and opening files
+    # Import C compatible List and String
+    from System import String
+    from System.Collections.Generic import List
+    # Add needed dll references
+    sys.path.append(os.environ['LIGHTFIELD_ROOT'])
+    sys.path.append(os.environ['LIGHTFIELD_ROOT']+"\\AddInViews")
+    clr.AddReference('PrincetonInstruments.LightFieldViewV5')
+    clr.AddReference('PrincetonInstruments.LightField.AutomationV5')
+    clr.AddReference('PrincetonInstruments.LightFieldAddInSupportServices')
+    # PI imports
+    from PrincetonInstruments.LightField.Automation import Automation
+    from PrincetonInstruments.LightField.AddIns import ExperimentSettings
+    from PrincetonInstruments.LightField.AddIns import CameraSettings
+    from PrincetonInstruments.LightField.AddIns import DeviceType
+    from PrincetonInstruments.LightField.AddIns import SensorTemperatureStatus
+    from PrincetonInstruments.LightField.AddIns import TriggerResponse
+    import PrincetonInstruments.LightField.AddIns as AddIns
+    lightfield_loaded=True
+
 def pixis_load_experiment(filename='DemoExp'):
     """Import premade settings file in LightField to send commands through api instead.
         Inputs:
@@ -41,6 +51,7 @@ def pixis_load_experiment(filename='DemoExp'):
             ::Error if not connected"""
     if pix_filename=='DemoExp': #premade settings for demo camera
         print("Warning: Loading Dummy Camera. Please select input filename to connect to the real PIXIS")
+    load_lightfield()
     auto = Automation(True, List[String]())
     experiment = auto.LightFieldApplication.Experiment
     connected=experiment.Load(filename) #loads premade settings for experiment
@@ -50,13 +61,22 @@ def pixis_load_experiment(filename='DemoExp'):
         print("Connection successful")
     return connected, auto, experiment
 
+def pixis_get_session():
+    """Session layer for the loaded experiment. A new session, with an empty setting cache, is made when a different experiment is loaded.
+        Returns:
+            ::PixisSession"""
+    global session
+    load_lightfield()
+    if session is None or session.experiment is not experiment:
+        session=ps.PixisSession(experiment,CameraSettings,ExperimentSettings,DeviceType.Camera)
+    return session
+
 def pixis_set_value(setting, value):    
-    """Check for existing experiment before setting new gain, adc rate, or adc quality.
+    """Check for existing experiment before setting new gain, adc rate, or adc quality. Writes are skipped if the setting already has the value.
         Inputs:
             :setting(string):
             :value():"""    
-    if experiment.Exists(setting):
-        experiment.SetValue(setting, value)
+    pixis_get_session().set(setting,value)
 
 def pixis_get_value(setting):    
     """Check for settings for gain, adc rate, adc quality, return values
@@ -66,37 +86,21 @@ def pixis_get_value(setting):
         return experiment.GetValue(setting)
 
 def pixis_device_found():
-    """Find connected device an inform user if device not detected
+    """Find connected device an inform user if device not detected. Checked once per session.
         Returns:
             ::Error message"""
-    for device in experiment.ExperimentDevices:
-        if (device.Type == DeviceType.Camera):
-            return True
-    print("Camera not found. Please add a camera and try again.")
-    return False  
+    return pixis_get_session().device_found()
 
 def pixis_take_bias_frames(n_bias):
-    """Loop to capture bias images with PIXIS.
+    """Capture bias images with PIXIS, all frames in one acquisition.
         Inputs:
             :n_bias(float): number of bias frames
         Returns:
             ::message that loop is beginning"""
     print(f"Taking {n_bias}  frames")
-    bias_exposure_time=0 #exposure time set to 0 for bias frames 
-            #may need to set the shutter function of PIXIS to not send trigger to ensure shutter does not open. 
-            #Right now the assumption is that the shutter does not open when a 0 second exopsure is given. 
-            #Set exposure time
-    count =1 #starts count for number of bias frames taken
-    while count<=n_bias: 
-        count+=1
-        pixis_set_value(CameraSettings.ShutterTimingExposureTime, bias_exposure_time)
-        pixis_set_value(CameraSettings.ShutterTimingMode,3)
-        if (pixis_device_found()==True): 
-            # Acquire image
-            waitUntil_ready()
-            experiment.Acquire()
-            waitUntil_ready()
-            pixis_set_value(CameraSettings.ShutterTimingExposureTime, bias_exposure_time)
+    #Right now the assumption is that the shutter does not open when a 0 second exopsure is given. Shutter is held closed as well.
+    pixis_get_session().bias(int(n_bias)) #frames are stored in one file
+    pixis_set_value(ExperimentSettings.FrameSettingsFramesToStore,1)
     pixis_set_value(CameraSettings.ShutterTimingMode,2)
 
 def pixis_take_exposure(exposuretime):
@@ -105,47 +109,27 @@ def pixis_take_exposure(exposuretime):
             :exposuretime(float): exposure time (seconds)
         Returns:
             ::Exposure time value, and completion"""  
-    if (pixis_device_found()==True): 
-            pixis_set_value(CameraSettings.ShutterTimingMode,2) # setting 2 means shutter open
-            pixis_set_value(CameraSettings.ShutterTimingExposureTime, exposuretime) #hold shutter open for exposuretime
-            print(f"exposure time set to {exposuretime}")
-            waitUntil_ready()
-            experiment.Acquire()
-            waitUntil_ready()
-            print("Exposure complete")
+    print(f"exposure time set to {exposuretime}")
+    if pixis_get_session().expose(exposuretime): #setting 2 means shutter open for exposuretime
+        print("Exposure complete")
 
 def pixis_take_dark_frames(n_dark,exposure_time):
-    """Aquire images with shutter closed.
+    """Aquire images with shutter closed, all frames in one acquisition.
         Inputs:
             :n_dark(float): number of dark frames
             :exposure_time(float): time shutter is open
         Returns:
             ::Message that process is starting"""
     print(f"Taking {n_dark} dark frames")
-    count =1 #begin count for dark images
-    while count<=n_dark: 
-        count+=1
-        if (pixis_device_found()==True): 
-            waitUntil_ready()
-            pixis_set_value(CameraSettings.ShutterTimingMode,3) #setting of 3 means shutter closed
-            pixis_set_value(CameraSettings.ShutterTimingExposureTime, exposure_time)
-            # Acquire image
-            waitUntil_ready()
-            experiment.Acquire()
-            waitUntil_ready()
+    pixis_get_session().dark(int(n_dark),exposure_time) #setting of 3 means shutter closed
+    pixis_set_value(ExperimentSettings.FrameSettingsFramesToStore,1)
     pixis_set_value(CameraSettings.ShutterTimingMode,2)
 
-def waitUntil_ready(delay=5): #default value is 5 seconds
-    """Delay for each command.
+def waitUntil_ready(timeout=60.0):
+    """Waits until the experiment is ready to run. Wakes on LightField's IsReadyToRunChanged event and polls at a short interval if it does not arrive.
         Inputs:
-            :delay(float): Time in seconds"""  
-    ":delay: delay in seconds"
-    condition=experiment.IsReadyToRun
-    wU = True
-    while wU == True:
-        if condition: #checks the condition
-            wU = False
-        time.sleep(delay) #waits 60s for preformance
+            :timeout(float): longest wait in seconds"""  
+    pixis_get_session().waiter.wait_ready(timeout)
 
 def pixis_set_folder(pix_exp_folder,pix_diretory):
     """Create new folder to store the experiment files and subfiles.
@@ -185,15 +169,15 @@ def pixis_save_file(pix_filename):
         Returns:
             ::folder and directory creation messages
             ::error message, if error code is 17, updates folder path and directory"""
-    experiment.SetValue(
+    pixis_set_value(
         ExperimentSettings.FileNameGenerationBaseFileName,
         Path.GetFileName(pix_filename))
     # Option to Increment, set to false will not increment
-    experiment.SetValue(ExperimentSettings.FileNameGenerationAttachIncrement,True)
+    pixis_set_value(ExperimentSettings.FileNameGenerationAttachIncrement,True)
     # Option to add date
-    experiment.SetValue(ExperimentSettings.FileNameGenerationAttachDate,True)
+    pixis_set_value(ExperimentSettings.FileNameGenerationAttachDate,True)
     # Option to add time
-    experiment.SetValue(ExperimentSettings.FileNameGenerationAttachTime,True)
+    pixis_set_value(ExperimentSettings.FileNameGenerationAttachTime,True)
 
 def pixis_get_current_temperature():
     """Present temperature value of PIXIS for user to read.
@@ -203,19 +187,26 @@ def pixis_get_current_temperature():
     print(f"Current Temperature:{current_temp}")
     return current_temp
     
+def pixis_start_cooling(temperature):
+    """Writes the temperature set point and returns at once. The temperature is read and logged on a background thread.
+        Inputs:
+            :temperature(float): value in Celsius
+        Returns:
+            ::TemperatureController, call wait_locked before the first science frame"""
+    global cooling
+    if cooling is None or cooling.session is not pixis_get_session():
+        cooling=ps.TemperatureController(pixis_get_session(),locked_status=SensorTemperatureStatus.Locked)
+    cooling.start(temperature)
+    return cooling
+
 def pixis_set_temperature(temperature):
-    """Set temperature if Ready condition is met and not aquiring data.
+    """Set temperature if Ready condition is met and not aquiring data. Waits for the temperature to lock.
         Inputs:
             :temperature(float): value in Celsius
         Returns:
             ::Temperature change message and set message"""   
     if (experiment.IsReadyToRun & experiment.IsRunning==False): #checks if experiment is loaded and ready to set temperature low for the detector
-        experiment.SetValue(CameraSettings.SensorTemperatureSetPoint,temperature)    
-        time.sleep(5)
-        while pixis_get_temperature_status()!=2: 
-            time.sleep(4)
-            ct=pixis_get_current_temperature() 
-            print(f"Detector temperature is being changed to {temperature}. Current temperature is {ct}")
+        pixis_start_cooling(temperature).wait_locked()
         print(pixis_get_temperature_status())
         print(f"Detctor temperature now set to {pixis_get_current_temperature()}")
 
@@ -298,13 +289,15 @@ def experimentfilesettings(pix_filenames_basename,pix_folder_name):
 
     return print(f" Detector Temperature = {pixis_get_current_temperature()}")
 
-def experimentrun(pix_start,pix_end,pix_step,pix_time,n_bias):
+def experimentrun(pix_start,pix_end,pix_step,pix_time,n_bias,checkpoint=None,temperature=None):
     """Homes scan controller. Takes bias frames then scans from user start to end wavelengths at desired step. takes 1 dark and 1 exposure frame at each stop wavelength.
         Inputs:
             :start_wl(float): nm
             :end_wl(float): nm
             :wl_step(float): nm
             :exp_time(float): ms
+            :checkpoint(ScanCheckpoint): checkpoint to resume from, see checkpoint.resume. A new scan writes <basename>_checkpoint.json
+            :temperature(float): detector set point in Celsius. Homing and file settings run during the cool-down and the first frame waits for lock
         Returns:
             ::bias frames taken, taking exposure, exposure time, exposure complete, taking dark frame, movement status, set temperature messages"""
     pix_start=180.0 #nm #make variable user can change
@@ -312,14 +305,34 @@ def experimentrun(pix_start,pix_end,pix_step,pix_time,n_bias):
     pix_step=10.0 #nm #make variable user can change
     pix_time=1000.0 #milleseconds #make variable user can change
     ndark=int(1) #int
-    mcapi.go_to_fromhome(MCPort,pix_start) 
     n_bias=10 #make variable user can change
-    exp_filnames_basename_bias_pre=pix_filenames_basename+'_bias_pre'
-    pixis_set_value(ExperimentSettings.FileNameGenerationBaseFileName,exp_filnames_basename_bias_pre)
-    pixis_take_bias_frames(n_bias)
+    if temperature is not None:
+        cooler=pixis_start_cooling(temperature) #cools while the scan controller homes
+    if checkpoint is None:
+        wavelengths=[]
+        current_wl=pix_start
+        while current_wl<=pix_end:
+            wavelengths.append(current_wl)
+            current_wl+=pix_step
+        plan={'pix_start':pix_start,'pix_end':pix_end,'pix_step':pix_step,'pix_time':pix_time,'n_bias':n_bias,'temperature':temperature}
+        checkpoint=ckpt.ScanCheckpoint(pix_filenames_basename+'_checkpoint.json','experimentrun',plan,[[None,wl] for wl in wavelengths])
+        checkpoint.save()
+        ckpt.home_to(MCPort,checkpoint,pix_start) #step count saved for a resume
+        exp_filnames_basename_bias_pre=pix_filenames_basename+'_bias_pre'
+        pixis_set_value(ExperimentSettings.FileNameGenerationBaseFileName,exp_filnames_basename_bias_pre)
+        if temperature is not None:
+            print(f"Waited {cooler.wait_locked():.0f} s for detector lock after homing")
+        pixis_take_bias_frames(n_bias)
+    else: #pre bias frames were taken before the scan stopped
+        first=checkpoint.next_index()
+        if first<len(checkpoint.points):
+            ckpt.resume_position(MCPort,checkpoint,checkpoint.points[first][1])
+        if temperature is not None:
+            print(f"Waited {cooler.wait_locked():.0f} s for detector lock after positioning")
     pixis_set_value(ExperimentSettings.FileNameGenerationBaseFileName,pix_filenames_basename)
-    current_wl=pix_start
-    while current_wl<=pix_end:
+    for idx,(filternum,current_wl) in enumerate(checkpoint.points):
+        if checkpoint.is_done(idx):
+            continue
         print(f"Taking exposure at {np.round(current_wl,2)} nm")
         exp_filename=pix_filenames_basename+"_wl"+str(np.round(current_wl,2)).replace(".", "_")
         pixis_set_value(ExperimentSettings.FileNameGenerationBaseFileName,exp_filename)
@@ -330,7 +343,7 @@ def experimentrun(pix_start,pix_end,pix_step,pix_time,n_bias):
         pixis_set_value(ExperimentSettings.FileNameGenerationBaseFileName,pix_filenames_basename)
         print(f"Going to {current_wl+pix_step} nm")
         mcapi.go_to_from(MCPort,current_wl,float(current_wl+pix_step))
-        current_wl+=pix_step
+        checkpoint.point_done(idx,current_wl+pix_step,files=[exp_filename,dark_filename])
     mcapi.home(MCPort)
     exp_filnames_basename_bias_post=pix_filenames_basename+'_bias_post'
     pixis_set_value(ExperimentSettings.FileNameGenerationBaseFileName,exp_filnames_basename_bias_post)
@@ -1,15 +1,149 @@
-import time
-import pyvisa as visa
-import datetime
 import os
-import sys
-import codecs
-import codecs
-import pandas as pd
+import re
+import csv
+import json
+import hashlib
 import serial
 import serial.tools.list_ports
-import numpy as np
-# import clr # Import the .NET class library
+
+"""Serial port discovery for the USB to serial adapters of each device. Ports are found by adapter serial number and cached so lookups do not enumerate the USB bus."""
+
+PORT_SN={'MCPort':'A6040X2D','FWPort':'A6040W3Z','ShutPort':'A65892C1','PicoPort':'A65893GG','Turbo':'A67166PW'} #USB adapter serial number of each device
+PORT_DEFAULTS={'MCPort':'/dev/ttyUSB0','FWPort':'/dev/ttyUSB1','ShutPort':'/dev/ttyUSB2','PicoPort':'/dev/ttyUSB3','Turbo':'/dev/ttyUSB4'} #used when a device is not found
+MCPort='MCPort' #port database aliases the drivers pass to the instrument registry, which resolves them to the device
+FWPort='FWPort'
+shutterport='ShutPort'
+picoasrl='PicoPort' #VISA resource of the picoammeter
+VISA_SERIAL=re.compile(r'^ASRL(?P<port>.+)::INSTR$',re.IGNORECASE) #VISA resource string of a serial port
+
+def enumerate_ports():
+    """Lists the serial ports once.
+    Returns:
+        ::dictionary of USB serial number to device path
+        ::fingerprint of the USB topology"""
+    found={}
+    topology=[]
+    for comport in serial.tools.list_ports.comports():
+        topology.append((comport.device,comport.serial_number,comport.vid,comport.pid,comport.location))
+        if comport.serial_number:
+            found[comport.serial_number]=comport.device
+    fingerprint=hashlib.sha1(json.dumps(sorted(topology,key=str),default=str).encode()).hexdigest()
+    return found,fingerprint
+
+class PortResolver:
+    """Maps device aliases to serial ports. The mapping is cached in a JSON file with the fingerprint of the USB topology it was built from.
+    The bus is enumerated again only when a cached device path has disappeared, or when asked to.
+    Inputs:
+        :path(string): port database csv, rewritten only when the mapping changes
+        :cache(string): JSON cache file, next to the port database if None"""
+    def __init__(self,path="port_database.csv",cache=None):
+        self.path=path
+        self.cache=cache or os.path.splitext(path)[0]+'_cache.json'
+        self.serials=dict(PORT_SN)
+        self.ports=dict(PORT_DEFAULTS)
+        self.fingerprint=None
+        self.present=set() #aliases whose port existed at the last check, only these can go stale
+        self.checked=False #False until the cached ports are first checked
+        self.enumerations=0 #number of times the bus was enumerated
+        self.load()
+
+    def load(self):
+        """Reads the cached mapping, or the port database csv if there is no cache."""
+        if os.path.exists(self.cache):
+            with open(self.cache) as fp:
+                data=json.load(fp)
+            self.serials.update(data.get('serials',{}))
+            self.ports.update(data.get('ports',{}))
+            self.fingerprint=data.get('fingerprint')
+        elif os.path.exists(self.path):
+            with open(self.path,newline='') as fp:
+                for row in csv.DictReader(fp):
+                    self.serials[row['Port_Alias']]=row['Port_SN']
+                    self.ports[row['Port_Alias']]=row['Port_Name']
+
+    def save(self):
+        """Writes the cache and the port database csv."""
+        tmp=self.cache+'.tmp'
+        with open(tmp,'w') as fp:
+            json.dump({'fingerprint':self.fingerprint,'serials':self.serials,'ports':self.ports},fp,indent=1)
+        os.replace(tmp,self.cache)
+        with open(self.path,'w',newline='') as fp:
+            writer=csv.writer(fp)
+            writer.writerow(['','Port_Alias','Port_SN','Port_Name'])
+            for idx,alias in enumerate(self.serials):
+                writer.writerow([idx,alias,self.serials[alias],self.ports.get(alias,'')])
+
+    def stale(self):
+        """True if a device path that existed has disappeared, or the mapping was never built from the bus.
+        On the first check since the cache was loaded any missing cached path is stale, the device may have moved while the cache was unused."""
+        if self.fingerprint is None:
+            return True
+        if not self.checked:
+            self.checked=True
+            self.present={alias for alias,port in self.ports.items() if os.path.exists(port)}
+            return len(self.present)<len(self.ports)
+        return any(not os.path.exists(self.ports[alias]) for alias in self.present)
+
+    def refresh(self,force=False):
+        """Enumerates the bus if the cache is stale or force is True, and updates the ports of the devices found.
+        Returns:
+            ::dictionary of alias to device path"""
+        if not force and not self.stale():
+            return self.ports
+        found,fingerprint=enumerate_ports()
+        self.enumerations+=1
+        self.checked=True
+        if fingerprint==self.fingerprint and not force: #same bus as when the cache was built, a device is unplugged
+            self.present={alias for alias,port in self.ports.items() if os.path.exists(port)}
+            return self.ports
+        ports=dict(self.ports)
+        for alias,sn in self.serials.items():
+            if sn in found:
+                ports[alias]=found[sn]
+            else:
+                print(f"Device {alias} ({sn}) not found. Leaving the local port to {ports.get(alias)}.")
+        changed=ports!=self.ports or fingerprint!=self.fingerprint
+        self.ports,self.fingerprint=ports,fingerprint
+        self.present={alias for alias,port in self.ports.items() if os.path.exists(port)}
+        if changed:
+            self.save()
+        return self.ports
+
+    def resolve(self,name):
+        """Serial port of a device.
+        Inputs:
+            :name(string): alias such as 'MCPort', adapter serial number, device path or VISA string such as 'ASRL/dev/ttyUSB3::INSTR'
+        Returns:
+            ::device path"""
+        match=VISA_SERIAL.match(name)
+        if match: #VISA serial resource, numbered ports are COM ports on Windows
+            port=match['port']
+            name=f'COM{port}' if port.isdigit() else port
+        if name in self.ports:
+            self.refresh() #only enumerates if a known port has disappeared
+            return self.ports[name]
+        for alias,sn in self.serials.items():
+            if sn==name:
+                return self.resolve(alias)
+        return name #already a device path
+
+    def visa(self,name):
+        """VISA resource string of a device, such as 'ASRL/dev/ttyUSB3::INSTR' for the picoammeter."""
+        return 'ASRL'+self.resolve(name)+'::INSTR'
+
+    def records(self):
+        """Port table as a list of rows with Port_Alias, Port_SN and Port_Name."""
+        return [{'Port_Alias':alias,'Port_SN':sn,'Port_Name':self.ports.get(alias)} for alias,sn in self.serials.items()]
+
+resolvers={} #PortResolver per port database path
+
+def get_resolver(path="port_database.csv"):
+    """Shared PortResolver for a port database, refreshed if its cache is stale."""
+    if path not in resolvers:
+        resolvers[path]=PortResolver(path)
+    resolver=resolvers[path]
+    resolver.refresh()
+    return resolver
 
 def update_port_databse(path="port_database.csv"):
     """Assigns port name to serial number of the usb device connected to the computer.
@@ -18,45 +152,31 @@ def update_port_databse(path="port_database.csv"):
     Returns:
         ::updated port list
         ::error message if device is not found"""
-    port_dict_SN={'Port_Alias': ['MCPort','FWPort','ShutPort','PicoPort','Turbo'], 
-    'Port_SN':['A6040X2D','A6040W3Z','A65892C1','A65893GG','A67166PW'],
-    'Port_Name':['/dev/ttyUSB0', '/dev/ttyUSB1','/dev/ttyUSB2','/dev/ttyUSB3','/dev/ttyUSB4']
-    }
-    port_database=pd.DataFrame(port_dict_SN)
-    for idx,portsn in enumerate(port_database['Port_SN']):
-        found=0
-        for comport in serial.tools.list_ports.comports():
-            if comport.serial_number==portsn: 
-                print(comport.device)
-                port_database['Port_Name'][idx]=comport.device
-                found=1
-                break
-        if found ==0: 
-            print("Device not found. Leaving the local port to default value.")
-    path=path
-    port_database.to_csv(path)
-    return port_database
+    if path not in resolvers:
+        resolvers[path]=PortResolver(path)
+    resolvers[path].refresh(force=True)
+    return resolvers[path].records()
 
 def get_port_database(path="port_database.csv"):
     """Prints current ports for each serial connection.
     Inputs:
-        :path(string): filename for port database"""
-    port_database=pd.read_csv(path,index_col=[0])
-    return port_database
+        :path(string): filename for port database
+    Returns:
+        ::list of rows with Port_Alias, Port_SN and Port_Name"""
+    return get_resolver(path).records()
 
-def setports():
+def setports(path="port_database.csv"):
     """Retrieves port csv file and assigns port alias to each usb to serial connection for the varius devices.
     Returns:
-        ::Table of port names, alias, and asl or serial address"""
+        ::dictionary of MCPort, shutterport, PicoPort, picoasrl and FWPort"""
     try:
-        port_database=get_port_database()
-        MCPort = port_database[port_database['Port_Alias']=='MCPort']['Port_Name'].values[0] #port for scan controller
-        shutterport= port_database[port_database['Port_Alias']=='ShutPort']['Port_Name'].values[0] #port for shutter
-        PicoPort=port_database[port_database['Port_Alias']=='PicoPort']['Port_Name'].values[0]#port for picoamerter
-        picoasrl='ASRL'+PicoPort+'::INSTR' #asrl port for the picoammeter
-        FWPort=port_database[port_database['Port_Alias']=='FWPort']['Port_Name'].values[0] #port for filter wheel
-        return port_database
+        resolver=get_resolver(path)
+        return {'MCPort':resolver.resolve('MCPort'), #port for scan controller
+                'shutterport':resolver.resolve('ShutPort'), #port for shutter
+                'PicoPort':resolver.resolve('PicoPort'), #port for picoamerter
+                'picoasrl':resolver.visa('PicoPort'), #asrl port for the picoammeter
+                'FWPort':resolver.resolve('FWPort')} #port for filter wheel
     except Exception as ex:
         msg =f"Error, could not set port database. Error: {ex}"
         print(msg)
-        return
\ No newline at end of file
+        return
@@ -1,18 +1,16 @@
 import time
-import pyvisa as visa
 import datetime
 import codecs
-import pandas as pd
 import serial
 import serial.tools.list_ports
 import monochromatorapi as mcapi
 import shutterapi as shutter
-import pixisapi as pixis
 import fwapi as fw
 import nuvu as nuvu
-import command
 import PhotodiodeLinux as mclinux
 import port_utils as pt
+from port_utils import MCPort,FWPort #port database aliases, resolved by the instrument registry
+import estimate
 import os.path
 import os
 import numpy as np
@@ -24,13 +22,23 @@ import logging
 
 """Functions used in experiment to take data with NUVU controller and picoammeter and save that data. Uses variables in command.py and port_utils.py."""
 
-def run_ptc(lamp='D2',wl=0,filtnum=1):
+EXPTIMES=[0.010,0.20,0.025,0.050,0.075,0.1,0.2,0.25,0.5,0.75,1,2,3,5,7.5,10,20,30,40,50,60,70,80,90,100,120,140,160,180,200,250,300] #exp in seconds #ladder of run_ptc
+
+def run_ptc(lamp='D2',wl=0,filtnum=1,camera=None,dry_run=False):
     """Set log data, exposuretimes, directory names, take bias and darks.
     Inputs:
         :lamp(string): Lamp selection. D2=Deuterium Lamp, Xe=Xenon Lamp. Must be manually switched to the lamp
         :wl(integer): wavelength entered into log of image for further data analysis
-        :filtnum(integer): Filter 1-5 of filter wheel. Refer to filter change map for cutoff values"""
-    data_dir = nuvu.getpath()
+        :filtnum(integer): Filter 1-5 of filter wheel. Refer to filter change map for cutoff values
+        :camera(NuvuCamera): open camera server connection, one is opened if None
+        :dry_run(boolean): print and return the time estimate of the ladder from estimate.py without touching the devices"""
+    if dry_run: #walks the plan only
+        est=estimate.ptc_ladder(EXPTIMES,filtnum)
+        est.report()
+        return est
+    if camera is None: #one connection for the whole ladder
+        camera = nuvu.NuvuCamera()
+    data_dir = camera.getpath()
     print(f'The current working directory is {data_dir}')
     val = input("Is this the correct data directory? Y or N")
     if val == 'Y': ##Need to enter the response with 'Y'
@@ -49,9 +57,10 @@ def run_ptc(lamp='D2',wl=0,filtnum=1):
         log.setLevel(logging.INFO)
         log.info("Starting PTC data collection ")
         log.info(f"Saving data and log in {data_dir}")
-    t0 = datetime.datetime.now()
+    t0 = datetime.now()
     log.info(f'Start time={t0}')
     fn = data_dir + 'ptc_log.csv'
+    frame_log = nuvu.ExperimentLog(data_dir + 'ptc_log.jsonl') #frames are written as they are taken
     dir = os.path.dirname(logfilename)
     if not os.path.exists(dir):
         log.info("Log directory does not exist. Making one!")
@@ -62,78 +71,53 @@ def run_ptc(lamp='D2',wl=0,filtnum=1):
     else:
         writeheader = False
         log.info("Log file exits in this folder.")
-    exptime=[0.010,0.20,0.025,0.050,0.075,0.1,0.2,0.25,0.5,0.75,1,2,3,5,7.5,10,20,30,40,50,60,70,80,90,100,120,140,160,180,200,250,300] #exp in seconds
+    exptime=EXPTIMES
     log.info(f'exptime list: {exptime}')
     filtnum=fw.set_fw_to_position(filtnum,FWPort)
     log.info(f'filter wheel set to {filtnum}')
     log.info('Entering loop for taking exposures')
     for idx,et in enumerate(exptime):
-        t1 = datetime.datetime.now()
+        t1 = datetime.now()
         log.info(f'Exposure time is set for {et} seconds')
         log.info(f'Taking pre-bias')
-        imno = nuvu.getimno()
-        time.sleep(0.2)
+        imno = camera.bias()
         imtype='Bias'
-        if idx==0: 
-            log_df=pd.DataFrame(nuvu.get_log_data(imtype,et,imno,wl,lamp,filtnum))
-        else: 
-            temp_df=pd.DataFrame(nuvu.get_log_data(imtype,et,imno,wl,lamp,filtnum))
-            log_df=pd.concat([log_df,temp_df],ignore_index=True)
-        nuvu.bias()
-        time.sleep(0.2)
+        frame_log.append(imtype,et,imno,wl,lamp,filtnum)
 
         log.info(f'Taking pre-dark')
-        imno = nuvu.getimno()
-        time.sleep(0.2)
+        imno = camera.dark(et)
         imtype='Dark'
-        temp_df=pd.DataFrame(nuvu.get_log_data(imtype,et,imno,wl,lamp,filtnum))
-        log_df=pd.concat([log_df,temp_df],ignore_index=True)
-        nuvu.dark(et)
-        time.sleep(0.2)
+        frame_log.append(imtype,et,imno,wl,lamp,filtnum)
 
         log.info(f'Taking First Flat Exposures')
-        imno = nuvu.getimno()    
-        time.sleep(0.2)
+        imno = camera.expose(et,1)
         imtype='Flat'
-        temp_df=pd.DataFrame(nuvu.get_log_data(imtype,et,imno,wl,lamp,filtnum))
-        log_df=pd.concat([log_df,temp_df],ignore_index=True)
-        nuvu.exposure_burst(et,1)
-        time.sleep(0.2)
+        frame_log.append(imtype,et,imno,wl,lamp,filtnum)
 
         log.info(f'Taking Second Flat Exposures')
-        imno = nuvu.getimno()    
-        time.sleep(0.2)
+        imno = camera.expose(et,1)
         imtype='Flat'
-        temp_df=pd.DataFrame(nuvu.get_log_data(imtype,et,imno,wl,lamp,filtnum))
-        log_df=pd.concat([log_df,temp_df],ignore_index=True)
-        nuvu.exposure_burst(et,1)
-        time.sleep(0.2)
+        frame_log.append(imtype,et,imno,wl,lamp,filtnum)
 
         log.info(f'Taking post-dark')
-        imno = nuvu.getimno()
-        time.sleep(0.2)
+        imno = camera.dark(et)
         imtype='Dark'
-        temp_df=pd.DataFrame(nuvu.get_log_data(imtype,et,imno,wl,lamp,filtnum))
-        log_df=pd.concat([log_df,temp_df],ignore_index=True)
-        nuvu.dark(et)
-        time.sleep(0.2)
+        frame_log.append(imtype,et,imno,wl,lamp,filtnum)
 
-        log.info(f'Taking post-dark')
-        imno = nuvu.getimno()
+        log.info(f'Taking post-bias')
+        imno = camera.bias()
         imtype='Bias'
-        temp_df=pd.DataFrame(nuvu.get_log_data(imtype,et,imno,wl,lamp,filtnum))
-        log_df=pd.concat([log_df,temp_df],ignore_index=True)
-        nuvu.bias()
-        time.sleep(0.2)
+        frame_log.append(imtype,et,imno,wl,lamp,filtnum)
 
-        t2 = datetime.datetime.now()
+        t2 = datetime.now()
         #et = int(et/2)
         log.info(f"Exp {idx}, exptime {et} ended at {t2}")
         log.info(f'This exposure took {t2-t1} seconds')
-    t3 = datetime.datetime.now()
+    t3 = datetime.now()
     log.info(f'This exposure took {t3-t0} seconds')
     log.info(f'Saving data log in {fn}')
-    log_df.to_csv(fn)
+    frame_log.close()
+    frame_log.to_dataframe().to_csv(fn)
     log.info(f'Images saved in {data_dir}')
     log.info(f'Scan complete. See scan log in {logfilename}')
     #led(0)
@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import reduction
+
+"""Photon transfer curve analysis of the frames taken by ptc.run_ptc. Kept apart from ptc.py so worker processes do not import the instrument modules."""
+
+def load_ptc_log(log):
+    """Reads the frame log written by ptc.run_ptc.
+    Inputs:
+        :log(string or DataFrame): ptc_log.csv, ptc_log.jsonl or a DataFrame with imtype, Exp_time and imno columns
+    Returns:
+        ::DataFrame sorted by image number"""
+    if isinstance(log,str):
+        if log.endswith('.jsonl'):
+            log=pd.read_json(log,lines=True)
+        else:
+            log=pd.read_csv(log,index_col=0)
+    return log.sort_values('imno').reset_index(drop=True)
+
+def ptc_levels(log_df,path_format):
+    """Groups the frames of each exposure time of the PTC ladder.
+    Inputs:
+        :log_df(DataFrame): PTC frame log
+        :path_format(string): file name pattern with an imno field, such as data_dir+'image_{imno:05d}.fits'
+    Returns:
+        ::list of dictionaries with exptime and bias, dark and flat file lists, only levels with two flats on disk"""
+    levels=[]
+    for et,group in log_df.groupby('Exp_time',sort=True):
+        files={}
+        for imtype in ('Bias','Dark','Flat'):
+            names=[path_format.format(imno=int(imno)) for imno in group[group['imtype']==imtype]['imno']]
+            files[imtype]=[fn for fn in names if os.path.exists(fn)]
+        if len(files['Flat'])<2: #level not finished yet
+            continue
+        levels.append({'exptime':float(et),'bias':files['Bias'],'dark':files['Dark'],'flat':files['Flat'][:2]})
+    return levels
+
+def tile_stats(image,tile):
+    """Mean and variance of each square tile of an image, computed for all tiles at once.
+    Inputs:
+        :image(array): 2D image
+        :tile(integer): tile size in pixels, edge pixels that do not fill a tile are left out
+    Returns:
+        ::array of tile means
+        ::array of tile variances"""
+    ny,nx=image.shape[0]//tile,image.shape[1]//tile
+    tiles=image[:ny*tile,:nx*tile].reshape(ny,tile,nx,tile)
+    return tiles.mean(axis=(1,3)).ravel(),tiles.var(axis=(1,3),ddof=1).ravel()
+
+def _load(filename):
+    frame,bscale,bzero=reduction.open_frame(filename)
+    return np.asarray(frame,dtype=np.float64)*bscale+bzero
+
+def level_stats(level,tile=64):
+    """Signal and noise of one exposure level from its pair of flats.
+    The flats are corrected with the mean of the darks at the same exposure time, or the biases if there are no darks.
+    Noise is the variance of the flat difference image divided by two, so fixed pattern noise cancels.
+    Inputs:
+        :level(dictionary): one entry of ptc_levels
+        :tile(integer): tile size in pixels
+    Returns:
+        ::dictionary of exptime, tile signal means, tile variances and the read noise variance from the bias pair"""
+    f1,f2=(_load(fn) for fn in level['flat'])
+    offset_files=level['dark'] or level['bias']
+    offset=np.mean([_load(fn) for fn in offset_files],axis=0) if offset_files else 0.0
+    signal,_=tile_stats((f1+f2)/2-offset,tile)
+    _,diff_var=tile_stats(f1-f2,tile)
+    read_var=np.nan
+    if len(level['bias'])>=2:
+        _,bias_var=tile_stats(_load(level['bias'][0])-_load(level['bias'][1]),tile)
+        read_var=float(np.median(bias_var)/2)
+    return {'exptime':level['exptime'],'signal':signal,'variance':diff_var/2,'read_var':read_var}
+
+def _level_key(level,tile):
+    """Cache key from the level's files, their modification times and the tile size."""
+    files=level['flat']+level['dark']+level['bias']
+    stamp=[(fn,os.path.getmtime(fn)) for fn in files]
+    return hashlib.sha1(json.dumps([stamp,tile]).encode()).hexdigest()
+
+def compute_levels(levels,tile=64,cache_dir=None,workers=None):
+    """Tile statistics for every level, one level per worker process. Levels already in the cache are not recomputed.
+    Inputs:
+        :levels(list): output of ptc_levels
+        :tile(integer): tile size in pixels
+        :cache_dir(string): folder for cached level results, no caching if None
+        :workers(integer): worker processes, all cores if None, 1 runs in this process
+    Returns:
+        ::list of level_stats dictionaries in exposure time order"""
+    results={}
+    todo=[]
+    for level in levels:
+        key=_level_key(level,tile)
+        cached=os.path.join(cache_dir,f'ptc_level_{key}.npz') if cache_dir else None
+        if cached and os.path.exists(cached):
+            data=np.load(cached)
+            results[key]={'exptime':float(data['exptime']),'signal':data['signal'],'variance':data['variance'],'read_var':float(data['read_var'])}
+        else:
+            todo.append((key,cached,level))
+    if todo:
+        if workers==1:
+            computed=[level_stats(level,tile) for key,cached,level in todo]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                computed=list(pool.map(level_stats,[level for key,cached,level in todo],[tile]*len(todo)))
+        for (key,cached,level),stats in zip(todo,computed):
+            results[key]=stats
+            if cached:
+                os.makedirs(cache_dir,exist_ok=True)
+                np.savez(cached,**stats)
+    print(f"PTC levels: {len(todo)} computed, {len(levels)-len(todo)} from cache")
+    return sorted(results.values(),key=lambda stats:stats['exptime'])
+
+def fit_ptc(stats,read_var=None):
+    """Fits gain, read noise and full well to the photon transfer curve.
+    Variance rises linearly with signal as read variance + signal/gain until the full well, where it turns over.
+    Inputs:
+        :stats(list): output of compute_levels
+        :read_var(float): read noise variance in ADU^2, median of the bias pairs if None
+    Returns:
+        ::dictionary of gain (e-/ADU), read noise (ADU and e-), full well (ADU and e-) and the curve as a DataFrame"""
+    curve=pd.DataFrame({'exptime':[s['exptime'] for s in stats],
+                        'signal':[float(np.median(s['signal'])) for s in stats],
+                        'variance':[float(np.median(s['variance'])) for s in stats]})
+    if read_var is None:
+        read_vars=[s['read_var'] for s in stats if np.isfinite(s['read_var'])]
+        read_var=float(np.median(read_vars)) if read_vars else 0.0
+    turnover=int(curve['variance'].idxmax()) #variance drops once pixels saturate
+    linear=curve.iloc[:turnover+1]
+    linear=linear[linear['signal']>0]
+    if len(linear)<2:
+        raise ValueError("Need at least two exposure levels below full well to fit the PTC")
+    shot=linear['variance']-read_var
+    inv_gain=float(np.sum(shot*linear['signal'])/np.sum(linear['signal']**2)) #least squares slope through the origin
+    gain=1/inv_gain
+    read_noise=float(np.sqrt(max(read_var,0.0)))
+    full_well=float(curve['signal'][turnover])
+    return {'gain':gain,'read_noise_adu':read_noise,'read_noise_e':read_noise*gain,
+            'full_well_adu':full_well,'full_well_e':full_well*gain,'curve':curve}
+
+def run_ptc_analysis(log,path_format,tile=64,cache_dir=None,workers=None):
+    """Reads the PTC log, computes every level that is not cached and fits the curve.
+    Inputs:
+        :log(string or DataFrame): ptc_log.csv from ptc.run_ptc
+        :path_format(string): file name pattern with an imno field
+        :tile(integer): tile size in pixels
+        :cache_dir(string): folder for cached level results
+        :workers(integer): worker processes
+    Returns:
+        ::fit_ptc results"""
+    levels=ptc_levels(load_ptc_log(log),path_format)
+    stats=compute_levels(levels,tile,cache_dir,workers)
+    result=fit_ptc(stats)
+    print(f"Gain {result['gain']:.3f} e-/ADU, read noise {result['read_noise_e']:.2f} e-, full well {result['full_well_e']:.0f} e-")
+    return result
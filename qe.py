@@ -1,22 +1,23 @@
 import time
-import pyvisa as visa
 import datetime
 import os
 import os.path
 import sys
 import codecs
-import pandas as pd
 import serial
 import serial.tools.list_ports
 import numpy as np
 import shutterapi as shutter
-import pixisapi as pixis
 import fwapi as fw
 import nuvu as nuvu
-import command
 import PhotodiodeLinux as mclinux
 import port_utils as pt
+from port_utils import MCPort,FWPort,picoasrl #port database aliases, resolved by the instrument registry
 import monochromatorapi as mcapi
+import checkpoint as ckpt
+import scheduler as sched
+import latency
+import estimate
 import subprocess
 from subprocess import Popen, PIPE, STDOUT
 import sys
@@ -26,7 +27,7 @@ import logging
 
 """Quantum Efficiency Measurement using picoammeter, filter wheel, NUVU controller. Uses variables in command.py and port_utils.py."""
 
-def get_qe_data(wl_min,wl_max,exp_time,step,lamp='D2',nburst=1,flist=[1,2,3]):
+def get_qe_data(wl_min,wl_max,exp_time,step,lamp='D2',nburst=1,flist=[1,2,3],camera=None,checkpoint=None,dry_run=False):
     """Get QE Data
     :wl_min(integer): wavelength in nm
     :wl_max(integer): wavelength in nm
@@ -34,14 +35,24 @@ def get_qe_data(wl_min,wl_max,exp_time,step,lamp='D2',nburst=1,flist=[1,2,3]):
     :step(integer): interval between wavelengths in nm
     :lamp(string): Xe=Xenon, D2=Deuterium lamp selected
     :nburst(integer): number of burst
-    :flist(integer): item in array for filter list slots"""
+    :flist(integer): item in array for filter list slots
+    :camera(NuvuCamera): open camera server connection, one is opened if None
+    :checkpoint(ScanCheckpoint): checkpoint to resume from, see checkpoint.resume. A new scan writes qe_checkpoint.json in the data directory
+    :dry_run(boolean): print and return the time estimate of the scan from estimate.py without touching the devices"""
+    if dry_run: #walks the plan only
+        est=estimate.qe_scan(wl_min,wl_max,exp_time,step,flist=flist,nburst=nburst)
+        est.report()
+        return est
     Ch1ON=1 #Channel 1 ON
     Ch2ON=1 #Channel 2 ON 
     nsamples=10 #previously 100 
     interval=0.1 #no change. 
+    latency.recorder.reset() #command latencies of this run only
     #intiallize picoammeter with the settings. 
     picoa=mclinux.picoammeter_initialize(Ch1ON,Ch2ON,interval,nsamples,picoasrl,debug=False)
-    data_dir = nuvu.getpath()
+    if camera is None: #one connection for the whole scan
+        camera = nuvu.NuvuCamera()
+    data_dir = camera.getpath()
     print(f'The current working directory is {data_dir}')
     val = input("Is this the correct data directory? Y or N")
     if val == 'Y': ##Need to enter the response with 'Y'
@@ -66,9 +77,18 @@ def get_qe_data(wl_min,wl_max,exp_time,step,lamp='D2',nburst=1,flist=[1,2,3]):
         log.info(f"filters used ={flist}")
         log.info(f"lamp ={lamp}")
         log.info(f"Saving data and log in {data_dir}")
-    t0 = datetime.datetime.now()
+    t0 = datetime.now()
     log.info(f'Start time={t0}')
     fn = data_dir + 'scan_log.csv'
+    log_fn = data_dir + 'scan_log.jsonl'
+    wl_list=np.arange(wl_min,wl_max+step,step)
+    resumed = checkpoint is not None
+    if checkpoint is None:
+        plan = {'wl_min':wl_min,'wl_max':wl_max,'exp_time':exp_time,'step':step,'lamp':lamp,'nburst':nburst,'flist':list(flist)}
+        checkpoint = ckpt.ScanCheckpoint(data_dir+'qe_checkpoint.json','get_qe_data',plan,[[f,wl] for f in flist for wl in wl_list])
+    frame_log = nuvu.ExperimentLog(log_fn,start=checkpoint.starts.get(log_fn)) #frames are written as they are taken
+    checkpoint.starts[log_fn] = frame_log.start
+    checkpoint.save()
     dir   = os.path.dirname(logfilename)
     if not os.path.exists(dir):
         log.info("Log directory does not exist. Making one!")
@@ -79,74 +99,84 @@ def get_qe_data(wl_min,wl_max,exp_time,step,lamp='D2',nburst=1,flist=[1,2,3]):
     else:
         writeheader = False
         log.info("Log file exits in this folder.")
-    wl_list=np.arange(wl_min,wl_max+step,step)
-    flag_data_log=0
+    nwl = len(wl_list)
+    scheduler = sched.StepScheduler(verbose=False) #moves overlap the bias frame
     for idxf,filtnum in enumerate(flist): 
+        if all(checkpoint.is_done(idxf*nwl+idx) for idx in range(nwl)): #filter finished before the scan was resumed
+            continue
         log.info(f"Scanning for filer number {filtnum}")
-        filtnum=fw.set_fw_to_position(filtnum,FWPort)
+        filter_pending=True #filter wheel moves together with the grating move to the first wavelength
         current_wl=mcapi.whereishome
         for idx,next_wl in enumerate(wl_list):
-            if idx==0: 
-                mcapi.go_to_fromhome(MCPort,next_wl)
-            else: 
-                mcapi.go_to_from(MCPort,current_wl,next_wl)
-            log.info(f"Monochromator at {next_wl} nm")
-            t1 = datetime.datetime.now()
-            log.info(f'Taking Bias for {next_wl} nm images')
-            imno = nuvu.getimno()
-            time.sleep(0.2)
-            imtype='Bias'
-            if flag_data_log==0: 
-                log_df=pd.DataFrame(nuvu.get_log_data(imtype,exp_time,imno,next_wl,lamp,filtnum))
-                flag_data_log=1
+            if checkpoint.is_done(idxf*nwl+idx):
+                continue
+            steps=[]
+            if filter_pending:
+                steps.append(sched.Step('filter',lambda f=filtnum: fw.set_fw_to_position(f,FWPort)))
+                filter_pending=False
+            if resumed: #first point after resuming
+                steps.append(sched.Step('move',lambda wl=next_wl: ckpt.resume_position(MCPort,checkpoint,wl)))
+                resumed = False
+            elif idx==0: 
+                steps.append(sched.Step('move',lambda wl=next_wl: ckpt.home_to(MCPort,checkpoint,wl))) #step count saved for a resume
             else: 
-                temp_df=pd.DataFrame(nuvu.get_log_data(imtype,exp_time,imno,next_wl,lamp,filtnum))
-                log_df=pd.concat([log_df,temp_df],ignore_index=True)
-            nuvu.bias()
-            time.sleep(0.2)
-
-            log.info(f'Taking Dark along with photodiode for {next_wl} nm with exposure time ={exp_time} seconds')
-            imno = nuvu.getimno()
-            time.sleep(0.2)
-            imtype='Dark'
-            temp_df=pd.DataFrame(nuvu.get_log_data(imtype,exp_time,imno,next_wl,lamp,filtnum))
-            log_df=pd.concat([log_df,temp_df],ignore_index=True)
-            #dark(exp_time)
-            picoa_filename=data_dir + f'picoa_{imtype}_f{filtnum}_{next_wl}nm_{imno}.csv'
-            nuvu.dark_wt_pdiode(exp_time,nburst,picoa,picoa_filename)
-            time.sleep(0.2)
-
-            log.info(f'Taking Exposure along with photodiode for {next_wl} nm with exposure time ={exp_time} seconds')
-            imno = nuvu.getimno()
-            time.sleep(0.2)
-            imtype='Exposure'
-            temp_df=pd.DataFrame(nuvu.get_log_data(imtype,exp_time,imno,next_wl,lamp,filtnum))
-            log_df=pd.concat([log_df,temp_df],ignore_index=True)
-            #exposure_burst(exp_time,nburst)
-            picoa_filename=data_dir + f'picoa_{imtype}_f{filtnum}_{next_wl}nm_{imno}.csv'
-            nuvu.exposure_wt_pdiode(exp_time,nburst,picoa,picoa_filename)
+                steps.append(sched.Step('move',lambda wl=current_wl,nwl=next_wl: mcapi.go_to_from(MCPort,wl,nwl)))
+            t1 = datetime.now()
+            picoa_files={}
+            def bias(wl=next_wl):
+                log.info(f'Taking Bias for {wl} nm images')
+                imno = camera.bias()
+                frame_log.append('Bias',exp_time,imno,wl,lamp,filtnum)
+            def dark(wl=next_wl):
+                log.info(f"Monochromator at {wl} nm")
+                log.info(f'Taking Dark along with photodiode for {wl} nm with exposure time ={exp_time} seconds')
+                imno = camera.getimno()
+                imtype='Dark'
+                frame_log.append(imtype,exp_time,imno,wl,lamp,filtnum)
+                picoa_files[imtype]=data_dir + f'picoa_{imtype}_f{filtnum}_{wl}nm_{imno}.csv'
+                nuvu.dark_wt_pdiode(exp_time,nburst,picoa,picoa_files[imtype],camera) #photodiode is sampled while the dark runs
+            def exposure(wl=next_wl):
+                log.info(f'Taking Exposure along with photodiode for {wl} nm with exposure time ={exp_time} seconds')
+                imno = camera.getimno()
+                imtype='Exposure'
+                frame_log.append(imtype,exp_time,imno,wl,lamp,filtnum)
+                picoa_files[imtype]=data_dir + f'picoa_{imtype}_f{filtnum}_{wl}nm_{imno}.csv'
+                nuvu.exposure_wt_pdiode(exp_time,nburst,picoa,picoa_files[imtype],camera) #photodiode is sampled while the exposure runs
+            #the bias frame does not need the grating or the filter in place, the photodiode samples of the dark and exposure do
+            steps.append(sched.Step('bias',bias))
+            steps.append(sched.Step('dark',dark,after=['bias','move','filter' if steps[0].name=='filter' else None]))
+            steps.append(sched.Step('exposure',exposure,after=['dark']))
+            report=scheduler.run(steps,label=f"f{filtnum} {next_wl} nm")
+            log.info(report.summary())
+            if report.results.get('filter',filtnum)!=filtnum:
+                log.info(f"Filter wheel did not reach filter {filtnum}")
             current_wl=next_wl
 
-            time.sleep(0.2)
             # imno = getimno()
             # log.info(f'Taking post-bias')
             # imno = getimno()
             # time.sleep(0.2)
             # imtype='Bias'
-            # temp_df=pd.DataFrame(get_log_data(imtype,exp_time,imno,next_wl,lamp,filtnum))
-            # log_df=pd.concat([log_df,temp_df],ignore_index=True)
+            # frame_log.append(imtype,exp_time,imno,next_wl,lamp,filtnum)
             # bias()
             # time.sleep(0.2)
-            t2 = datetime.datetime.now()
+            t2 = datetime.now()
             #et = int(et/2)
             log.info(f"Exp {idx}, exptime {exp_time} ended at {t2}")
             log.info(f'This exposure took {t2-t1} seconds')
+            frame_log.sync()
+            checkpoint.point_done(idxf*nwl+idx,next_wl,filtnum,offsets={log_fn:frame_log.tell()},files=[picoa_files['Dark'],picoa_files['Exposure']])
 
-        t3 = datetime.datetime.now()
+        t3 = datetime.now()
         log.info(f'This fitler {filtnum} took {t3-t0} seconds')
-    t4 = datetime.datetime.now()
+    t4 = datetime.now()
     log.info(f'This scan took {t4-t0} seconds')
+    scheduler.close()
+    log.info(f'Step scheduler: {scheduler.summary()}')
+    latency.recorder.to_csv(data_dir+'latency.csv') #time spent in each serial and VISA command
+    log.info(f'Command latencies saved in {data_dir}latency.csv')
     log.info(f'Saving data log in {fn}')
-    log_df.to_csv(fn)
+    frame_log.close()
+    frame_log.to_dataframe().to_csv(fn)
     log.info(f'Images saved in {data_dir}')
     log.info(f'Scan complete. See scan log in {logfilename}')
\ No newline at end of file
@@ -0,0 +1,153 @@
+import os
+import re
+import glob
+import numpy as np
+import pandas as pd
+import reduction
+
+"""Quantum efficiency from the photodiode and camera data saved by qe.get_qe_data. Points are processed as they appear so QE can be followed during the scan."""
+
+PLANCK=6.62607015e-34 #J s
+LIGHT_SPEED=2.99792458e8 #m/s
+PICOA_PATTERN=re.compile(r'picoa_(?P<imtype>[A-Za-z]+)_f(?P<filtnum>\d+)_(?P<wl>[\d.]+)nm_(?P<imno>\d+)\.csv$') #file names from qe.get_qe_data
+
+def parse_picoa_filename(filename):
+    """Reads image type, filter, wavelength and image number from a picoammeter file name written by qe.get_qe_data.
+    Returns:
+        ::dictionary of imtype, filtnum, wl, imno, None if the name does not match"""
+    match=PICOA_PATTERN.search(os.path.basename(filename))
+    if match is None:
+        return None
+    return {'imtype':match['imtype'],'filtnum':int(match['filtnum']),'wl':float(match['wl']),'imno':int(match['imno'])}
+
+def load_responsivity(responsivity):
+    """Reference photodiode responsivity curve.
+    Inputs:
+        :responsivity(string or DataFrame): csv or DataFrame with wl (nm) and responsivity (A/W) columns
+    Returns:
+        ::DataFrame sorted by wavelength"""
+    if isinstance(responsivity,str):
+        responsivity=pd.read_csv(responsivity)
+    return responsivity.sort_values('wl').reset_index(drop=True)
+
+def photon_rate(current,wl,responsivity):
+    """Photons per second on the photodiode for a photocurrent.
+    Inputs:
+        :current(float): photocurrent in A
+        :wl(float): wavelength in nm
+        :responsivity(DataFrame): wl and responsivity columns
+    Returns:
+        ::photons per second"""
+    resp=np.interp(wl,responsivity['wl'],responsivity['responsivity'])
+    power=current/resp #W
+    return power*wl*1e-9/(PLANCK*LIGHT_SPEED)
+
+class QEPipeline:
+    """Indexes the output folder of qe.get_qe_data and computes QE for every wavelength and filter that is complete.
+    Each call to update only reads the points that are new since the last call. Results are kept in qe_results.csv in the data folder
+    so a restarted pipeline continues where it stopped.
+    Inputs:
+        :data_dir(string): folder with picoa_*.csv files and the scan log
+        :path_format(string): camera frame file name pattern with an imno field, such as data_dir+'image_{imno:05d}.fits'
+        :responsivity(string or DataFrame): reference photodiode responsivity curve, wl in nm and responsivity in A/W
+        :gain(float): camera gain in e-/ADU, see ptc_analysis.fit_ptc
+        :channel(string): picoammeter column of the reference photodiode, 'Ch1' or 'Ch2'
+        :area_ratio(float): photons on the camera region per photon on the photodiode
+        :roi(tuple): (row start, row end, column start, column end) of the camera region, whole frame if None
+        :results_file(string): csv where results are kept, data_dir/qe_results.csv if None"""
+    def __init__(self,data_dir,path_format,responsivity,gain=1.0,channel='Ch1',area_ratio=1.0,roi=None,results_file=None):
+        self.data_dir=data_dir
+        self.path_format=path_format
+        self.responsivity=load_responsivity(responsivity)
+        self.gain=gain
+        self.channel=channel
+        self.area_ratio=area_ratio
+        self.roi=roi
+        self.results_file=results_file or os.path.join(data_dir,'qe_results.csv')
+        self.seen=set() #picoammeter files already indexed
+        self.pending={} #(filtnum, wl) to {imtype: index entry} for points still missing a file
+        if os.path.exists(self.results_file):
+            self.results=pd.read_csv(self.results_file)
+        else:
+            self.results=pd.DataFrame(columns=['wl','filtnum','exp_imno','dark_imno','exptime','pd_current','photon_rate','camera_rate','qe'])
+        self.done={(int(f),float(w)) for f,w in zip(self.results['filtnum'],self.results['wl'])}
+
+    def _exptime(self):
+        """Exposure time of each image number from the scan log, empty if the log is not there yet."""
+        for name in ('scan_log.jsonl','scan_log.csv'):
+            fn=os.path.join(self.data_dir,name)
+            if os.path.exists(fn):
+                log=pd.read_json(fn,lines=True) if name.endswith('.jsonl') else pd.read_csv(fn,index_col=0)
+                return dict(zip(log['imno'].astype(int),log['Exp_time'].astype(float)))
+        return {}
+
+    def index(self):
+        """Adds new picoammeter files to the index."""
+        for fn in sorted(glob.glob(os.path.join(self.data_dir,'picoa_*.csv'))):
+            if fn in self.seen:
+                continue
+            entry=parse_picoa_filename(fn)
+            if entry is None:
+                continue
+            self.seen.add(fn)
+            key=(entry['filtnum'],entry['wl'])
+            if key in self.done:
+                continue
+            entry['file']=fn
+            self.pending.setdefault(key,{})[entry['imtype']]=entry
+
+    def camera_signal(self,imno):
+        """Mean counts in the camera region of a frame."""
+        frame,bscale,bzero=reduction.open_frame(self.path_format.format(imno=imno))
+        if self.roi is not None:
+            r0,r1,c0,c1=self.roi
+            frame=frame[r0:r1,c0:c1]
+        return float(np.mean(frame,dtype=np.float64))*bscale+bzero
+
+    def process(self,key,exptimes):
+        """QE for one point from its exposure and dark.
+        Returns:
+            ::dictionary of results, None if a camera frame is not on disk yet"""
+        filtnum,wl=key
+        exp,dark=self.pending[key]['Exposure'],self.pending[key]['Dark']
+        frames=[self.path_format.format(imno=e['imno']) for e in (exp,dark)]
+        if not all(os.path.exists(fn) for fn in frames):
+            return None
+        exptime=exptimes.get(exp['imno'])
+        if exptime is None:
+            return None
+        current=pd.read_csv(exp['file'])[self.channel].mean()-pd.read_csv(dark['file'])[self.channel].mean()
+        photons=photon_rate(current,wl,self.responsivity)*self.area_ratio
+        electrons=(self.camera_signal(exp['imno'])-self.camera_signal(dark['imno']))*self.gain/exptime
+        return {'wl':wl,'filtnum':filtnum,'exp_imno':exp['imno'],'dark_imno':dark['imno'],'exptime':exptime,
+                'pd_current':current,'photon_rate':photons,'camera_rate':electrons,'qe':electrons/photons}
+
+    def update(self):
+        """Processes every point that became complete since the last call and saves the results.
+        Returns:
+            ::DataFrame of new results"""
+        self.index()
+        exptimes=self._exptime()
+        new=[]
+        for key in list(self.pending):
+            if {'Dark','Exposure'}<=set(self.pending[key]):
+                row=self.process(key,exptimes)
+                if row is not None:
+                    new.append(row)
+                    self.done.add(key)
+                    del self.pending[key]
+        new_df=pd.DataFrame(new,columns=self.results.columns)
+        if len(new_df):
+            self.results=pd.concat([self.results,new_df],ignore_index=True) if len(self.results) else new_df
+            self.results=self.results.sort_values(['filtnum','wl']).reset_index(drop=True)
+            self.results.to_csv(self.results_file,index=False)
+        return new_df
+
+    def qe_curve(self,filtnum=None):
+        """QE against wavelength.
+        Inputs:
+            :filtnum(integer): filter to return, all filters if None
+        Returns:
+            ::DataFrame of wl, filtnum and qe"""
+        res=self.results if filtnum is None else self.results[self.results['filtnum']==filtnum]
+        return res[['wl','filtnum','qe']].reset_index(drop=True)
@@ -0,0 +1,277 @@
+import os
+import functools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+"""Calibration frame reduction for NUVU and PIXIS images. Frames are memory-mapped and stacked in row chunks so memory stays bounded for hundreds of frames."""
+
+FITS_BLOCK=2880 #bytes, FITS headers and data are padded to this size
+FITS_DTYPES={8:'u1',16:'>i2',32:'>i4',64:'>i8',-32:'>f4',-64:'>f8'} #BITPIX to numpy type, FITS data is big endian
+STACK_COPIES={'median':2,'sigmaclip':4} #chunk sized arrays alive while combining, np.median partitions a copy, sigmaclip holds a copy, the deviation and the mask
+
+@functools.lru_cache(maxsize=1024)
+def read_fits_header(filename):
+    """Reads the primary header of a FITS file.
+    Inputs:
+        :filename(string): FITS file
+    Returns:
+        ::dictionary of header keywords
+        ::byte offset of the data"""
+    header={}
+    with open(filename,'rb') as fp:
+        nblocks=0
+        while True:
+            block=fp.read(FITS_BLOCK)
+            if len(block)<FITS_BLOCK:
+                raise ValueError(f"{filename} ended before the END card of the FITS header")
+            nblocks+=1
+            for i in range(0,FITS_BLOCK,80):
+                card=block[i:i+80].decode('ascii',errors='replace')
+                key=card[:8].strip()
+                if key=='END':
+                    return header,nblocks*FITS_BLOCK
+                if card[8:10]!='= ':
+                    continue
+                header[key]=card_value(card[10:])
+
+def card_value(text):
+    """Value of a FITS header card from column 11 on. Strings are read before the comment so slashes in them are kept.
+    Inputs:
+        :text(string): value and comment of the card
+    Returns:
+        ::string, boolean, integer, float or complex value, None for an empty value, the text itself if it cannot be read"""
+    text=text.strip()
+    if text.startswith("'"): #quote in a string is written twice
+        chars=[]
+        i=1
+        while i<len(text):
+            if text[i]=="'":
+                if text[i+1:i+2]!="'":
+                    break
+                i+=1
+            chars.append(text[i])
+            i+=1
+        return ''.join(chars).rstrip() #trailing spaces of a string are padding
+    value=text.split('/')[0].strip()
+    if value=='':
+        return None
+    if value in ('T','F'):
+        return value=='T'
+    number=value.upper().replace('D','E') #Fortran style double exponent
+    try:
+        return int(number)
+    except ValueError:
+        pass
+    try:
+        return float(number)
+    except ValueError:
+        pass
+    if number.startswith('(') and number.endswith(')'): #complex value (real, imaginary)
+        try:
+            real,imag=number[1:-1].split(',')
+            return complex(float(real),float(imag))
+        except ValueError:
+            pass
+    return value
+
+def open_frame(filename,index=0):
+    """Memory-maps one 2D frame without reading it into memory.
+    Inputs:
+        :filename(string): FITS file or .npy file
+        :index(integer): frame in a FITS file holding several frames (NAXIS3)
+    Returns:
+        ::memory-mapped array of shape (rows, columns), raw values without BSCALE/BZERO
+        ::BSCALE and BZERO for the frame"""
+    if filename.endswith('.npy'):
+        return np.load(filename,mmap_mode='r'),1.0,0.0
+    header,offset=read_fits_header(filename)
+    dtype=np.dtype(FITS_DTYPES[header['BITPIX']])
+    ncols,nrows=header['NAXIS1'],header['NAXIS2']
+    offset+=index*nrows*ncols*dtype.itemsize
+    frame=np.memmap(filename,dtype=dtype,mode='r',offset=offset,shape=(nrows,ncols))
+    return frame,float(header.get('BSCALE',1.0)),float(header.get('BZERO',0.0))
+
+def read_rows(filename,r0,r1,index=0):
+    """Reads rows r0 to r1 of a frame as float32 with BSCALE and BZERO applied."""
+    frame,bscale,bzero=open_frame(filename,index)
+    return np.asarray(frame[r0:r1],dtype=np.float32)*np.float32(bscale)+np.float32(bzero)
+
+def frame_shape(filename,index=0):
+    """Rows and columns of a frame."""
+    return open_frame(filename,index)[0].shape
+
+def frame_entry(entry):
+    """File name and frame index of a stack_frames entry, a file name or a (file name, index) pair."""
+    if isinstance(entry,(tuple,list)):
+        return entry[0],int(entry[1])
+    return entry,0
+
+def frames_in(filename):
+    """Every frame of a file as stack_frames entries, such as the frames of one PIXIS bias or dark acquisition.
+    Returns:
+        ::list of (file name, index)"""
+    if filename.endswith('.npy'):
+        return [(filename,0)]
+    header,offset=read_fits_header(filename)
+    nframes=header.get('NAXIS3',1) if header.get('NAXIS',2)>2 else 1
+    return [(filename,i) for i in range(nframes)]
+
+def combine(block,method='median',sigma=3.0,iters=3):
+    """Combines a stack of frame chunks along the first axis.
+    Inputs:
+        :block(array): frames x rows x columns
+        :method(string): 'median' or 'sigmaclip' for a sigma-clipped mean
+        :sigma(float): clipping limit in standard deviations
+        :iters(integer): clipping iterations
+    Returns:
+        ::combined rows x columns array"""
+    if method=='median':
+        return np.median(block,axis=0)
+    if method!='sigmaclip':
+        raise ValueError(f"Unknown stacking method {method}. Use 'median' or 'sigmaclip'")
+    block=block.copy()
+    for i in range(iters):
+        center=np.nanmedian(block,axis=0)
+        spread=np.nanstd(block,axis=0)
+        deviation=block-center
+        np.abs(deviation,out=deviation) #in place, one temporary
+        clip=deviation>sigma*spread
+        del deviation
+        if not clip.any():
+            break
+        block[clip]=np.nan
+    return np.nanmean(block,axis=0)
+
+def _stack_chunk(frames,r0,r1,method,sigma,iters,bias,scales):
+    """Worker for stack_frames. Reads the same rows from every frame and combines them."""
+    block=np.empty((len(frames),r1-r0,frame_shape(*frames[0])[1]),dtype=np.float32)
+    for i,(fn,index) in enumerate(frames):
+        block[i]=read_rows(fn,r0,r1,index)
+    if isinstance(bias,str):
+        bias=np.load(bias,mmap_mode='r')
+    if bias is not None:
+        block-=np.asarray(bias[r0:r1],dtype=np.float32)
+    if scales is not None:
+        block/=np.asarray(scales,dtype=np.float32)[:,None,None]
+    return r0,combine(block,method,sigma,iters).astype(np.float32)
+
+def chunk_rows_for(nframes,ncols,max_bytes=256*2**20,workers=1,copies=1):
+    """Rows per chunk so the chunks of all workers, with the copies each makes while combining, fit in max_bytes."""
+    return max(1,int(max_bytes//(workers*copies*nframes*ncols*4)))
+
+def stack_frames(filenames,method='median',sigma=3.0,iters=3,bias=None,scales=None,chunk_rows=None,workers=None,max_bytes=256*2**20):
+    """Stacks frames in row chunks, one chunk per worker process at a time.
+    Inputs:
+        :filenames(list): frames of the same shape, file names or (file name, index) pairs for files holding several frames
+        :method(string): 'median' or 'sigmaclip'
+        :sigma(float): clipping limit for 'sigmaclip'
+        :iters(integer): clipping iterations for 'sigmaclip'
+        :bias(array or string): master bias subtracted from each frame before stacking, array or .npy file
+        :scales(list): value each frame is divided by after bias subtraction, such as exposure times
+        :chunk_rows(integer): rows per chunk, chosen from max_bytes if None
+        :workers(integer): worker processes, all cores if None, 1 runs in this process
+        :max_bytes(integer): memory in bytes for the chunks of all worker processes, including the copies made by the stacking method
+    Returns:
+        ::stacked float32 frame"""
+    frames=[frame_entry(entry) for entry in filenames]
+    if len(frames)==0:
+        raise ValueError("No frames to stack")
+    nrows,ncols=frame_shape(*frames[0])
+    workers=workers or os.cpu_count() or 1
+    if chunk_rows is None:
+        chunk_rows=chunk_rows_for(len(frames),ncols,max_bytes,workers,STACK_COPIES.get(method,1))
+    master=np.empty((nrows,ncols),dtype=np.float32)
+    starts=range(0,nrows,chunk_rows)
+    jobs=[(frames,r0,min(r0+chunk_rows,nrows),method,sigma,iters,bias,scales) for r0 in starts] #a bias file name is mapped by each worker instead of copied
+    if workers==1:
+        results=(_stack_chunk(*job) for job in jobs)
+        for r0,rows in results:
+            master[r0:r0+len(rows)]=rows
+        return master
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures=[pool.submit(_stack_chunk,*job) for job in jobs]
+        for future in futures:
+            r0,rows=future.result()
+            master[r0:r0+len(rows)]=rows
+    return master
+
+def master_bias(filenames,output=None,method='median',**kwargs):
+    """Builds a master bias frame.
+    Inputs:
+        :filenames(list): bias frames, file names or (file name, index) pairs, see frames_in
+        :output(string): .npy file to save the master bias to
+        :method(string): 'median' or 'sigmaclip'
+    Returns:
+        ::master bias frame"""
+    master=stack_frames(filenames,method=method,**kwargs)
+    if output is not None:
+        np.save(output,master)
+    return master
+
+def master_dark(filenames,exptimes,bias,output=None,method='median',**kwargs):
+    """Builds a master dark rate frame in counts per second from bias subtracted darks.
+    Inputs:
+        :filenames(list): dark frames, file names or (file name, index) pairs, see frames_in
+        :exptimes(list or float): exposure time of each dark in seconds
+        :bias(array or string): master bias, array or .npy file
+        :output(string): .npy file to save the master dark to
+        :method(string): 'median' or 'sigmaclip'
+    Returns:
+        ::master dark rate frame"""
+    if np.isscalar(exptimes):
+        exptimes=[exptimes]*len(filenames)
+    if any(t<=0 for t in exptimes):
+        raise ValueError("Dark exposure times must be greater than zero")
+    master=stack_frames(filenames,method=method,bias=bias,scales=list(exptimes),**kwargs)
+    if output is not None:
+        np.save(output,master)
+    return master
+
+def calibrate_frame(filename,exptime,bias,dark=None,output=None,chunk_rows=256,index=0):
+    """Subtracts the master bias and the scaled master dark from a science frame one row chunk at a time.
+    Inputs:
+        :filename(string): science frame file
+        :exptime(float): exposure time of the science frame in seconds
+        :bias(array or string): master bias, array or .npy file
+        :dark(array or string): master dark rate, array or .npy file, no dark subtraction if None
+        :output(string): .npy file written through a memory map, result is kept in memory if None
+        :chunk_rows(integer): rows processed at a time
+        :index(integer): frame in a FITS file holding several frames (NAXIS3), see frames_in
+    Returns:
+        ::calibrated frame, memory-mapped when output is given"""
+    if isinstance(bias,str):
+        bias=np.load(bias,mmap_mode='r')
+    if isinstance(dark,str):
+        dark=np.load(dark,mmap_mode='r')
+    nrows,ncols=frame_shape(filename,index)
+    if output is not None:
+        result=np.lib.format.open_memmap(output,mode='w+',dtype=np.float32,shape=(nrows,ncols))
+    else:
+        result=np.empty((nrows,ncols),dtype=np.float32)
+    for r0 in range(0,nrows,chunk_rows):
+        r1=min(r0+chunk_rows,nrows)
+        rows=read_rows(filename,r0,r1,index)-np.asarray(bias[r0:r1],dtype=np.float32)
+        if dark is not None:
+            rows-=np.float32(exptime)*np.asarray(dark[r0:r1],dtype=np.float32)
+        result[r0:r1]=rows
+    if output is not None:
+        result.flush()
+    return result
+
+def frames_by_type(log_df,imtype,path_format):
+    """Frame files of one type from a scan log.
+    Inputs:
+        :log_df(DataFrame): scan log with imtype, imno and Exp_time columns, see nuvu.load_experiment_log
+        :imtype(string): 'Bias', 'Dark', 'Exposure' or 'Flat'
+        :path_format(string): file name pattern with an imno field, such as data_dir+'image_{imno:05d}.fits'
+    Returns:
+        ::list of file names
+        ::list of exposure times"""
+    rows=log_df[log_df['imtype']==imtype]
+    files,exptimes=[],[]
+    for imno,et in zip(rows['imno'],rows['Exp_time']):
+        fn=path_format.format(imno=int(imno))
+        if os.path.exists(fn): #frames still being written are left for the next call
+            files.append(fn)
+            exptimes.append(float(et))
+    return files,exptimes
@@ -0,0 +1,164 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import catalog
+import lazy
+pd=lazy.module('pandas') #imported on first use
+
+"""Loads a whole run folder of per-point picoammeter csv files (Ch1, Ch2, Elapsed_time) into one long table, with the filter, wavelength
+and dark flag of each point read from its file name. The files are read in worker processes, and the table can be saved as one compressed
+columnar file that later loads replace."""
+
+COLUMNS=['Ch1','Ch2','Elapsed_time'] #columns written by the picoammeter functions
+CHANNELS=['Ch1','Ch2']
+
+def read_point_csv(filename):
+    """Reads one picoammeter csv saved with DataFrame.to_csv, with or without the index column.
+    Returns:
+        ::array of samples x (Ch1, Ch2, Elapsed_time)"""
+    with open(filename) as fp:
+        lines=fp.read().split('\n')
+    header=lines[0].strip().split(',')
+    idx=[header.index(column) for column in COLUMNS]
+    rows=[line.split(',') for line in lines[1:] if line.strip()]
+    if not rows:
+        return np.empty((0,len(COLUMNS)))
+    return np.array(rows,dtype=float)[:,idx]
+
+def _read_chunk(filenames):
+    """Worker for load_run. Reads a list of files, the error message for a file that could not be read."""
+    out=[]
+    for filename in filenames:
+        try:
+            out.append(read_point_csv(filename))
+        except (OSError,ValueError,IndexError) as ex:
+            out.append(str(ex))
+    return out
+
+def point_files(run_directory):
+    """Data files in a run folder with their metadata.
+    Returns:
+        ::list of (file name, dictionary from catalog.parse_data_filename) sorted by file name"""
+    files=[]
+    for name in sorted(os.listdir(run_directory)):
+        info=catalog.parse_data_filename(name)
+        if info is not None and info['kind']!='frame_log':
+            files.append((name,info))
+    return files
+
+def converted_is_current(output,run_directory):
+    """True if a converted file exists and no csv in the run folder is newer."""
+    if not os.path.exists(output):
+        return False
+    mtime=os.path.getmtime(output)
+    if os.path.getmtime(run_directory)>mtime: #files added or removed
+        return False
+    return all(os.path.getmtime(os.path.join(run_directory,name))<=mtime for name,info in point_files(run_directory))
+
+def load_run(run_directory,output=None,workers=None,chunk_size=64,reload=False):
+    """Reads every point file of a run into a long table with one row per sample and channel.
+    Inputs:
+        :run_directory(string): run folder from PhotodiodeLinux.savefile or qe.get_qe_data
+        :output(string): .parquet or .npz file the table is saved to in the same pass, and loaded from next time while no csv is newer
+        :workers(integer): worker processes, all cores if None, 1 reads in this process
+        :chunk_size(integer): files read by a worker per task
+        :reload(boolean): read the csv files even if output is current
+    Returns:
+        ::DataFrame with file, imtype, filtnum, wl, dark, imno, sample, Elapsed_time, channel and current columns, plus date, lamp and slit
+        of the run when the folder name has them"""
+    if output is not None and not reload and converted_is_current(output,run_directory):
+        print(f"Loading {output}")
+        return read_converted(output)
+    t0=time.perf_counter()
+    files=point_files(run_directory)
+    names=[os.path.join(run_directory,name) for name,info in files]
+    chunks=[names[i:i+chunk_size] for i in range(0,len(names),chunk_size)]
+    if workers==1 or len(chunks)<2:
+        results=[_read_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results=list(pool.map(_read_chunk,chunks))
+    arrays=[]
+    keep=[]
+    for (name,info),data in zip(files,(data for chunk in results for data in chunk)):
+        if isinstance(data,str):
+            print(f"Error, could not read {name}. Error: {data}")
+            continue
+        arrays.append(data)
+        keep.append((name,info))
+    counts=np.array([len(data) for data in arrays],dtype=np.int64)
+    samples=np.concatenate(arrays) if arrays else np.empty((0,len(COLUMNS)))
+    point=np.repeat(np.arange(len(keep)),counts) #point of each sample
+    nchan=len(CHANNELS)
+    def expand(values,dtype=None):
+        """Per point values repeated for each sample and channel."""
+        values=np.array(values,dtype=object if dtype is None else dtype)
+        return np.repeat(values[point],nchan)
+    def missing(key):
+        return [np.nan if info[key] is None else info[key] for name,info in keep]
+    sample=np.concatenate([np.arange(n,dtype=np.int32) for n in counts]) if len(counts) else np.empty(0,dtype=np.int32)
+    table=pd.DataFrame({
+        'file':pd.Categorical.from_codes(np.repeat(point,nchan),[name for name,info in keep]),
+        'imtype':pd.Categorical(expand([info['imtype'] for name,info in keep])),
+        'filtnum':pd.array(expand(missing('filtnum'),float),dtype='Int8'),
+        'wl':expand(missing('wl'),float),
+        'dark':expand([bool(info['dark']) for name,info in keep],bool),
+        'imno':pd.array(expand(missing('imno'),float),dtype='Int32'),
+        'sample':np.repeat(sample,nchan),
+        'Elapsed_time':np.repeat(samples[:,2],nchan),
+        'channel':pd.Categorical.from_codes(np.tile(np.arange(nchan),len(samples)),CHANNELS),
+        'current':samples[:,:nchan].reshape(-1)}) #Ch1 and Ch2 of a sample are next to each other
+    run=catalog.parse_run_folder(os.path.basename(os.path.normpath(run_directory)))
+    if run is not None:
+        for key in ('date','lamp','slit'):
+            table[key]=pd.Categorical([run[key]]*len(table)) if isinstance(run[key],str) else run[key]
+    print(f"Read {len(keep)} files, {len(samples)} samples in {time.perf_counter()-t0:.2f} s")
+    if output is not None:
+        save_converted(table,output)
+    return table
+
+def save_converted(table,output):
+    """Saves a table from load_run as compressed columns, parquet (needs pyarrow) or numpy npz."""
+    if output.endswith('.parquet'):
+        try:
+            table.to_parquet(output,compression='zstd',index=False)
+        except ImportError as ex:
+            print(f"Error, could not save {output}, use a .npz file or install pyarrow. Error: {ex}")
+            return
+    elif output.endswith('.npz'):
+        columns={}
+        for column in table.columns:
+            values=table[column]
+            if hasattr(values,'cat'): #codes and categories
+                columns[column+'.codes']=values.cat.codes.to_numpy()
+                columns[column+'.categories']=np.array(values.cat.categories,dtype=str)
+            elif values.dtype.name in ('Int8','Int32'): #nullable integers, missing is -1
+                columns[column+'.int']=values.fillna(-1).to_numpy(dtype=np.int32)
+            else:
+                columns[column]=values.to_numpy()
+        np.savez_compressed(output,**columns)
+    else:
+        print(f"Error, could not save {output}. Use a .parquet or .npz file")
+        return
+    print(f"Saved {output}")
+
+def read_converted(filename):
+    """Reads a table saved by save_converted.
+    Returns:
+        ::DataFrame as returned by load_run"""
+    if filename.endswith('.parquet'):
+        return pd.read_parquet(filename)
+    table={}
+    with np.load(filename) as data:
+        for key in data.files:
+            column,_,part=key.partition('.')
+            if part=='codes':
+                table[column]=pd.Categorical.from_codes(data[key],data[column+'.categories'])
+            elif part=='int':
+                values=pd.array(data[key],dtype='Int32' if column=='imno' else 'Int8')
+                values[data[key]==-1]=pd.NA
+                table[column]=values
+            elif part=='':
+                table[column]=data[key]
+    return pd.DataFrame(table)
@@ -0,0 +1,123 @@
+import time
+import concurrent.futures
+
+"""Runs the steps of a scan point as a dependency graph. Each step starts as soon as the steps it depends on are finished, so operations on
+different devices, such as the grating and the filter wheel moves, overlap instead of running one after the other."""
+
+class Step:
+    """One operation of a scan point.
+    Inputs:
+        :name(string): unique name within the point
+        :func(function): called without arguments, its return value is kept in the report
+        :after(list): names of the steps that must finish first"""
+    def __init__(self,name,func,after=()):
+        self.name=name
+        self.func=func
+        self.after=[dep for dep in after if dep is not None]
+
+class PointReport:
+    """Timing of one scheduled point. Times are in s from the start of the point.
+    Inputs:
+        :label: point label, such as the wavelength
+        :steps(list): Step of the point"""
+    def __init__(self,label,steps):
+        self.label=label
+        self.after={step.name:step.after for step in steps}
+        self.results={}
+        self.start={}
+        self.end={}
+        self.wall=0.0
+
+    def duration(self,name):
+        return self.end[name]-self.start[name]
+
+    def serial(self):
+        """Time the point would have taken with the steps run one after the other."""
+        return sum(self.duration(name) for name in self.end)
+
+    def critical_path(self):
+        """Chain of steps that set the duration of the point, found by following the dependency that finished last back from the last step.
+        Returns:
+            ::list of step names, first step first"""
+        if not self.end:
+            return []
+        name=max(self.end,key=self.end.get)
+        path=[name]
+        while self.after[name]:
+            name=max(self.after[name],key=self.end.get)
+            path.insert(0,name)
+        return path
+
+    def summary(self):
+        path=self.critical_path()
+        steps=' > '.join(f"{name} {self.duration(name):.1f}s" for name in path)
+        return f"Point {self.label}: {self.wall:.1f} s (serial {self.serial():.1f} s), critical path {steps}"
+
+class StepScheduler:
+    """Runs the steps of each point on a thread pool. Steps that use the same device must depend on each other,
+    the pooled instrument sessions only stop two threads from talking to a device at the same time, not reorder them.
+    Inputs:
+        :max_workers(integer): steps run at the same time
+        :verbose(boolean): print the critical path of every point"""
+    def __init__(self,max_workers=4,verbose=True):
+        self.pool=concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,thread_name_prefix='step')
+        self.verbose=verbose
+        self.reports=[]
+
+    def run(self,steps,label=None):
+        """Runs the steps of one point and waits for all of them. If a step fails, the steps depending on it are not started
+        and the error is raised once the running steps have finished.
+        Inputs:
+            :steps(list): Step of the point
+            :label: point label used in the report
+        Returns:
+            ::PointReport"""
+        report=PointReport(label,steps)
+        waiting={step.name:step for step in steps}
+        for step in steps:
+            for dep in step.after:
+                if dep not in waiting:
+                    raise ValueError(f"Step {step.name} depends on unknown step {dep}")
+        t0=time.perf_counter()
+        def timed(step):
+            report.start[step.name]=time.perf_counter()-t0
+            try:
+                return step.func()
+            finally:
+                report.end[step.name]=time.perf_counter()-t0
+        running={}
+        error=None
+        while waiting or running:
+            if error is None:
+                for name in [name for name,step in waiting.items() if all(dep in report.results for dep in step.after)]:
+                    running[self.pool.submit(timed,waiting.pop(name))]=name
+            if not running:
+                if error is None: #nothing can start, the dependencies form a loop
+                    raise ValueError(f"Steps {list(waiting)} can not be scheduled")
+                break
+            finished,_=concurrent.futures.wait(running,return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name=running.pop(future)
+                try:
+                    report.results[name]=future.result()
+                except Exception as ex:
+                    if error is None:
+                        error=ex
+        report.wall=time.perf_counter()-t0
+        self.reports.append(report)
+        if error is not None:
+            raise error
+        if self.verbose:
+            print(report.summary())
+        return report
+
+    def summary(self):
+        """Totals over the points run so far.
+        Returns:
+            ::dictionary of points, wall time, serial time and time saved in s"""
+        wall=sum(report.wall for report in self.reports)
+        serial=sum(report.serial() for report in self.reports)
+        return {'points':len(self.reports),'wall':wall,'serial':serial,'saved':serial-wall}
+
+    def close(self):
+        self.pool.shutdown(wait=True)
@@ -1,9 +1,9 @@
-import serial
+import instruments
 import port_utils as pt
-import command
 
 """VCM D1 Shutter Controller commands for opening and closing shutter. Uses variables in command.py and port_utils.py."""
 
+@instruments.releases_ports
 def shutopen(shutterport):
     """
     Tests if VCM D1 shutter controller serial parameters are correct and if port is closed or open. Opens shutter and leaves open until close command sent. 
@@ -14,17 +14,11 @@ def shutopen(shutterport):
         ::error message due to improper connection"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=shutterport, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per VCMD1 manual. bits/sec
-                            timeout = None, #per VCMD1 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per VCMD1 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per VCMD1 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per VCMD1 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per VCMD1 manual. Number of data bits in transmission
-                            )
+        ser = instruments.serial_port(shutterport) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser connection for write command
         ser.write(b'@'); #ASCII command to open shutter sent as byte
+        ser.close() #hand the connection back to the pool
         msg = f"Shutter opened"
         print(msg)
         return
@@ -32,6 +26,7 @@ def shutopen(shutterport):
         msg = f"Error, could not establish communication, check serial connection Error: {ex}"
         print(msg)
         
+@instruments.releases_ports
 def shutclose(shutterport):
     """
     Tests if VCM D1 shutter controller serial parameters are correct and if port is closed or open. Closes shutter and leaves closed until open command sent.
@@ -42,17 +37,11 @@ def shutclose(shutterport):
         ::error message due to improper connection"""
     try:
         #serial communication settings. port variable may be changed depending on computer connected, but other settings must stay the same
-        ser = serial.Serial(port=shutterport, #string variable in command.py for shutter serial connection
-                            baudrate = 9600, #per VCMD1 manual. bits/sec
-                            timeout = None, #per VCMD1 manual. Add time when sending or recieveing transmissions
-                            xonxoff = True, #per VCMD1 manual. Software flow control between computer and device
-                            parity = serial.PARITY_NONE, #per VCMD1 manual. Checks if byte is even or odd
-                            stopbits = serial.STOPBITS_ONE, #per VCMD1 manual. Adds stop byte after transmission ends
-                            bytesize = serial.EIGHTBITS, #per VCMD1 manual. Number of data bits in transmission
-                            )      
+        ser = instruments.serial_port(shutterport) #pooled session shared by all functions, settings in instruments.SERIAL_SETTINGS
         ser.close() #close open ser connection
         ser.open() #open ser connection for write command
         ser.write(b'A'); #ASCII command to close shutter sent as a byte
+        ser.close() #hand the connection back to the pool
         msg = f"Shutter closed"
         print(msg)
         return
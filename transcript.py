@@ -0,0 +1,306 @@
+import json
+import time
+import threading
+import importlib
+import instruments
+
+"""Records the bytes sent to and received from every device port during a bench run, and plays them back in place of pyserial and PyVISA.
+With a replay the monochromator, filter wheel, shutter and picoammeter code runs on any computer without the hardware.
+A transcript is a JSON lines file: one header line, then one line per write or read with its time in s from the start of the recording."""
+
+DRIVER_MODULES=['monochromatorapi','fwapi','shutterapi','PhotodiodeLinux'] #modules whose time.sleep calls are scaled during a replay
+
+def encode(data):
+    return data.decode('latin-1') if isinstance(data,bytes) else data
+
+class TranscriptRecorder:
+    """Writes every write and read of the pooled sessions to a transcript while it is active.
+    Inputs:
+        :filename(string): transcript file, overwritten"""
+    def __init__(self,filename):
+        self.filename=filename
+        self.fp=None
+        self.start=None
+        self.lock=threading.Lock()
+
+    def __enter__(self):
+        if self.fp is not None: #already recording
+            return self
+        self.fp=open(self.filename,'w')
+        self.start=time.perf_counter()
+        self.fp.write(json.dumps({'transcript':1,'date':time.strftime('%Y-%m-%d %H:%M:%S')})+'\n')
+        instruments.get_registry().set_backend(self.open)
+        return self
+
+    def __exit__(self,*exc):
+        self.stop()
+
+    def stop(self):
+        """Closes the sessions and the transcript. Later connections go to the devices without recording."""
+        instruments.get_registry().set_backend(None)
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp=None
+
+    def open(self,kind,label,opener):
+        return RecordingConnection(opener(),kind,label,self)
+
+    def event(self,device,kind,op,data):
+        with self.lock:
+            if self.fp is not None:
+                self.fp.write(json.dumps({'t':round(time.perf_counter()-self.start,6),'device':device,'kind':kind,'op':op,'data':encode(data)})+'\n')
+
+class RecordingConnection:
+    """Serial or VISA connection that passes everything to the device and records writes and reads.
+    Inputs:
+        :conn: open serial.Serial or PyVISA resource
+        :kind(string): 'serial' or 'visa'
+        :device(string): device alias
+        :recorder(TranscriptRecorder): transcript written to"""
+    def __init__(self,conn,kind,device,recorder):
+        object.__setattr__(self,'conn',conn)
+        object.__setattr__(self,'kind',kind)
+        object.__setattr__(self,'device',device)
+        object.__setattr__(self,'recorder',recorder)
+
+    def __getattr__(self,name):
+        return getattr(self.conn,name)
+
+    def __setattr__(self,name,value):
+        setattr(self.conn,name,value)
+
+    def received(self,data):
+        if data:
+            self.recorder.event(self.device,self.kind,'read',data)
+        return data
+
+    def write(self,data):
+        n=self.conn.write(data)
+        self.recorder.event(self.device,self.kind,'write',data)
+        return n
+
+    def read(self,*args,**kwargs):
+        return self.received(self.conn.read(*args,**kwargs))
+
+    def read_until(self,*args,**kwargs):
+        return self.received(self.conn.read_until(*args,**kwargs))
+
+    def readline(self,*args,**kwargs):
+        return self.received(self.conn.readline(*args,**kwargs))
+
+    def readlines(self,*args,**kwargs):
+        lines=self.conn.readlines(*args,**kwargs)
+        self.received(b''.join(lines))
+        return lines
+
+    def query(self,cmd):
+        self.write(cmd)
+        return self.read()
+
+def load_transcript(filename):
+    """Reads a transcript.
+    Returns:
+        ::dictionary of device alias to list of events"""
+    devices={}
+    with open(filename) as fp:
+        for line in fp:
+            event=json.loads(line)
+            if 'device' in event:
+                devices.setdefault(event['device'],[]).append(event)
+    return devices
+
+class ReplayMismatch(Exception):
+    """A command sent during a replay is not the one in the transcript."""
+
+class ScaledTime:
+    """Stands in for the time module of the driver modules during a replay, with sleeps shortened by scale."""
+    def __init__(self,scale):
+        self.scale=scale
+
+    def __getattr__(self,name):
+        return getattr(time,name)
+
+    def sleep(self,seconds):
+        if self.scale>0:
+            time.sleep(seconds*self.scale)
+
+def scale_driver_sleeps(scale):
+    """Replaces the time module of the driver modules with ScaledTime(scale).
+    Returns:
+        ::dictionary of module name to its time module, for restore_driver_sleeps"""
+    patched={}
+    for name in DRIVER_MODULES:
+        module=importlib.import_module(name)
+        if not hasattr(module,'time'): #module does not sleep
+            continue
+        patched[name]=module.time
+        module.time=ScaledTime(scale)
+    return patched
+
+def restore_driver_sleeps(patched):
+    for name,original in patched.items():
+        importlib.import_module(name).time=original
+
+class TranscriptReplay:
+    """Plays a transcript back through the pooled sessions. Each device answers the commands sent to it with the responses recorded after
+    the same command. A command that differs from the recording is reported, or raises ReplayMismatch if strict, and the replay
+    continues from the next recorded copy of that command.
+    Inputs:
+        :filename(string): transcript file
+        :speed(float): None answers at once and skips the driver sleeps, 1 keeps the recorded timing, larger values run that much faster
+        :strict(boolean): raise ReplayMismatch on a command that is not in the recording"""
+    def __init__(self,filename,speed=None,strict=False):
+        self.filename=filename
+        self.devices=load_transcript(filename)
+        self.speed=speed
+        self.strict=strict
+        self.position={device:0 for device in self.devices} #index of the next event of each device
+        self.mismatches=[]
+        self.patched={}
+        self.lock=threading.Lock()
+
+    def __enter__(self):
+        if self.patched: #already replaying
+            return self
+        instruments.get_registry().set_backend(self.open)
+        self.patched=scale_driver_sleeps(0.0 if self.speed is None else 1.0/self.speed)
+        return self
+
+    def __exit__(self,*exc):
+        self.stop()
+
+    def stop(self):
+        """Puts back the real devices and time module."""
+        instruments.get_registry().set_backend(None)
+        restore_driver_sleeps(self.patched)
+        self.patched={}
+
+    def open(self,kind,label,opener):
+        if label not in self.devices:
+            raise ConnectionError(f"Device {label} is not in transcript {self.filename}")
+        return ReplayConnection(self,kind,label)
+
+    def wait(self,delay):
+        """Sleeps for delay s of replay time, already divided by speed."""
+        if self.speed is not None and delay>0:
+            time.sleep(delay)
+
+    def respond(self,device,data):
+        """Finds the command in the recording and returns its responses.
+        Returns:
+            ::list of (delay in s after the command, response data)"""
+        events=self.devices[device]
+        data=encode(data)
+        with self.lock:
+            idx=self.position[device]
+            while idx<len(events) and events[idx]['op']!='write': #responses nobody read this time
+                idx+=1
+            if idx>=len(events) or events[idx]['data']!=data:
+                found=next((i for i in range(idx,len(events)) if events[i]['op']=='write' and events[i]['data']==data),None)
+                msg=f"Replay of {device}: sent {data!r}, recording has {events[idx]['data']!r}" if idx<len(events) else f"Replay of {device}: sent {data!r} after the end of the recording"
+                self.mismatches.append(msg)
+                if self.strict:
+                    raise ReplayMismatch(msg)
+                print(msg)
+                if found is None:
+                    return []
+                idx=found
+            t0=events[idx]['t']
+            idx+=1
+            responses=[]
+            while idx<len(events) and events[idx]['op']=='read':
+                responses.append((events[idx]['t']-t0,events[idx]['data']))
+                idx+=1
+            self.position[device]=idx
+        return responses
+
+    def done(self):
+        """True if every recorded command was sent."""
+        return all(not any(event['op']=='write' for event in events[self.position[device]:]) for device,events in self.devices.items())
+
+class ReplayConnection:
+    """Serial or VISA connection that answers from a transcript.
+    Inputs:
+        :replay(TranscriptReplay): transcript played back
+        :kind(string): 'serial' or 'visa'
+        :device(string): device alias"""
+    def __init__(self,replay,kind,device):
+        self.replay=replay
+        self.kind=kind
+        self.device=device
+        self.is_open=True
+        self.buffer=b''
+        self.pending=[] #(time due, data) of responses not yet received
+        self.messages=[] #whole responses of a VISA device
+        self.write_termination=''
+        self.read_termination=''
+        self.resource_name=device
+
+    def close(self):
+        self.is_open=False
+
+    def write(self,data):
+        t=time.perf_counter()
+        self.pending=[(t+delay/self.replay.speed if self.replay.speed else t,response) for delay,response in self.replay.respond(self.device,data)]
+        if self.kind=='serial':
+            self.buffer=b''
+        return len(data)
+
+    def receive(self,count=None):
+        """Moves recorded responses into the buffer, waiting for their recorded time, until count bytes are there or the responses run out."""
+        while self.pending and (count is None or len(self.buffer)<count):
+            due,data=self.pending.pop(0)
+            self.replay.wait(due-time.perf_counter() if self.replay.speed else 0)
+            if self.kind=='visa':
+                self.messages.append(data)
+            else:
+                self.buffer+=data.encode('latin-1')
+
+    def take(self,n):
+        data,self.buffer=self.buffer[:n],self.buffer[n:]
+        return data
+
+    def read(self,size=1):
+        if self.kind=='visa':
+            self.receive()
+            return self.messages.pop(0) if self.messages else ''
+        self.receive(size)
+        return self.take(size)
+
+    def read_until(self,expected=b'\n',size=None):
+        while expected not in self.buffer and (size is None or len(self.buffer)<size) and self.pending:
+            self.receive(len(self.buffer)+1)
+        end=self.buffer.find(expected)
+        n=len(self.buffer) if end<0 else end+len(expected)
+        return self.take(n if size is None else min(n,size))
+
+    def readline(self):
+        return self.read_until(b'\n')
+
+    def readlines(self):
+        self.receive()
+        data=self.take(len(self.buffer))
+        return data.splitlines(keepends=True)
+
+    def query(self,cmd):
+        self.write(cmd)
+        return self.read()
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.buffer=b''
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)+sum(len(data) for due,data in self.pending if due<=time.perf_counter())
+
+def record(filename):
+    """Starts recording all device traffic to a transcript. Use as a with block or call stop() on the returned recorder."""
+    return TranscriptRecorder(filename).__enter__()
+
+def replay(filename,speed=None,strict=False):
+    """Starts answering all device traffic from a transcript. Use as a with block or call stop() on the returned replay."""
+    return TranscriptReplay(filename,speed,strict).__enter__()